@@ -1,88 +1,490 @@
 # Import necessary libraries and modules
+import logging
 import os
-import json
-from flask import Flask, request
-from twilio.rest import Client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request
 from twilio.twiml.messaging_response import MessagingResponse
-import tensorflow as tf
 import numpy as np
 import PIL
 from PIL import Image
 import io
 import requests
 from dotenv import load_dotenv
-import imghdr
+from inference import BatchingEngine, InferenceError
+from interpreter_pool import InterpreterPool
+from model_export import model_filename
+from async_replies import ReplyDispatcher
+from preprocessing import INPUT_SIZE, TTA_VIEWS, ImageDecodeError, prepare_image, to_input_array, tta_views
+from kvstore import open_store
+from prediction_cache import PredictionCache
+from plant_profiles import PlantProfileStore
+from session_store import SessionStore
+from tracing import end_trace, server_timing, stage, start_trace
+from metrics import Metrics
+from calibration import FUSION_METHODS, Calibration, calibration_filename
+from downloader import MediaDownloader, HTTPStatusError, NotAnImageError, UnrecognisedImageError, MediaTooLargeError
 
 # Load environment variables from a .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize the Flask application
 app = Flask(__name__)
 
-# Load the TFLite model for plant identification
-interpreter = tf.lite.Interpreter(model_path="dr_roots_model.tflite")
-interpreter.allocate_tensors()
-
-# Load the class mapping from a JSON file
-with open('class_mapping.json', 'r') as f:
-    class_mapping = json.load(f)
-
-# Load plant information from a JSON file
-with open('plant_data.json', 'r', encoding='utf-8') as f:
-    plant_info = json.load(f)
+# Optionally time each request's stages (session, download, decode, cache,
+# inference, format) and return them in a Server-Timing header, as read by
+# benchmarks/load_test.py
+REQUEST_TRACING = os.getenv('REQUEST_TRACING', 'false').lower() in ('1', 'true', 'yes')
+
+# Optionally export stage and request latency, image outcomes and prediction
+# confidence on /metrics. Needs prometheus_client; with several gunicorn workers
+# also set PROMETHEUS_MULTIPROC_DIR
+METRICS_ENABLED = os.getenv('METRICS', 'false').lower() in ('1', 'true', 'yes')
+metrics = Metrics() if METRICS_ENABLED else None
+
+if REQUEST_TRACING or METRICS_ENABLED:
+    @app.before_request
+    def begin_request_trace():
+        g.request_started = time.perf_counter()
+        start_trace()
+
+    @app.after_request
+    def finish_request_trace(response):
+        trace = end_trace() or {}
+        if REQUEST_TRACING and trace:
+            response.headers['Server-Timing'] = server_timing(trace)
+        if metrics is not None:
+            metrics.observe_trace(trace)
+            metrics.observe_request(request.endpoint, time.perf_counter() - g.request_started)
+        return response
+
+def count_outcome(outcome):
+    if metrics is not None:
+        metrics.count_outcome(outcome)
+
+# Pool of TFLite interpreters for plant identification that share one copy of
+# the model, one interpreter per concurrent request thread. The interpreter
+# runtime is loaded on first use, or by preload() in the gunicorn
+# master when running with --preload
+INTERPRETER_POOL_SIZE = int(os.getenv('INTERPRETER_POOL_SIZE', os.getenv('GUNICORN_THREADS', 1)))
+INTERPRETER_NUM_THREADS = int(os.getenv('INTERPRETER_NUM_THREADS', 1))
+
+# Which exported variant to serve: float32, dynamic, int8 or float16
+MODEL_VARIANT = os.getenv('MODEL_VARIANT', 'float32')
+
+interpreter_pool = InterpreterPool(
+    model_filename(MODEL_VARIANT),
+    size=INTERPRETER_POOL_SIZE,
+    num_threads=INTERPRETER_NUM_THREADS
+)
+
+# Without INFERENCE_BATCHING, TTA views and multi-photo messages run on a second
+# pool whose interpreters stay at one batch size (a photo's other TTA views), so
+# neither they nor the batch-1 interpreters above are ever resized. Its
+# interpreters are built on first use like the others
+BATCH_POOL_SIZE = int(os.getenv('BATCH_POOL_SIZE', INTERPRETER_POOL_SIZE))
+
+batch_pool = InterpreterPool(
+    model_filename(MODEL_VARIANT),
+    size=BATCH_POOL_SIZE,
+    num_threads=INTERPRETER_NUM_THREADS,
+    batch_size=len(TTA_VIEWS) - 1
+)
+
+# Temperature and per-class confidence cutoffs fitted for this model in
+# dr_roots.py (dr_roots_model*.calibration.json). Without the file every class
+# needs 0.7, as before
+calibration = Calibration.load(calibration_filename(model_filename(MODEL_VARIANT)))
+
+# Optionally name the two likeliest plants when they are too close to call,
+# instead of asking for another photo
+TOP2_REPLIES = os.getenv('TOP2_REPLIES', 'false').lower() in ('1', 'true', 'yes')
+TOP2_MARGIN = float(os.getenv('TOP2_MARGIN', 0.2))
+
+# Optionally take a second look at uncertain photos with test-time augmentation:
+# when the first prediction's calibrated confidence is within
+# [TTA_MIN_CONFIDENCE, TTA_MAX_CONFIDENCE), the photo's mirror image and centre
+# and corner crops are run too, as one batch, and every view's scores are
+# averaged. Photos outside the band,
+# clearly identified or hopeless, cost one inference as before
+TTA_ENABLED = os.getenv('TTA', 'false').lower() in ('1', 'true', 'yes')
+TTA_MIN_CONFIDENCE = float(os.getenv('TTA_MIN_CONFIDENCE', 0.4))
+TTA_MAX_CONFIDENCE = float(os.getenv('TTA_MAX_CONFIDENCE', 0.7))
+
+# Messages with several photos (e.g. different angles of one leaf) are answered
+# together: the photos are downloaded at once on this pool, run through the
+# model in one batch and their scores fused (mean or log) into one answer
+MAX_MEDIA_PER_MESSAGE = int(os.getenv('MAX_MEDIA_PER_MESSAGE', 10))
+MEDIA_FUSION = os.getenv('MEDIA_FUSION', 'mean')
+if MEDIA_FUSION not in FUSION_METHODS:
+    raise ValueError(f"MEDIA_FUSION must be one of {FUSION_METHODS}, got {MEDIA_FUSION!r}")
+
+media_executor = ThreadPoolExecutor(max_workers=int(os.getenv('MEDIA_DOWNLOAD_WORKERS', 4)),
+                                    thread_name_prefix='media')
+
+# Optionally group concurrent predictions into dynamic batches that run on the
+# pooled interpreters
+BATCHING_ENABLED = os.getenv('INFERENCE_BATCHING', 'false').lower() in ('1', 'true', 'yes')
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 5))
+# Batches are padded to one of these sizes (1 and BATCH_MAX_SIZE by default), e.g. '8'
+BATCH_SIZES = [int(size) for size in os.getenv('BATCH_SIZES', '').split(',') if size.strip()] or None
+
+batching_engine = None
+if BATCHING_ENABLED:
+    batching_engine = BatchingEngine(interpreter_pool, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                                     batch_sizes=BATCH_SIZES)
+
+# Optionally crop photos to the leaf before resizing them for the model. Needs
+# opencv-python-headless, so check for it now rather than on the first photo
+CROP_TO_LEAF = os.getenv('CROP_TO_LEAF', 'false').lower() in ('1', 'true', 'yes')
+if CROP_TO_LEAF:
+    import remove_background
+
+# Load plant information and the class mapping, indexing profiles by model class
+# and by name, and make sure every class the model can predict has a profile
+plant_profiles = PlantProfileStore.from_files('plant_data.json', 'class_mapping.json')
+plant_profiles.validate()
 
 # Get Twilio credentials from environment variables
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
-# Initialize the Twilio client
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-# Dictionary to track user states for conversation flow
-user_states = {}
+# The Twilio REST client is only needed to send replies out-of-band, so it (and
+# its sizeable import) is created on first use
+twilio_client = None
+
+def get_twilio_client():
+    global twilio_client
+    if twilio_client is None:
+        from twilio.rest import Client
+
+        # Optionally point the client at a local stub of the API
+        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        if os.getenv('TWILIO_API_BASE_URL'):
+            client.api.base_url = os.getenv('TWILIO_API_BASE_URL')
+        twilio_client = client
+    return twilio_client
+
+# Shared downloader for Twilio media, keeping connections to the media host alive
+downloader = MediaDownloader(
+    auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+    max_bytes=int(os.getenv('MEDIA_MAX_BYTES', 10 * 1024 * 1024)),
+    connect_timeout=float(os.getenv('MEDIA_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('MEDIA_READ_TIMEOUT', 10)),
+    retries=int(os.getenv('MEDIA_RETRIES', 2))
+)
+
+# Cache predictions for repeated images. memory:// is per worker, use
+# sqlite:///prediction_cache.db or redis://... to share hits between workers
+PREDICTION_CACHE_URL = os.getenv('PREDICTION_CACHE_URL', 'memory://')
+
+prediction_cache = None
+if PREDICTION_CACHE_URL:
+    prediction_cache = PredictionCache(
+        open_store(PREDICTION_CACHE_URL, max_entries=int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 10000)), name='predictions'),
+        namespace=MODEL_VARIANT + ('-crop' if CROP_TO_LEAF else '') + ('-tta' if TTA_ENABLED else ''),
+        ttl=float(os.getenv('PREDICTION_CACHE_TTL', 7 * 24 * 3600)),
+        perceptual=os.getenv('PREDICTION_CACHE_PERCEPTUAL', 'false').lower() in ('1', 'true', 'yes')
+    )
+
+# Conversation state per user. memory:// is per worker, use sqlite:///sessions.db
+# or redis://... so a user's state survives their next message landing on
+# another worker
+SESSION_STORE_URL = os.getenv('SESSION_STORE_URL', 'memory://')
+
+user_sessions = SessionStore(
+    open_store(SESSION_STORE_URL, max_entries=int(os.getenv('SESSION_MAX_USERS', 10000)), name='sessions'),
+    ttl=float(os.getenv('SESSION_TTL', 24 * 3600))
+)
+
+# With metrics on, remember for RETRY_WINDOW seconds which users were last told
+# their photo could not be identified, so the photo they send next is counted
+# as a retry
+RETRY_WINDOW = float(os.getenv('RETRY_WINDOW', 600))
+
+unidentified_images = None
+if metrics is not None:
+    unidentified_images = open_store(SESSION_STORE_URL, max_entries=int(os.getenv('SESSION_MAX_USERS', 10000)),
+                                     ttl=RETRY_WINDOW, name='unidentified_images')
+
+def preload():
+    # Called from gunicorn's when_ready hook with --preload: import the
+    # interpreter runtime once in the master, before workers fork
+    interpreter_pool.load()
+    batch_pool.load()
+
+# Per-thread float32 input buffers for the batching engine, reused across requests
+input_buffers = threading.local()
 
 def predict_image(image):
-    # Preprocess the image
-    image = image.resize((224, 224))
-    image_array = np.array(image) / 255.0
-    image_array = np.expand_dims(image_array, axis=0).astype(np.float32)
-
-    # Set the input tensor
-    input_details = interpreter.get_input_details()
-    interpreter.set_tensor(input_details[0]['index'], image_array)
-
-    # Run inference
-    interpreter.invoke()
-
-    # Get the output tensor
-    output_details = interpreter.get_output_details()
-    output_data = interpreter.get_tensor(output_details[0]['index'])
-
-    # Get the predicted class and confidence
-    predicted_class = np.argmax(output_data)
-    confidence = output_data[0][predicted_class]
-
-    return predicted_class, confidence
+    # Decode and resize before checking out an interpreter
+    image = prepare_image(image, crop=CROP_TO_LEAF)
+
+    with stage('inference'):
+        if batching_engine is not None:
+            # Scale into this thread's buffer and queue it for the next batch
+            image_array = getattr(input_buffers, 'array', None)
+            if image_array is None:
+                image_array = input_buffers.array = np.empty((*INPUT_SIZE, 3), dtype=np.float32)
+            probabilities = batching_engine.predict(to_input_array(image, out=image_array))
+        else:
+            # Scale straight into the interpreter's input tensor and run it
+            with interpreter_pool.acquire() as runner:
+                runner.write_input(lambda view: to_input_array(image, out=view[0]))
+                probabilities = runner.invoke()[0]
+
+    if needs_views(probabilities):
+        probabilities = predict_views(image, probabilities)
+
+    # The model's (uncalibrated) score for every class
+    return probabilities
+
+def needs_views(probabilities):
+    # Whether a first prediction is uncertain enough for TTA. Every path that
+    # predicts a photo applies this, so a cached prediction means the same
+    # thing however it got there
+    return TTA_ENABLED and TTA_MIN_CONFIDENCE <= calibration.calibrate(probabilities).max() < TTA_MAX_CONFIDENCE
+
+def predict_views(image, probabilities):
+    # Run the other TTA views of a prepared image and average them with the
+    # first pass's probabilities
+    views = TTA_VIEWS[1:]
+    with stage('tta'):
+        if batching_engine is not None:
+            # Queued together, so they share one of the engine's fixed-size batches
+            outputs = batching_engine.predict_many(tta_views(image, views))
+        else:
+            # Every view written straight into the input of an interpreter
+            # already sized for them, and run in one invoke
+            with batch_pool.acquire() as runner:
+                runner.write_input(lambda view: tta_views(image, views, out=view), batch_size=batch_pool.batch_size)
+                outputs = runner.invoke()
+    return (probabilities + outputs.sum(axis=0)) / (len(views) + 1)
+
+def predict_images(images):
+    # (N, num_classes) uncalibrated scores for prepared images, run in batches,
+    # then TTA for the uncertain ones as predict_image does. A single photo
+    # goes through predict_image instead of a mostly padded batch
+    if len(images) == 1:
+        return predict_image(images[0])[np.newaxis]
+
+    with stage('inference'):
+        if batching_engine is not None:
+            outputs = batching_engine.predict_many([to_input_array(image) for image in images])
+        else:
+            # In chunks of the batch pool's size, the last one zero-padded
+            size = batch_pool.batch_size
+            outputs = []
+            with batch_pool.acquire() as runner:
+                for start in range(0, len(images), size):
+                    chunk = images[start:start + size]
+
+                    def fill(view):
+                        for i, image in enumerate(chunk):
+                            to_input_array(image, out=view[i])
+                        view[len(chunk):] = 0
+
+                    runner.write_input(fill, batch_size=size)
+                    outputs.append(runner.invoke()[:len(chunk)])
+            outputs = np.concatenate(outputs)
+
+    for i, image in enumerate(images):
+        if needs_views(outputs[i]):
+            outputs[i] = predict_views(image, outputs[i])
+    return outputs
+
+def load_media(media_url):
+    # Download and decode one attachment. Returns (image_data, image,
+    # probabilities), with probabilities None unless the prediction cache had
+    # the same (or, with perceptual hashing, a recompressed) image
+    with stage('download'):
+        download = downloader.download(media_url)
+    image_data = download.data
+
+    if prediction_cache is not None:
+        with stage('cache'):
+            probabilities = prediction_cache.get(image_data)
+        if probabilities is not None:
+            return image_data, None, probabilities
+
+    with stage('decode'):
+        try:
+            image = prepare_image(Image.open(io.BytesIO(image_data)), crop=CROP_TO_LEAF)
+        except PIL.UnidentifiedImageError:
+            raise
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageDecodeError(str(e)) from e
+
+    probabilities = None
+    if prediction_cache is not None:
+        with stage('cache'):
+            probabilities = prediction_cache.get_similar(image)
+    return image_data, image, probabilities
+
+def load_all_media(media_urls):
+    # load_media for every attachment, several at once on the media pool (whose
+    # threads are not traced, so the whole fan-out is timed as 'download').
+    # Returns (media, skipped): attachments that fail are logged and counted in
+    # skipped while any succeed, otherwise the first failure is raised
+    if len(media_urls) == 1:
+        return [load_media(media_urls[0])], 0
+
+    with stage('download'):
+        futures = [media_executor.submit(load_media, url) for url in media_urls]
+        media, errors = [], []
+        for future in futures:
+            try:
+                media.append(future.result())
+            except Exception as e:
+                errors.append(e)
+    if not media:
+        raise errors[0]
+    for e in errors:
+        logger.warning("Skipped an attachment of a %d-photo message: %r", len(media_urls), e)
+    return media, len(errors)
+
+def predict_media(media):
+    # (N, num_classes) uncalibrated scores for load_media results, running every
+    # image without a cached prediction in a single batch
+    results = [probabilities for _, _, probabilities in media]
+    uncached = [i for i, probabilities in enumerate(results) if probabilities is None]
+    if uncached:
+        outputs = predict_images([media[i][1] for i in uncached])
+        for i, probabilities in zip(uncached, outputs):
+            results[i] = probabilities
+            if prediction_cache is not None:
+                with stage('cache'):
+                    prediction_cache.put(media[i][0], media[i][1], probabilities)
+    return np.stack(results)
 
 def get_plant_info(plant_name):
-    for plant in plant_info:
-        if plant['Scientific Name'] == plant_name:
-            # Format citations on a new line each
-            citations = "\n".join(plant['Citations'])
-
-            info = (
-                f"🌿 *Plant Profile: {plant['Common Name']}* 🌿\n"
-                f"- Scientific Name: {plant['Scientific Name']}\n"
-                f"- Shona Name: {plant['Shona Name']}\n"
-                f"\n🍃 What it looks like: \n{plant['Physical Description']}\n"
-                f"\n💊 Reported Medicinal Uses: \n{plant['Reported Medicinal Uses']}\n"
-                f"\n🧪 How it's prepared & used: \n{plant['Preparation Methods & Parts Used']}\n"
-                f"\n🌱 Conservation Status (on the IUCN Red List): {plant['IUCN Red List of Threatened Species']}\n"
-                f"\n📚 Want to learn more? Check out these papers: \n{citations}"
-            )
-            return info
-    return "Plant not found in database"
+    profile = plant_profiles.by_name(plant_name)
+    if profile is None:
+        return "Plant not found in database"
+    return profile.message
+
+def near_tie_reply(ranked):
+    # Name both plants with what they look like, so the user can tell them
+    # apart without sending another photo
+    lines = []
+    for predicted_class, confidence in ranked:
+        profile = plant_profiles.by_class(predicted_class)
+        lines.append(f"🌿 *{profile.data['Common Name']}* ({profile.scientific_name}), {confidence*100:.1f}%\n{profile.data['Physical Description']}")
+    options = "\n\n".join(lines)
+    return f"*It's a close call! 🔍 This looks like one of these two plants:*\n\n{options} \n\nType 'Menu' and choose 1 to read either plant's full profile, or 'Exit' to end the conversation."
+
+def reply_to_media(media_urls):
+    # Download the images, run a prediction and build the reply text. Returns
+    # (outcome, reply), the outcome being one of metrics.OUTCOMES
+    try:
+        # Download the images, checking each is an image as it streams
+        media, skipped = load_all_media(media_urls)
+
+        # Make a prediction for every photo, fuse them into one and compare the
+        # calibrated confidence with the predicted class's cutoff
+        probabilities = predict_media(media)
+        decision, ranked = calibration.decide(probabilities, TOP2_MARGIN if TOP2_REPLIES else None, MEDIA_FUSION)
+        predicted_class, confidence = ranked[0]
+        if metrics is not None:
+            metrics.observe_confidence(confidence)
+
+        if decision == 'identified':
+            # Get the predicted plant name and information
+            with stage('format'):
+                profile = plant_profiles.by_class(predicted_class)
+                plant_name = profile.scientific_name
+                info = profile.message
+
+                photos = f" Going by your {len(media)} photos," if len(media) > 1 else ""
+                if skipped:
+                    # Say which answer this is when some photos were left out
+                    photos = f" Going by {len(media)} of your {len(media) + skipped} photos ({skipped} couldn't be read),"
+                return 'identified', f"*Leaf it to me! 🔍{photos} I'm {confidence*100:.1f}% confident this is {plant_name}!* 🌿\n\n{info} \n\nYou can type 'Menu' to start over or 'Exit' to end the conversation."
+
+        if decision == 'near_tie':
+            with stage('format'):
+                return 'near_tie', near_tie_reply(ranked)
+
+        # Low confidence in prediction
+        return 'low_confidence', "I'm not confident enough to identify this plant. Please try another image. \n\nYou can type 'Menu' to start over or 'Exit' to end the conversation."
+
+    except HTTPStatusError as e:
+        # Failed to download the image
+        return 'download_failed', f"Failed to download image. HTTP status code: {e.status_code}"
+    except NotAnImageError:
+        # URL does not point to an image
+        return 'not_an_image', "The URL does not point to a valid image. Please try sending an image."
+    except UnrecognisedImageError:
+        # Image format not recognized
+        return 'unrecognised_format', "Sorry, the image format is not recognized. Please try a different image."
+    except MediaTooLargeError:
+        # Image is over the download size cap
+        return 'too_large', "Sorry, that image is too large. Please send a smaller photo."
+    except requests.exceptions.RequestException as e:
+        # Error occurred during image download
+        return 'download_failed', f"Sorry, I had trouble downloading the image. Error: {str(e)}"
+    except PIL.UnidentifiedImageError:
+        # Image format not supported
+        return 'unrecognised_format', "Sorry, the image format is not supported. Please try a different image."
+    except ImageDecodeError:
+        # Recognised as an image but truncated or corrupt
+        return 'decode_failed', "Sorry, I couldn't read that image, it may be damaged. Please try sending it again."
+    except InferenceError as e:
+        # TensorFlow Lite error during image processing
+        return 'model_error', f"There was an error processing the image with TensorFlow Lite. Error: {str(e)}"
+    except Exception as e:
+        # Unexpected error occurred
+        logger.exception("Unexpected error processing media")
+        return 'error', f"Sorry, there was an unexpected error processing your image. Error: {str(e)}"
+
+def process_media(media_urls, user=None):
+    # Reply text for an image message (one or more attachment URLs) from user,
+    # counting its outcome and whether it retries an image that was just turned away
+    if isinstance(media_urls, str):
+        media_urls = [media_urls]
+    if unidentified_images is not None and user:
+        previous = unidentified_images.get(user)
+        if previous is not None:
+            metrics.count_retry(previous)
+
+    outcome, reply = reply_to_media(media_urls)
+    count_outcome(outcome)
+
+    if unidentified_images is not None and user:
+        if outcome == 'identified':
+            unidentified_images.delete(user)
+        else:
+            unidentified_images.set(user, outcome, ttl=RETRY_WINDOW)
+    return reply
+
+def send_message(to_number, body):
+    # Deliver a reply outside of the webhook response
+    get_twilio_client().messages.create(from_=TWILIO_PHONE_NUMBER, to=to_number, body=body)
+
+# Optionally answer image messages asynchronously: the webhook acks at once and a
+# background pool downloads, predicts and sends the result via the REST API
+ASYNC_REPLIES = os.getenv('ASYNC_REPLIES', 'false').lower() in ('1', 'true', 'yes')
+ASYNC_WORKERS = int(os.getenv('ASYNC_WORKERS', 4))
+ASYNC_MAX_QUEUE = int(os.getenv('ASYNC_MAX_QUEUE', 32))
+
+def process_media_traced(media_urls, user=None):
+    # process_media for the background pool, traced so its stages reach the
+    # metrics even though the webhook request has already returned
+    start_trace()
+    try:
+        return process_media(media_urls, user)
+    finally:
+        metrics.observe_trace(end_trace() or {})
+
+reply_dispatcher = None
+if ASYNC_REPLIES:
+    reply_dispatcher = ReplyDispatcher(process_media_traced if metrics is not None else process_media, send_message,
+                                       max_workers=ASYNC_WORKERS, max_queue=ASYNC_MAX_QUEUE)
 
 @app.route('/')
 def home():
@@ -183,6 +585,124 @@ def home():
 </html>
     """
 
+@app.route('/ready')
+def ready():
+    # Readiness check that builds and warms the interpreters this worker does
+    # not have yet. It never waits for interpreters serving requests, and a
+    # probe that arrives while another is still building reports 'loading'
+    # instead of waiting for it
+    started = time.perf_counter()
+    pools = [interpreter_pool] if batching_engine is not None else [interpreter_pool, batch_pool]
+    try:
+        loaded = all([pool.warm(timeout=0) for pool in pools])
+    except Exception as e:
+        return {'ready': False, 'error': str(e)}, 503
+    status = {
+        'ready': loaded,
+        'pool_size': interpreter_pool.size,
+        'pool_available': interpreter_pool.available(),
+        'batch_pool_available': batch_pool.available(),
+        'warm_ms': (time.perf_counter() - started) * 1000.0,
+    }
+    if not loaded:
+        return {**status, 'error': 'loading'}, 503
+    return status
+
+@app.route('/stats')
+def stats():
+    # Throughput and latency counters for the inference engine and reply queue
+    stats = {
+        'pool_size': interpreter_pool.size,
+        'pool_available': interpreter_pool.available(),
+        'batch_pool_available': batch_pool.available(),
+        'batching': batching_engine is not None,
+    }
+    if batching_engine is not None:
+        stats.update(batching_engine.stats())
+    if reply_dispatcher is not None:
+        stats['async_replies'] = reply_dispatcher.stats()
+    stats['downloads'] = downloader.stats()
+    if prediction_cache is not None:
+        stats['prediction_cache'] = prediction_cache.stats()
+    return stats
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus scrape endpoint, only served with METRICS=true
+    if metrics is None:
+        return {'error': 'metrics are disabled, set METRICS=true'}, 404
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+# Main menu shown to new users and whenever input is not recognised
+WELCOME_MESSAGE = "🌿 *Welcome to Doctor Roots!* 🌿 \n\nI'm your friendly medicinal plant bot.\n\n📸*Send me a clear photo of a plant - I'll try to identify it and share fun facts about it!*📸\n\nOr choose one of these options:\n1️⃣ Learn more about other plants\n2️⃣ Contact the developer\n\n🚨Important Disclaimer🚨\nThe information disseminated here is for educational purposes only and should not be taken as medical advice."
+
+# Plants offered in the 'Learn more' list, in menu order
+PLANT_CHOICES = [
+    "Catharanthus roseus",
+    "Psidium guajava",
+    "Zingiber officinale Roscoe",
+    "Citrus limon",
+    "Mangifera indica",
+    "Moringa oleifera Lour",
+    "Aloe barbadensis"
+]
+
+def handle_message(state, incoming_msg, num_media):
+    # Work out the user's next state and the reply for a message. A next state
+    # of None ends the session; a reply of None means the attached image should
+    # be processed. This runs inside the session store's atomic transition, so
+    # it must stay quick and free of I/O
+
+    # Initialize user state if this is the first interaction with the number
+    if state is None:
+        state = 'menu'
+
+    # If the message is 'menu' or 'start over', reset the user state to the menu
+    if incoming_msg in ['menu', 'start over']:
+        return 'menu', WELCOME_MESSAGE
+    elif incoming_msg in ['exit', 'end']:
+        # If the message is 'exit' or 'end', remove the user from the state tracking and thank them
+        return None, "Thank you for trying out Doctor Roots! If you have any feedback or questions, feel free to reach out. Have a great day!"
+
+    # If the user is in the menu state, send the main menu message and change state to default
+    if state == 'menu':
+        return 'default', WELCOME_MESSAGE
+
+    # If there are media files in the message, process them
+    if num_media > 0:
+        return state, None
+
+    if state == 'default':
+        if incoming_msg == '1':
+            # List of plants to learn about
+            plant_list = "\n".join([
+                "1️⃣ Madagascar Periwinkle",
+                "2️⃣ Guava",
+                "3️⃣ Ginger",
+                "4️⃣ Lemon",
+                "5️⃣ Mango",
+                "6️⃣ Moringa",
+                "7️⃣ Aloe vera"
+            ])
+            return 'selecting_plant', f"🌿 *Eeny, meeny, miny, grow!* 🌿\n\nWhich lucky plant will you get to know?\n\n{plant_list} \n\nYou can type 'Menu' to start over or 'Exit' to end the conversation."
+        elif incoming_msg == '2':
+            # Contact developer information
+            return state, "This project was created by Ruva, a passionate CS student, with the aim of helping Africa where 80% of people use traditional medicinal plants (per UN data). There's a critical lack of reliable, accessible tools for accurate plant identification. \n\nWant to contribute to the knowledge base? Reach out using the following: \n👩‍💻 GitHub:https://github.com/RuvaS20 \n📧 Email: ruvarashe.sadya@gmail.com"
+        # Default message for unrecognized input
+        return state, WELCOME_MESSAGE
+
+    if state == 'selecting_plant':
+        if incoming_msg.isdigit() and 1 <= int(incoming_msg) <= len(PLANT_CHOICES):
+            # Retrieve and display information about the selected plant
+            plant_name = PLANT_CHOICES[int(incoming_msg) - 1]
+            return 'default', get_plant_info(plant_name)
+        # Handle invalid plant selection
+        return 'selecting_plant', "Invalid selection. Please select a number from the list of plants. Or type 'Menu' to start over or 'Exit' to end the conversation."
+
+    # Unknown state, e.g. left behind by an older deployment
+    return 'default', WELCOME_MESSAGE
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     # Retrieve the incoming message text and sender's phone number from the request
@@ -194,144 +714,31 @@ def webhook():
     # Retrieve the number of media files sent with the message
     num_media = int(request.values.get('NumMedia', 0))
 
-    # Initialize user state if this is the first interaction with the number
-    if from_number not in user_states:
-        user_states[from_number] = {'state': 'menu'}
+    # Move the user to their next state and get the reply in one atomic step, so
+    # concurrent messages on different workers cannot interleave
+    with stage('session'):
+        reply = user_sessions.transition(from_number, lambda state: handle_message(state, incoming_msg, num_media))
 
-    # If the message is 'menu' or 'start over', reset the user state to the menu
-    if incoming_msg in ['menu', 'start over']:
-        user_states[from_number]['state'] = 'menu'
-        msg.body("🌿 *Welcome to Doctor Roots!* 🌿 \n\nI'm your friendly medicinal plant bot.\n\n📸*Send me a clear photo of a plant - I'll try to identify it and share fun facts about it!*📸\n\nOr choose one of these options:\n1️⃣ Learn more about other plants\n2️⃣ Contact the developer\n\n🚨Important Disclaimer🚨\nThe information disseminated here is for educational purposes only and should not be taken as medical advice.")
-        return str(resp)  # Return the response to the user
-    elif incoming_msg in ['exit', 'end']:
-        # If the message is 'exit' or 'end', remove the user from the state tracking and thank them
-        user_states.pop(from_number, None)
-        msg.body("Thank you for trying out Doctor Roots! If you have any feedback or questions, feel free to reach out. Have a great day!")
+    if reply is not None:
+        msg.body(reply)
         return str(resp)
 
-    # If the user is in the menu state, send the main menu message and change state to default
-    if user_states[from_number]['state'] == 'menu':
-        msg.body("🌿 *Welcome to Doctor Roots!* 🌿 \n\nI'm your friendly medicinal plant bot.\n\n📸*Send me a clear photo of a plant - I'll try to identify it and share fun facts about it!*📸\n\nOr choose one of these options:\n1️⃣ Learn more about other plants\n2️⃣ Contact the developer\n\n🚨Important Disclaimer🚨\nThe information disseminated here is for educational purposes only and should not be taken as medical advice.")
-        user_states[from_number]['state'] = 'default'
-
-    # If there are media files in the message, process them
-    elif num_media > 0:
-
-        # If the state is menu, ask for a text message first
-        if user_states[from_number]['state'] == 'menu':
-            msg.body("Please send a text message first.")
-            return str(resp)
-
-        # Retrieve the URL of the first media file
-        media_url = request.values.get('MediaUrl0')
-        
-        if media_url:
-            try:
-                # Inform the user that the prediction process has started
-                msg.body("Please wait a few seconds while I process the image...")
-                # Send the response to the user immediately
-                response = str(resp)
-                
-                # Reset the response to send the prediction result
-                resp = MessagingResponse()
-                msg = resp.message()
-
-                # Download the image from the URL
-                response = requests.get(media_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-                
-                if response.status_code == 200:
-                    image_data = response.content
-                    content_type = response.headers.get('Content-Type')
-
-                    # Check if the content is an image
-                    if 'image' in content_type:
-                        image_format = imghdr.what(None, h=image_data)
-
-                        if image_format:
-                            # Open the image and make a prediction
-                            image = Image.open(io.BytesIO(image_data))
-                            predicted_class, confidence = predict_image(image)
-                            
-                            if confidence >= 0.7:
-                                # Get the predicted plant name and information
-                                plant_name = class_mapping[str(predicted_class)]
-                                info = get_plant_info(plant_name)
-
-                                msg.body(f"*Leaf it to me! 🔍 I'm {confidence*100:.1f}% confident this is {plant_name}!* 🌿\n\n{info} \n\nYou can type 'Menu' to start over or 'Exit' to end the conversation.")
-
-                            else:
-                                # Low confidence in prediction
-                                msg.body("I'm not confident enough to identify this plant. Please try another image. \n\nYou can type 'Menu' to start over or 'Exit' to end the conversation.")
-
-                        else:
-                            # Image format not recognized
-                            msg.body("Sorry, the image format is not recognized. Please try a different image.")
-                    else:
-                        # URL does not point to an image
-                        msg.body("The URL does not point to a valid image. Please try sending an image.")
-                else:
-                    # Failed to download the image
-                    msg.body(f"Failed to download image. HTTP status code: {response.status_code}")
-            except requests.exceptions.RequestException as e:
-                # Error occurred during image download
-                msg.body(f"Sorry, I had trouble downloading the image. Error: {str(e)}")
-            except PIL.UnidentifiedImageError:
-                # Image format not supported
-                msg.body("Sorry, the image format is not supported. Please try a different image.")
-            except tf.errors.InvalidArgumentError as e:
-                # TensorFlow error during image processing
-                msg.body(f"There was an error processing the image with TensorFlow. Error: {str(e)}")
-            except Exception as e:
-                # Unexpected error occurred
-                msg.body(f"Sorry, there was an unexpected error processing your image. Error: {str(e)}")
-                print(f"Unexpected error: {str(e)}")
-                
+    # Retrieve the URLs of the attached media files, answered in one reply
+    media_urls = [request.values.get(f'MediaUrl{i}') for i in range(min(num_media, MAX_MEDIA_PER_MESSAGE))]
+    media_urls = [url for url in media_urls if url]
+
+    if media_urls:
+        if reply_dispatcher is not None:
+            # Acknowledge straight away and deliver the prediction out-of-band
+            if reply_dispatcher.submit(from_number, media_urls, from_number):
+                return str(MessagingResponse())
+            # Too many images already queued, shed load instead of piling up
+            msg.body("I'm getting a lot of photos right now. Please try again in a minute.")
         else:
-            # No image found in the message
-            msg.body("Sorry, I couldn't find the image you sent. Please try sending it again.")
-    
+            msg.body(process_media(media_urls, from_number))
     else:
-        if user_states[from_number]['state'] == 'default':
-            if incoming_msg == '1':
-                # List of plants to learn about
-                plant_list = "\n".join([
-                    "1️⃣ Madagascar Periwinkle",
-                    "2️⃣ Guava",
-                    "3️⃣ Ginger",
-                    "4️⃣ Lemon",
-                    "5️⃣ Mango",
-                    "6️⃣ Moringa",
-                    "7️⃣ Aloe vera"
-                ])
-                msg.body(f"🌿 *Eeny, meeny, miny, grow!* 🌿\n\nWhich lucky plant will you get to know?\n\n{plant_list} \n\nYou can type 'Menu' to start over or 'Exit' to end the conversation.")
-                user_states[from_number]['state'] = 'selecting_plant'
-            elif incoming_msg == '2':
-                # Contact developer information
-                msg.body("This project was created by Ruva, a passionate CS student, with the aim of helping Africa where 80% of people use traditional medicinal plants (per UN data). There's a critical lack of reliable, accessible tools for accurate plant identification. \n\nWant to contribute to the knowledge base? Reach out using the following: \n👩‍💻 GitHub:https://github.com/RuvaS20 \n📧 Email: ruvarashe.sadya@gmail.com")
-            else:
-                # Default message for unrecognized input
-                msg.body("🌿 *Welcome to Doctor Roots!* 🌿 \n\nI'm your friendly medicinal plant bot.\n\n📸*Send me a clear photo of a plant - I'll try to identify it and share fun facts about it!*📸\n\nOr choose one of these options:\n1️⃣ Learn more about other plants\n2️⃣ Contact the developer\n\n🚨Important Disclaimer🚨 \nThe information disseminated here is for educational purposes only and should not be taken as medical advice.")
-        
-        elif user_states[from_number]['state'] == 'selecting_plant':
-            if incoming_msg.isdigit() and 1 <= int(incoming_msg) <= 7:
-                # Retrieve and display information about the selected plant
-                plant_index = int(incoming_msg) - 1
-                plant_name = [
-                    "Catharanthus roseus",
-                    "Psidium guajava",
-                    "Zingiber officinale Roscoe",
-                    "Citrus limon",
-                    "Mangifera indica",
-                    "Moringa oleifera Lour",
-                    "Aloe barbadensis"
-                ][plant_index]
-                info = get_plant_info(plant_name)
-                msg.body(f"{info}")
-                user_states[from_number]['state'] = 'default'
-            else:
-                # Handle invalid plant selection
-                msg.body("Invalid selection. Please select a number from the list of plants. Or type 'Menu' to start over or 'Exit' to end the conversation.")
-                user_states[from_number]['state'] = 'selecting_plant'
+        # No image found in the message
+        msg.body("Sorry, I couldn't find the image you sent. Please try sending it again.")
 
     return str(resp)  # Return the response to be sent back to the user
 
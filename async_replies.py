@@ -0,0 +1,78 @@
+# Background delivery of image predictions, so the webhook can acknowledge Twilio
+# straight away instead of holding the request open for the download and inference
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ReplyDispatcher:
+    def __init__(self, handler, send, max_workers=4, max_queue=32):
+        # handler(*args) builds the reply text, send(to, body) delivers it
+        self.handler = handler
+        self.send = send
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+
+        # Bounds the jobs that are running or waiting, so a burst cannot grow
+        # the executor's internal queue without limit
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='reply')
+
+        self._stats_lock = threading.Lock()
+        self._pending = 0
+        self._sent = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def submit(self, to, *args):
+        # Returns False when the queue is full so the caller can push back
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            return False
+
+        with self._stats_lock:
+            self._pending += 1
+        try:
+            self._executor.submit(self._deliver, to, args)
+        except RuntimeError:
+            # Executor has been shut down
+            self._release(failed=True)
+            return False
+        return True
+
+    def _deliver(self, to, args):
+        failed = False
+        try:
+            body = self.handler(*args)
+            self.send(to, body)
+        except Exception:
+            failed = True
+            logger.exception("Failed to deliver reply to %s", to)
+        finally:
+            self._release(failed)
+
+    def _release(self, failed):
+        with self._stats_lock:
+            self._pending -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._sent += 1
+        self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'pending': self._pending,
+                'sent': self._sent,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+            }
@@ -1,15 +1,35 @@
+# Offline augmentation of a folder of plant photos, spread over all CPU cores.
+#
+# Each worker process builds its own transform pipeline once. Every image gets a
+# seed derived from --seed and its filename, so a rerun (or a different number
+# of workers) produces identical output. Finished images are appended to
+# augment_manifest.jsonl in the output folder and skipped on the next run, so an
+# interrupted run can be resumed and new photos added without redoing the rest.
+#
+# Usage:
+#     python augment_images.py input_folder output_folder --num-augmentations 3
+import argparse
+import json
 import os
+import random
+import zlib
+from multiprocessing import Pool
+
 import cv2
 import numpy as np
 import albumentations as A
 from tqdm import tqdm
 
-def augment_images(input_folder, output_folder, num_augmentations_per_image=5):
-    # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+MANIFEST_NAME = 'augment_manifest.jsonl'
+
+# Set in each worker by init_worker
+_transform = None
+
 
+def build_transform():
     # Define augmentation pipeline
-    transform = A.Compose([
+    return A.Compose([
         A.RandomRotate90(p=0.5),
         A.Flip(p=0.5),
         A.Transpose(p=0.5),
@@ -37,32 +57,127 @@ def augment_images(input_folder, output_folder, num_augmentations_per_image=5):
         A.HueSaturationValue(p=0.3),
     ])
 
-    # Loop through all images in the input folder
-    for filename in tqdm(os.listdir(input_folder)):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            # Read the image
-            image_path = os.path.join(input_folder, filename)
-            image = cv2.imread(image_path)
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-            # Generate augmented images
-            for i in range(num_augmentations_per_image):
-                augmented = transform(image=image)
-                augmented_image = augmented['image']
-                
-                # Save the augmented image
-                output_filename = f"aug_{i}_{filename}"
-                output_path = os.path.join(output_folder, output_filename)
-                cv2.imwrite(output_path, cv2.cvtColor(augmented_image, cv2.COLOR_RGB2BGR))
-
-# Usage
-input_folder = r"FILEPATH"
-output_folder = r"FILEPATH"
-num_augmentations_per_image = 3
-
-print(f"Augmenting images from: {input_folder}")
-print(f"Saving augmented images to: {output_folder}")
-
-augment_images(input_folder, output_folder, num_augmentations_per_image)
-
-print("Augmentation complete!")
+
+def image_seed(base_seed, filename):
+    # Stable across runs and processes, unlike hash()
+    return zlib.crc32(f"{base_seed}:{filename}".encode('utf-8'))
+
+
+def init_worker():
+    global _transform
+    # One process per core already, keep OpenCV from starting its own threads
+    cv2.setNumThreads(1)
+    _transform = build_transform()
+
+
+def seed_transform(seed):
+    # Newer albumentations keep their own generator, older ones use the global
+    # random and numpy generators
+    if hasattr(_transform, 'set_random_seed'):
+        _transform.set_random_seed(seed)
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def augment_file(task):
+    input_folder, output_folder, filename, num_augmentations, seed = task
+
+    # Read the image
+    image = cv2.imread(os.path.join(input_folder, filename))
+    if image is None:
+        return {'file': filename, 'seed': seed, 'error': 'could not read image'}
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    # Generate and save the augmented images
+    seed_transform(seed)
+    outputs = []
+    for i in range(num_augmentations):
+        augmented_image = _transform(image=image)['image']
+        output_filename = f"aug_{i}_{filename}"
+        cv2.imwrite(os.path.join(output_folder, output_filename), cv2.cvtColor(augmented_image, cv2.COLOR_RGB2BGR))
+        outputs.append(output_filename)
+
+    return {'file': filename, 'seed': seed, 'num_augmentations': num_augmentations, 'outputs': outputs}
+
+
+def load_manifest(output_folder):
+    # {filename: entry} for every image finished by an earlier run
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    done = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                if 'error' not in entry:
+                    done[entry['file']] = entry
+    return done
+
+
+def is_done(entry, seed, num_augmentations, output_folder):
+    return (entry is not None
+            and entry['seed'] == seed
+            and entry['num_augmentations'] == num_augmentations
+            and all(os.path.exists(os.path.join(output_folder, f)) for f in entry['outputs']))
+
+
+def augment_images(input_folder, output_folder, num_augmentations_per_image=5, workers=None, seed=0, force=False):
+    # Create output folder if it doesn't exist
+    os.makedirs(output_folder, exist_ok=True)
+
+    done = {} if force else load_manifest(output_folder)
+    filenames = sorted(f for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    tasks = []
+    for filename in filenames:
+        file_seed = image_seed(seed, filename)
+        if not is_done(done.get(filename), file_seed, num_augmentations_per_image, output_folder):
+            tasks.append((input_folder, output_folder, filename, num_augmentations_per_image, file_seed))
+
+    print(f"{len(filenames) - len(tasks)} of {len(filenames)} images already augmented")
+    if not tasks:
+        return {'augmented': 0, 'skipped': len(filenames), 'failed': 0}
+
+    # Build the pipeline once here too, so a broken transform fails now rather
+    # than in every worker the pool keeps restarting
+    build_transform()
+
+    failed = 0
+    with open(os.path.join(output_folder, MANIFEST_NAME), 'w' if force else 'a') as manifest, \
+            Pool(workers, initializer=init_worker) as pool:
+        # Record each image as soon as it is finished so an interrupted run
+        # loses at most the images in flight
+        for entry in tqdm(pool.imap_unordered(augment_file, tasks), total=len(tasks)):
+            if 'error' in entry:
+                failed += 1
+                print(f"Skipping {entry['file']}: {entry['error']}")
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+
+    return {'augmented': len(tasks) - failed, 'skipped': len(filenames) - len(tasks), 'failed': failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write augmented copies of every image in a folder')
+    parser.add_argument('input_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--num-augmentations', type=int, default=3, help='Augmented copies per image')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Base seed, combined with each filename')
+    parser.add_argument('--force', action='store_true', help='Ignore the manifest and redo every image')
+    args = parser.parse_args()
+
+    print(f"Augmenting images from: {args.input_folder}")
+    print(f"Saving augmented images to: {args.output_folder}")
+
+    summary = augment_images(args.input_folder, args.output_folder, args.num_augmentations,
+                             args.workers, args.seed, args.force)
+
+    print(f"Augmentation complete! {summary['augmented']} augmented, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Throughput of on-the-fly batch augmentation (data_pipeline.augment_batch)
+# against the per-image albumentations pipeline from augment_images.py.
+#
+# The tf.data rows use the in-memory cache, so after the first epoch they time
+# only batching, scaling and augmentation. The albumentations row transforms the
+# same decoded images one at a time in this process, without writing them to
+# disk, which is a lower bound on what augment_images.py spends per copy.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_augmentation --data-dir /path/to/medicinal_plants/data --epochs 3
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from data_pipeline import augment_batch, make_dataset
+from dataset import list_directories, list_plant_folders
+from preprocessing import INPUT_SIZE
+
+
+def time_dataset(dataset, epochs):
+    times = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        for _ in dataset:
+            pass
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def time_albumentations(images, epochs):
+    try:
+        from augment_images import build_transform
+        transform = build_transform()
+    except ImportError as e:
+        print(f"Skipping albumentations: {e}")
+        return None
+
+    times = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        for image in images:
+            transform(image=image)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare batched tf augmentation with albumentations')
+    parser.add_argument('--data-dir', required=True, help='Directory containing <plant>/<split> folders')
+    parser.add_argument('--split', default='Train')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    directories = [os.path.join(args.data_dir, plant, args.split) for plant in list_plant_folders(args.data_dir)]
+    num_images = len(list_directories(directories)[0])
+
+    results = {
+        'tf.data (cached)': time_dataset(
+            make_dataset(directories, args.batch_size, INPUT_SIZE, cache='memory'), args.epochs),
+        'tf.data + augment_batch': time_dataset(
+            make_dataset(directories, args.batch_size, INPUT_SIZE, cache='memory', augment=True), args.epochs),
+    }
+
+    # Decode once for the per-image comparison
+    images = [np.uint8(x * 255) for batch, _ in make_dataset(directories, args.batch_size, INPUT_SIZE, shuffle=False)
+              for x in np.asarray(batch)]
+    albumentations_times = time_albumentations(images, args.epochs)
+    if albumentations_times is not None:
+        results['albumentations (1 core)'] = albumentations_times
+
+    # Make sure augment_batch is warmed up and report its cost on one batch alone
+    batch = np.random.rand(args.batch_size, *INPUT_SIZE, 3).astype(np.float32)
+    augment_batch(batch)
+    started = time.perf_counter()
+    for _ in range(5):
+        augment_batch(batch)
+    batch_ms = (time.perf_counter() - started) / 5 * 1000
+
+    print(f"{num_images} images, batch size {args.batch_size}\n")
+    print(f"{'pipeline':<26} " + ' '.join(f"{'epoch ' + str(i + 1):>10}" for i in range(args.epochs)) + f" {'img/s':>8}")
+    for name, times in results.items():
+        # Report throughput from the last epoch, after the cache has been filled
+        print(f"{name:<26} " + ' '.join(f"{t:>9.2f}s" for t in times) + f" {num_images / times[-1]:>8.0f}")
+    print(f"\naugment_batch alone: {batch_ms:.1f} ms per batch of {args.batch_size} "
+          f"({args.batch_size / batch_ms * 1000:.0f} img/s)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'num_images': num_images, 'batch_size': args.batch_size, 'epoch_seconds': results,
+                       'augment_batch_ms': batch_ms}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# Cold-start benchmark for the webhook server: time to import the app, time to
+# the first prediction and memory per worker.
+#
+# --mode import starts fresh Python processes that import app.py and run one
+# prediction. --mode gunicorn boots gunicorn (with or without --preload), waits
+# for /ready and reports RSS, PSS and private memory of every worker. PSS splits
+# shared pages between the processes using them, so it shows what --preload saves.
+#
+# Usage (from the repository root, Linux only):
+#     python -m benchmarks.bench_cold_start --mode import --runs 3
+#     python -m benchmarks.bench_cold_start --mode gunicorn --workers 3 --preload
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+CHILD = """
+import json, os, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+import numpy as np
+from PIL import Image
+app.predict_image(Image.fromarray(np.zeros((480, 640, 3), dtype=np.uint8)))
+predicted = time.perf_counter()
+from benchmarks.bench_cold_start import memory_usage
+print(json.dumps({'import_s': imported - started, 'first_prediction_s': predicted - started,
+                  **memory_usage(os.getpid())}))
+"""
+
+
+def memory_usage(pid):
+    # RSS, PSS and private memory in MB from /proc
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                field, value = line.split(':', 1)
+                if field in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    usage[field] = int(value.split()[0]) / 1024
+    except FileNotFoundError:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['Rss'] = int(line.split()[1]) / 1024
+    return {
+        'rss_mb': usage.get('Rss'),
+        'pss_mb': usage.get('Pss'),
+        'private_mb': usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0) if 'Pss' in usage else None,
+    }
+
+
+def child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def run_import(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD], capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    for i, r in enumerate(results):
+        print(f"run {i}: import {r['import_s']:.2f}s, first prediction {r['first_prediction_s']:.2f}s, "
+              f"RSS {r['rss_mb']:.0f} MB")
+    return results
+
+
+def run_gunicorn(workers, threads, preload, port, timeout):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_PRELOAD='true' if preload else 'false', PORT=str(port))
+    started = time.perf_counter()
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Time until a worker has warmed its interpreters and answered /ready
+        ready_s = None
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=timeout) as response:
+                    if response.status == 200:
+                        ready_s = time.perf_counter() - started
+                        break
+            except OSError:
+                time.sleep(0.05)
+        if ready_s is None:
+            raise RuntimeError(f"gunicorn did not become ready within {timeout}s")
+
+        # Give the other workers a chance to be warmed too
+        for _ in range(workers * 4):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=timeout).read()
+
+        workers_usage = [memory_usage(pid) for pid in child_pids(master.pid)]
+        result = {'preload': preload, 'ready_s': ready_s, 'master': memory_usage(master.pid), 'workers': workers_usage}
+        print(f"preload={preload}: first /ready after {ready_s:.2f}s")
+        for i, usage in enumerate(workers_usage):
+            print(f"  worker {i}: RSS {usage['rss_mb']:.0f} MB, PSS {usage['pss_mb'] or 0:.0f} MB, "
+                  f"private {usage['private_mb'] or 0:.0f} MB")
+        return result
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure webhook cold start time and memory')
+    parser.add_argument('--mode', choices=['import', 'gunicorn'], default='import')
+    parser.add_argument('--runs', type=int, default=3, help='Fresh processes to start in import mode')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--preload', action='store_true')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    if args.mode == 'import':
+        results = run_import(args.runs)
+    else:
+        results = run_gunicorn(args.workers, args.threads, args.preload, args.port, args.timeout)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
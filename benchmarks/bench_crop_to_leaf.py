@@ -0,0 +1,82 @@
+# Is cropping webhook photos to the leaf (CROP_TO_LEAF) worth it? Runs the
+# served model over a labelled split twice, with plain preprocessing and with
+# the crop, and reports top-1 accuracy next to the per-image preprocessing time
+# (decode, crop, resize) each way. Images are decoded from the original files
+# every time, as the webhook decodes every download.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_crop_to_leaf --data-dir /path/to/medicinal_plants/data
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from dataset import list_split, load_class_names
+from interpreter_pool import InterpreterPool
+from model_export import MODEL_VARIANTS, model_filename
+from preprocessing import open_image, to_input_array
+
+
+def evaluate(pool, filenames, labels, crop):
+    preprocess_ms = []
+    correct = 0
+    with pool.acquire() as runner:
+        for path, label in zip(filenames, labels):
+            started = time.perf_counter()
+            image = open_image(path, crop=crop)
+            preprocess_ms.append((time.perf_counter() - started) * 1000.0)
+
+            runner.write_input(lambda view: to_input_array(image, out=view[0]))
+            correct += int(np.argmax(runner.invoke()[0]) == label)
+
+    return {
+        'top1_accuracy': correct / len(labels),
+        'preprocess_ms_p50': float(np.percentile(preprocess_ms, 50)),
+        'preprocess_ms_p99': float(np.percentile(preprocess_ms, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare accuracy and cost of cropping photos to the leaf')
+    parser.add_argument('--data-dir', required=True, help='Directory containing <plant>/<split> folders')
+    parser.add_argument('--model-dir', default='.', help='Directory containing the exported .tflite files')
+    parser.add_argument('--variant', default='float32', choices=MODEL_VARIANTS)
+    parser.add_argument('--class-mapping', default='class_mapping.json')
+    parser.add_argument('--split', default='Test')
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N images')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    filenames, labels, _ = list_split(args.data_dir, args.split, load_class_names(args.class_mapping))
+    if args.limit:
+        filenames, labels = filenames[:args.limit], labels[:args.limit]
+
+    pool = InterpreterPool(os.path.join(args.model_dir, model_filename(args.variant)))
+    pool.warm()
+
+    # Warm the file cache and OpenCV before timing
+    evaluate(pool, filenames[:5], labels[:5], crop=True)
+
+    results = {
+        'plain': evaluate(pool, filenames, labels, crop=False),
+        'crop_to_leaf': evaluate(pool, filenames, labels, crop=True),
+    }
+
+    print(f"{len(filenames)} {args.split} images, {args.variant} model\n")
+    print(f"{'preprocessing':<14} {'top-1':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['top1_accuracy']:>8.4f} {r['preprocess_ms_p50']:>8.2f} {r['preprocess_ms_p99']:>8.2f}")
+
+    plain, crop = results['plain'], results['crop_to_leaf']
+    print(f"\nCropping costs {crop['preprocess_ms_p50'] - plain['preprocess_ms_p50']:+.2f} ms per image (p50) "
+          f"for {(crop['top1_accuracy'] - plain['top1_accuracy']) * 100:+.2f} points of top-1 accuracy")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
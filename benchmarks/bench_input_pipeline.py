@@ -0,0 +1,67 @@
+# Epoch-time comparison of the training input pipelines: the original
+# CustomDataGenerator against the tf.data pipeline, uncached and cached in
+# memory, with the webhook's Pillow decoding (the default) and with native
+# tf.io decoding (decoder='native').
+# Only the input side is timed, batches are pulled as fast as the pipeline
+# can produce them.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_input_pipeline --data-dir /path/to/medicinal_plants/data --epochs 2
+import argparse
+import os
+import time
+
+from data_pipeline import CustomDataGenerator, make_dataset
+from dataset import list_plant_folders
+
+
+def time_generator(generator, epochs):
+    times = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        for i in range(len(generator)):
+            generator[i]
+        generator.on_epoch_end()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def time_dataset(dataset, epochs):
+    times = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        for _ in dataset:
+            pass
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare training input pipeline epoch times')
+    parser.add_argument('--data-dir', required=True, help='Directory containing <plant>/<split> folders')
+    parser.add_argument('--split', default='Train')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=2)
+    args = parser.parse_args()
+
+    directories = [os.path.join(args.data_dir, plant, args.split) for plant in list_plant_folders(args.data_dir)]
+    img_size = (224, 224)
+    num_images = len(CustomDataGenerator(directories, args.batch_size, img_size).filenames)
+
+    results = {
+        'CustomDataGenerator': time_generator(CustomDataGenerator(directories, args.batch_size, img_size), args.epochs),
+        'tf.data': time_dataset(make_dataset(directories, args.batch_size, img_size), args.epochs),
+        'tf.data (cached)': time_dataset(make_dataset(directories, args.batch_size, img_size, cache='memory'), args.epochs),
+        'tf.data (native)': time_dataset(make_dataset(directories, args.batch_size, img_size, decoder='native'),
+                                         args.epochs),
+    }
+
+    print(f"{num_images} images, batch size {args.batch_size}\n")
+    print(f"{'pipeline':<20} " + ' '.join(f"{'epoch ' + str(i + 1):>10}" for i in range(args.epochs)) + f" {'img/s':>8}")
+    for name, times in results.items():
+        # Report throughput from the last epoch, after any cache has been filled
+        print(f"{name:<20} " + ' '.join(f"{t:>9.2f}s" for t in times) + f" {num_images / times[-1]:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# Microbenchmark for the per-request tensor input path: the original
+# np.array / 255 + expand_dims + astype + set_tensor route versus scaling straight
+# into the interpreter's input tensor with cached tensor indices.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_input_tensor --model dr_roots_model.tflite
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from inference import ModelRunner
+from preprocessing import INPUT_SIZE, to_input_array
+
+
+def original_path(interpreter, image):
+    # predict_image as it was before the input tensor was written in place
+    image_array = np.array(image) / 255.0
+    image_array = np.expand_dims(image_array, axis=0).astype(np.float32)
+    input_details = interpreter.get_input_details()
+    interpreter.set_tensor(input_details[0]['index'], image_array)
+    interpreter.invoke()
+    output_details = interpreter.get_output_details()
+    return interpreter.get_tensor(output_details[0]['index'])
+
+
+def in_place_path(runner, image):
+    runner.write_input(lambda view: to_input_array(image, out=view[0]))
+    return runner.invoke()
+
+
+def measure(fn, iterations):
+    # Mean wall time, plus the peak memory allocated during a single call
+    fn()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-request input tensor path')
+    parser.add_argument('--model', default='dr_roots_model.tflite')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    image = Image.fromarray(np.random.randint(0, 256, (*INPUT_SIZE, 3), dtype=np.uint8))
+
+    interpreter = tf.lite.Interpreter(model_path=args.model)
+    interpreter.allocate_tensors()
+    runner = ModelRunner(tf.lite.Interpreter(model_path=args.model))
+    runner.interpreter.allocate_tensors()
+
+    # Both paths must produce the same probabilities
+    np.testing.assert_allclose(original_path(interpreter, image), in_place_path(runner, image), rtol=1e-5, atol=1e-6)
+
+    results = {
+        'original': measure(lambda: original_path(interpreter, image), args.iterations),
+        'in_place': measure(lambda: in_place_path(runner, image), args.iterations),
+    }
+
+    print(f"{'path':<10} {'ms/call':>10} {'peak bytes':>12}")
+    for name, (seconds, peak) in results.items():
+        print(f"{name:<10} {seconds * 1000:>10.3f} {peak:>12}")
+
+    saved_ms = (results['original'][0] - results['in_place'][0]) * 1000
+    saved_bytes = results['original'][1] - results['in_place'][1]
+    print(f"\nSaved per call: {saved_ms:.3f} ms, {saved_bytes} bytes allocated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Accuracy-vs-latency comparison of the exported TFLite variants. Each model is
+# run one image at a time over the test split, the way the webhook serves it,
+# and top-1 accuracy, p50/p99 CPU latency and file size are reported.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_model_variants --data-dir /path/to/medicinal_plants/data
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from dataset import list_split, load_class_names
+from inference import ModelRunner
+from model_export import MODEL_VARIANTS, model_filename
+from preprocessing import open_image, to_input_array
+
+
+def benchmark_variant(model_path, images, labels, num_threads):
+    runner = ModelRunner(tf.lite.Interpreter(model_path=model_path, num_threads=num_threads))
+    runner.interpreter.allocate_tensors()
+
+    # Warm up so one-off allocation is not counted
+    runner.write_input(lambda view: to_input_array(images[0], out=view[0]))
+    runner.invoke()
+
+    latencies = []
+    correct = 0
+    for image, label in zip(images, labels):
+        started = time.perf_counter()
+        runner.write_input(lambda view: to_input_array(image, out=view[0]))
+        output = runner.invoke()[0]
+        latencies.append(time.perf_counter() - started)
+        correct += int(np.argmax(output) == label)
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'size_mb': os.path.getsize(model_path) / 1024 / 1024,
+        'top1_accuracy': correct / len(labels),
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p99': float(np.percentile(latencies, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare accuracy and latency of the TFLite model variants')
+    parser.add_argument('--data-dir', required=True, help='Directory containing <plant>/Test folders')
+    parser.add_argument('--model-dir', default='.', help='Directory containing the exported .tflite files')
+    parser.add_argument('--variants', nargs='+', default=list(MODEL_VARIANTS), choices=MODEL_VARIANTS)
+    parser.add_argument('--class-mapping', default='class_mapping.json')
+    parser.add_argument('--split', default='Test')
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N images')
+    parser.add_argument('--num-threads', type=int, default=1, help='Interpreter threads (1 matches a dyno worker)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    filenames, labels, _ = list_split(args.data_dir, args.split, load_class_names(args.class_mapping))
+    if args.limit:
+        filenames, labels = filenames[:args.limit], labels[:args.limit]
+
+    # Decode everything up front so only inference is timed
+    images = [open_image(f) for f in filenames]
+    print(f"Loaded {len(images)} {args.split} images")
+
+    results = {}
+    for variant in args.variants:
+        model_path = os.path.join(args.model_dir, model_filename(variant))
+        if not os.path.exists(model_path):
+            print(f"Skipping {variant}, {model_path} not found")
+            continue
+        results[variant] = benchmark_variant(model_path, images, labels, args.num_threads)
+
+    print(f"\n{'variant':<10} {'size MB':>8} {'top-1':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for variant, r in results.items():
+        print(f"{variant:<10} {r['size_mb']:>8.2f} {r['top1_accuracy']:>8.4f} "
+              f"{r['latency_ms_p50']:>8.2f} {r['latency_ms_p99']:>8.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
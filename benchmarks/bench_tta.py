@@ -0,0 +1,146 @@
+# Cost and benefit of the webhook's test-time augmentation (TTA=true). Over a
+# labelled split, each image is predicted once on a batch-1 interpreter, then
+# its other TTA views are run as one invoke on a second interpreter built at
+# that batch size, the way app.predict_views does without request batching.
+# Reports the latency of building the views, of that batched run and of the same
+# views run one at a time on the batch-1 interpreter, and the share of photos
+# answered, and answered correctly, at the model's calibrated cutoffs with no
+# TTA, with TTA gated on the uncertainty band and with TTA on every photo. The
+# band's average cost is in units of one inference.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_tta --data-dir /path/to/medicinal_plants/data --min-confidence 0.4 --max-confidence 0.7
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from calibration import Calibration, calibration_filename
+from dataset import list_split, load_class_names
+from inference import ModelRunner
+from interpreter_pool import load_interpreter_class
+from model_export import MODEL_VARIANTS, model_filename
+from preprocessing import TTA_VIEWS, open_image, to_input_array, tta_views
+
+
+def answered(calibration, probabilities, label):
+    # (answered, answered correctly) for the webhook's decision on one photo
+    decision, ranked = calibration.decide(probabilities)
+    return decision == 'identified', decision == 'identified' and ranked[0][0] == label
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cost and accuracy effect of test-time augmentation')
+    parser.add_argument('--data-dir', required=True, help='Directory containing <plant>/<split> folders')
+    parser.add_argument('--model-dir', default='.', help='Directory containing the exported .tflite files')
+    parser.add_argument('--variant', default='float32', choices=MODEL_VARIANTS)
+    parser.add_argument('--class-mapping', default='class_mapping.json')
+    parser.add_argument('--split', default='Test')
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N images')
+    parser.add_argument('--min-confidence', type=float, default=0.4, help='TTA_MIN_CONFIDENCE')
+    parser.add_argument('--max-confidence', type=float, default=0.7, help='TTA_MAX_CONFIDENCE')
+    parser.add_argument('--num-threads', type=int, default=1, help='Interpreter threads (1 matches a dyno worker)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    filenames, labels, _ = list_split(args.data_dir, args.split, load_class_names(args.class_mapping))
+    if args.limit:
+        filenames, labels = filenames[:args.limit], labels[:args.limit]
+
+    # Decode everything up front so only augmentation and inference are timed
+    images = [open_image(f) for f in filenames]
+    print(f"Loaded {len(images)} {args.split} images")
+
+    model_path = os.path.join(args.model_dir, model_filename(args.variant))
+    calibration = Calibration.load(calibration_filename(model_path))
+    views = TTA_VIEWS[1:]
+
+    # As app.interpreter_pool and app.batch_pool: one interpreter at batch 1
+    # and one built at the size of the other views, both mapping the model
+    interpreter_cls = load_interpreter_class()
+    runners = []
+    for batch_size in (1, len(views)):
+        interpreter = interpreter_cls(model_path=model_path, num_threads=args.num_threads)
+        interpreter.allocate_tensors()
+        runners.append(ModelRunner(interpreter))
+        runners[-1].resize(batch_size)
+    runner, batch_runner = runners
+
+    # Warm both up so one-off kernel setup is not counted
+    for warm_runner in runners:
+        warm_runner.write_input(lambda view: view.fill(0), batch_size=warm_runner.batch_size)
+        warm_runner.invoke()
+
+    timings = {'single': [], 'views': [], 'batched': [], 'sequential': []}
+    counts = {mode: {'answered': 0, 'correct': 0} for mode in ('none', 'band', 'always')}
+    triggered = 0
+
+    for image, label in zip(images, labels):
+        started = time.perf_counter()
+        runner.write_input(lambda view: to_input_array(image, out=view[0]))
+        first = runner.invoke()[0].copy()
+        timings['single'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        tta_views(image, views)
+        timings['views'].append(time.perf_counter() - started)
+
+        # As app.predict_views: every view built straight into the batch
+        # interpreter's input tensor and run at once
+        started = time.perf_counter()
+        batch_runner.write_input(lambda view: tta_views(image, views, out=view), batch_size=len(views))
+        outputs = batch_runner.invoke()
+        timings['batched'].append(time.perf_counter() - started)
+
+        # The same views one at a time on the batch-1 interpreter, for
+        # comparison. Both must give the same scores
+        pixels = np.asarray(image)
+        started = time.perf_counter()
+        sequential = []
+        for name in views:
+            runner.write_input(lambda view: tta_views(pixels, (name,), out=view))
+            sequential.append(runner.invoke()[0])
+        timings['sequential'].append(time.perf_counter() - started)
+        np.testing.assert_allclose(outputs, np.stack(sequential), rtol=1e-4, atol=1e-6)
+
+        averaged = (first + outputs.sum(axis=0)) / (len(views) + 1)
+        in_band = args.min_confidence <= calibration.calibrate(first).max() < args.max_confidence
+        triggered += int(in_band)
+        for mode, probabilities in (('none', first), ('band', averaged if in_band else first), ('always', averaged)):
+            is_answered, is_correct = answered(calibration, probabilities, label)
+            counts[mode]['answered'] += int(is_answered)
+            counts[mode]['correct'] += int(is_correct)
+
+    latency = {name: float(np.percentile(np.array(values) * 1000.0, 50)) for name, values in timings.items()}
+    single = latency['single']
+    results = {
+        'images': len(images),
+        'views': len(views) + 1,
+        'latency_ms_p50': latency,
+        'band': [args.min_confidence, args.max_confidence],
+        'band_fraction': triggered / len(images),
+        # The batched timing includes building the views into the input tensor
+        'band_cost': 1.0 + triggered / len(images) * latency['batched'] / single,
+        'modes': {mode: {'coverage': c['answered'] / len(images),
+                         'accuracy': c['correct'] / c['answered'] if c['answered'] else 0.0,
+                         'correct': c['correct'] / len(images)}
+                  for mode, c in counts.items()},
+    }
+
+    print(f"\np50 ms: single {single:.2f}, build views {latency['views']:.2f}, "
+          f"{len(views)} views batched {latency['batched']:.2f} (one at a time {latency['sequential']:.2f})")
+    print(f"band [{args.min_confidence}, {args.max_confidence}) triggers on {results['band_fraction']:.1%} "
+          f"of photos, average cost {results['band_cost']:.2f}x one inference")
+    print(f"\n{'TTA':<8} {'answered':>9} {'accuracy':>9} {'correct':>9}")
+    for mode, r in results['modes'].items():
+        print(f"{mode:<8} {r['coverage']:>9.4f} {r['accuracy']:>9.4f} {r['correct']:>9.4f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Parity check for preprocessing.py over a real dataset: every path that
+# turns a photo into model input must produce bit-identical float32 tensors,
+# or the model is served different pixels from the ones it was trained on.
+# Compares, for the same files, the webhook path (prepare_image on downloaded
+# bytes + to_input_array), the batch API (load_batch), the tf.data pipeline
+# as dr_roots.py builds it (make_dataset, cached), the CustomDataGenerator,
+# pack_dataset.py's .npy shards and resize_images.py's .npy output. Exits
+# non-zero on any mismatch.
+#
+# All of these share preprocessing.load_pixels, so this catches paths that
+# stop using it; tests/test_preprocessing.py pins load_pixels itself to golden
+# pixels, which catches changes in Pillow's decoding.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.check_preprocessing_parity --data-dir /path/to/medicinal_plants/data
+import argparse
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from data_pipeline import CustomDataGenerator, make_dataset, make_packed_dataset
+from dataset import list_directories, list_plant_folders
+from pack_dataset import pack_dataset, packed_order
+from preprocessing import INPUT_SIZE, load_batch, prepare_image, to_input_array
+from resize_images import output_filenames, resize_images
+
+
+def webhook_path(filenames):
+    # What app.predict_media does with downloaded bytes
+    batch = []
+    for path in filenames:
+        with open(path, 'rb') as f:
+            image = prepare_image(Image.open(io.BytesIO(f.read())))
+        batch.append(to_input_array(image))
+    return np.stack(batch)
+
+
+def dataset_path(directories):
+    return np.concatenate([np.asarray(x) for x, _ in make_dataset(directories, 16, INPUT_SIZE, shuffle=False,
+                                                                  cache='memory')])
+
+
+def generator_path(directories):
+    generator = CustomDataGenerator(directories, 16, INPUT_SIZE, shuffle=False)
+    return np.concatenate([generator[i][0] for i in range(len(generator))])
+
+
+def packed_path(data_dir, split, filenames, workdir):
+    # pack_dataset lists images by class then filename and packs them in
+    # packed_order, so map them back
+    pack_dir = os.path.join(workdir, 'packed')
+    manifest = pack_dataset(data_dir, pack_dir, 'npy', workers=1)
+    packed = np.concatenate([np.asarray(x) for x, _ in
+                             make_packed_dataset(pack_dir, split, 16, shuffle=False)])
+    order = sorted(range(len(filenames)), key=lambda i: (
+        list_plant_folders(data_dir).index(os.path.basename(os.path.dirname(os.path.dirname(filenames[i])))),
+        os.path.basename(filenames[i])))
+    result = np.empty_like(packed)
+    result[np.array(order)[packed_order(len(filenames), manifest['seed'])]] = packed
+    return result
+
+
+def resize_images_path(directories, filenames, workdir):
+    batch = {}
+    for d in directories:
+        output_dir = os.path.join(workdir, 'resized', os.path.basename(os.path.dirname(d)))
+        resize_images(d, output_dir, INPUT_SIZE, output_format='npy', workers=1)
+        names = output_filenames(sorted(os.listdir(d)), 'npy')
+        for name, output_name in names.items():
+            batch[os.path.join(d, name)] = to_input_array(np.load(os.path.join(output_dir, output_name)))
+    return np.stack([batch[path] for path in filenames])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check all preprocessing paths produce identical tensors')
+    parser.add_argument('--data-dir', required=True, help='Directory containing <plant>/<split> folders')
+    parser.add_argument('--split', default='Test')
+    args = parser.parse_args()
+
+    directories = [os.path.join(args.data_dir, plant, args.split) for plant in list_plant_folders(args.data_dir)]
+    filenames = list_directories(directories)[0]
+    reference = load_batch(filenames)
+    print(f"{len(filenames)} {args.split} images")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {
+            'webhook': webhook_path(filenames),
+            'make_dataset': dataset_path(directories),
+            'CustomDataGenerator': generator_path(directories),
+            'pack_dataset (npy)': packed_path(args.data_dir, args.split, filenames, workdir),
+            'resize_images (npy)': resize_images_path(directories, filenames, workdir),
+        }
+
+    failed = False
+    for name, batch in paths.items():
+        identical = batch.shape == reference.shape and batch.dtype == reference.dtype and np.array_equal(batch, reference)
+        max_diff = float(np.max(np.abs(batch - reference))) if batch.shape == reference.shape else float('nan')
+        print(f"{name:<22} {'identical' if identical else 'MISMATCH':<10} max abs diff {max_diff:.3g}")
+        failed = failed or not identical
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+# Load test for /webhook: replays Twilio-style form posts from many simulated
+# WhatsApp users at once and reports throughput, latency percentiles per flow,
+# a per-stage breakdown and memory per gunicorn worker.
+#
+# Each simulated user keeps its own conversation, mixing three flows:
+#   menu   'menu' then a greeting, back at the main menu
+#   plant  '1' then a plant number, the plant profile lookup
+#   image  NumMedia=N with MediaUrl0..N-1 pointing at a local stub media server
+#          (--media-per-message, 1 by default)
+# The stub serves distinct JPEGs at the configured sizes after an artificial
+# delay, standing in for Twilio's media CDN.
+#
+# By default the harness boots gunicorn itself (with REQUEST_TRACING=true,
+# synchronous replies and the prediction cache off, so every image is really
+# predicted) and can pass any other app setting through --env, which is how two
+# configurations are compared. With --url it drives a server that is already
+# running; start that with REQUEST_TRACING=true to get the stage breakdown.
+#
+# Usage (from the repository root, Linux only for the memory figures):
+#     python -m benchmarks.load_test --requests 500 --concurrency 8 --workers 2 --threads 4
+#     python -m benchmarks.load_test --workers 2 --threads 4 --env INFERENCE_BATCHING=true
+#     python -m benchmarks.load_test --url http://127.0.0.1:5000 --concurrency 4
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image
+
+from benchmarks.bench_cold_start import child_pids, memory_usage
+from tracing import parse_server_timing
+
+FLOWS = ('menu', 'plant', 'image')
+
+
+def make_jpeg(width, height, seed):
+    # Smooth random colour fields compress like a photo, unlike pure noise
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(coarse).resize((width, height), Image.BILINEAR).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+class MediaServer:
+    # Stub media host serving /media/<width>x<height>/<n>.jpg after latency_ms
+    def __init__(self, sizes, unique_images=64, latency_ms=0.0):
+        self.images = {size: [make_jpeg(*size, seed) for seed in range(unique_images)] for size in sizes}
+        self.latency = latency_ms / 1000.0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                try:
+                    _, _, size, name = self.path.split('/')
+                    width, height = (int(v) for v in size.split('x'))
+                    images = server.images[(width, height)]
+                    data = images[int(name.split('.')[0]) % len(images)]
+                except (ValueError, KeyError):
+                    self.send_error(404)
+                    return
+                time.sleep(server.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, size, n):
+        return f"http://127.0.0.1:{self.httpd.server_port}/media/{size[0]}x{size[1]}/{n}.jpg"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class LoadTest:
+    def __init__(self, base_url, media, sizes, mix, total_requests, duration, media_per_message=1):
+        self.base_url = base_url.rstrip('/')
+        self.media = media
+        self.sizes = sizes
+        self.media_per_message = media_per_message
+        self.flows = [flow for flow, weight in mix.items() for _ in range(weight)]
+        self.total_requests = total_requests
+        self.duration = duration
+        self.sent = 0
+        self.images = itertools.count()
+        self.results = []
+        self.lock = threading.Lock()
+
+    def post(self, session, flow, from_number, **form):
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{self.base_url}/webhook", data={'From': from_number, **form}, timeout=120)
+            ok = response.status_code == 200
+            timings = parse_server_timing(response.headers.get('Server-Timing', ''))
+        except requests.RequestException:
+            ok, timings = False, {}
+        latency_ms = (time.perf_counter() - started) * 1000.0
+        with self.lock:
+            self.results.append({'flow': flow, 'ok': ok, 'latency_ms': latency_ms, 'stages': timings})
+
+    def reserve(self, count):
+        # Claim count more requests, False once the budget or time is used up
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return False
+        with self.lock:
+            if self.total_requests is not None and self.sent + count > self.total_requests:
+                return False
+            self.sent += count
+            return True
+
+    def user(self, user_id, seed):
+        rng = random.Random(seed)
+        from_number = f"whatsapp:+2637{user_id:08d}"
+        with requests.Session() as session:
+            # The first message of a conversation always gets the main menu
+            if not self.reserve(1):
+                return
+            self.post(session, 'menu', from_number, Body='hi')
+
+            while True:
+                flow = rng.choice(self.flows)
+                if flow == 'image':
+                    if not self.reserve(1):
+                        return
+                    attachments = {}
+                    for i in range(self.media_per_message):
+                        attachments[f'MediaUrl{i}'] = self.media.url(rng.choice(self.sizes), next(self.images))
+                        attachments[f'MediaContentType{i}'] = 'image/jpeg'
+                    self.post(session, 'image', from_number, Body='', NumMedia=str(self.media_per_message),
+                              **attachments)
+                else:
+                    if not self.reserve(2):
+                        return
+                    if flow == 'plant':
+                        self.post(session, 'plant', from_number, Body='1')
+                        self.post(session, 'plant', from_number, Body=str(rng.randint(1, 7)))
+                    else:
+                        self.post(session, 'menu', from_number, Body='menu')
+                        self.post(session, 'menu', from_number, Body='hi')
+
+    def run(self, concurrency, seed=0):
+        self.deadline = time.perf_counter() + self.duration if self.duration else None
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            for future in [executor.submit(self.user, i, seed + i) for i in range(concurrency)]:
+                future.result()
+        return time.perf_counter() - started
+
+
+def percentiles(values):
+    values = np.asarray(values)
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+def summarise(results, elapsed):
+    summary = {
+        'requests': len(results),
+        'errors': sum(not r['ok'] for r in results),
+        'elapsed_s': elapsed,
+        'throughput_per_sec': len(results) / elapsed,
+        'flows': {},
+        'stages': {},
+    }
+    for flow in FLOWS:
+        latencies = [r['latency_ms'] for r in results if r['flow'] == flow]
+        if latencies:
+            summary['flows'][flow] = {'count': len(latencies), **percentiles(latencies)}
+
+    # Server-side stages of image requests, plus whatever the client saw that
+    # no stage accounts for (network, WSGI, TwiML)
+    stages = {}
+    for r in results:
+        if r['flow'] == 'image' and r['stages']:
+            for name, ms in r['stages'].items():
+                stages.setdefault(name, []).append(ms)
+            stages.setdefault('other', []).append(r['latency_ms'] - sum(r['stages'].values()))
+    for name, values in stages.items():
+        summary['stages'][name] = {'count': len(values), **percentiles(values)}
+    return summary
+
+
+def start_gunicorn(workers, threads, preload, port, extra_env, timeout):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_PRELOAD='true' if preload else 'false', PORT=str(port),
+               REQUEST_TRACING='true', ASYNC_REPLIES='false', PREDICTION_CACHE_URL='')
+    env.setdefault('TWILIO_ACCOUNT_SID', 'ACloadtest')
+    env.setdefault('TWILIO_AUTH_TOKEN', 'loadtest')
+    env.update(extra_env)
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=timeout) as response:
+                if response.status == 200:
+                    return master
+        except OSError:
+            time.sleep(0.05)
+    stop_gunicorn(master)
+    raise RuntimeError(f"gunicorn did not become ready within {timeout}s")
+
+
+def stop_gunicorn(master):
+    master.send_signal(signal.SIGTERM)
+    master.wait()
+
+
+def print_summary(summary):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']:.1f}s: "
+          f"{summary['throughput_per_sec']:.1f} req/s, {summary['errors']} errors")
+
+    print(f"\n{'flow':<10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in summary['flows'].items():
+        print(f"{name:<10} {r['count']:>7} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['p99']:>9.1f}")
+
+    if summary['stages']:
+        print(f"\n{'image stage':<12} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, r in summary['stages'].items():
+            print(f"{name:<12} {r['count']:>7} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['p99']:>9.1f}")
+    else:
+        print("\nNo Server-Timing headers, start the server with REQUEST_TRACING=true for a stage breakdown")
+
+    for i, usage in enumerate(summary.get('workers', [])):
+        print(f"worker {i}: RSS {usage['rss_mb']:.0f} MB, PSS {usage['pss_mb'] or 0:.0f} MB, "
+              f"private {usage['private_mb'] or 0:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay Twilio webhook traffic and report latency by stage')
+    parser.add_argument('--url', help='Drive this running server instead of starting gunicorn')
+    parser.add_argument('--requests', type=int, default=300, help='Total requests to send')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds instead')
+    parser.add_argument('--concurrency', type=int, default=8, help='Simulated users sending at once')
+    parser.add_argument('--mix', default='menu=1,plant=1,image=2', help='Relative weights of the flows')
+    parser.add_argument('--image-sizes', nargs='+', default=['640x480', '1600x1200', '4032x3024'])
+    parser.add_argument('--unique-images', type=int, default=64, help='Distinct images per size')
+    parser.add_argument('--media-per-message', type=int, default=1, help='Photos attached to each image message')
+    parser.add_argument('--media-latency-ms', type=float, default=50.0, help='Delay before the stub serves media')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--preload', action='store_true')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra app setting for the gunicorn server, repeatable')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Seconds to wait for gunicorn to be ready')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.image_sizes]
+    mix = {flow: int(weight) for flow, weight in (item.split('=') for item in args.mix.split(','))}
+    media = MediaServer(sizes, args.unique_images, args.media_latency_ms)
+
+    master = None
+    if args.url is None:
+        extra_env = dict(item.split('=', 1) for item in args.env)
+        master = start_gunicorn(args.workers, args.threads, args.preload, args.port, extra_env, args.timeout)
+        base_url = f"http://127.0.0.1:{args.port}"
+    else:
+        base_url = args.url
+
+    try:
+        test = LoadTest(base_url, media, sizes, mix, None if args.duration else args.requests, args.duration,
+                        args.media_per_message)
+        elapsed = test.run(args.concurrency, args.seed)
+        summary = summarise(test.results, elapsed)
+        if master is not None:
+            summary['config'] = {'workers': args.workers, 'threads': args.threads, 'preload': args.preload,
+                                 'env': args.env}
+            summary['workers'] = [memory_usage(pid) for pid in child_pids(master.pid)]
+    finally:
+        if master is not None:
+            stop_gunicorn(master)
+        media.close()
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# Confidence calibration for the served model. Softmax scores from a fine-tuned
+# network are usually over- or under-confident, so a fixed 'confidence >= 0.7'
+# cutoff turns away more (or fewer) photos than it should. Temperature scaling
+# fitted on the validation split rescales the scores, and per-class thresholds
+# fitted on the calibrated scores let confusable plants need more confidence
+# than distinctive ones.
+#
+# The fit is saved as JSON next to the .tflite file it was fitted for
+# (dr_roots_model.tflite -> dr_roots_model.calibration.json) and loaded by the
+# webhook; without the file the scores are used as-is with the 0.7 cutoff
+import json
+import os
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.7
+
+# How the scores for several photos of one plant are combined
+FUSION_METHODS = ('mean', 'log')
+
+
+def calibration_filename(model_path):
+    return os.path.splitext(model_path)[0] + '.calibration.json'
+
+
+def apply_temperature(probabilities, temperature):
+    # softmax(log(p) / T). log(p) only differs from the logits by a per-image
+    # constant, so this is temperature scaling without needing the logits
+    logits = np.log(np.clip(np.asarray(probabilities, dtype=np.float64), 1e-12, 1.0)) / temperature
+    logits -= logits.max(axis=-1, keepdims=True)
+    scaled = np.exp(logits)
+    return scaled / scaled.sum(axis=-1, keepdims=True)
+
+
+def negative_log_likelihood(probabilities, labels, temperature):
+    scaled = apply_temperature(probabilities, temperature)
+    return float(-np.log(np.clip(scaled[np.arange(len(labels)), labels], 1e-12, 1.0)).mean())
+
+
+def fit_temperature(probabilities, labels, low=0.05, high=20.0, iterations=50):
+    # Golden-section search over log(T) for the temperature with the lowest
+    # validation NLL, which is unimodal in T
+    log_low, log_high = np.log(low), np.log(high)
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    a = log_high - ratio * (log_high - log_low)
+    b = log_low + ratio * (log_high - log_low)
+    loss_a = negative_log_likelihood(probabilities, labels, np.exp(a))
+    loss_b = negative_log_likelihood(probabilities, labels, np.exp(b))
+    for _ in range(iterations):
+        if loss_a < loss_b:
+            log_high, b, loss_b = b, a, loss_a
+            a = log_high - ratio * (log_high - log_low)
+            loss_a = negative_log_likelihood(probabilities, labels, np.exp(a))
+        else:
+            log_low, a, loss_a = a, b, loss_b
+            b = log_low + ratio * (log_high - log_low)
+            loss_b = negative_log_likelihood(probabilities, labels, np.exp(b))
+    return float(np.exp((log_low + log_high) / 2.0))
+
+
+def fit_thresholds(probabilities, labels, target_precision=0.9, min_accepted=10,
+                   default=DEFAULT_THRESHOLD, candidates=np.arange(0.3, 0.96, 0.01)):
+    # For each class, the lowest cutoff at which the photos predicted as that
+    # class are right at least target_precision of the time. Classes with too
+    # few validation predictions to tell keep the default cutoff
+    predictions = probabilities.argmax(axis=1)
+    confidence = probabilities.max(axis=1)
+    correct = predictions == labels
+
+    thresholds = {}
+    for cls in range(probabilities.shape[1]):
+        predicted = predictions == cls
+        threshold = default
+        for candidate in candidates:
+            accepted = predicted & (confidence >= candidate)
+            if accepted.sum() < min_accepted:
+                break
+            if correct[accepted].mean() >= target_precision:
+                threshold = float(round(candidate, 2))
+                break
+        thresholds[cls] = threshold
+    return thresholds
+
+
+def fuse(probabilities, method='mean'):
+    # One distribution from (N, num_classes) scores for N photos of the same
+    # plant. 'mean' averages them, so one poor photo only dilutes the rest.
+    # 'log' sums log-probabilities, a product of the photos' opinions, which is
+    # more decisive when they agree but lets a single confident photo dominate
+    probabilities = np.atleast_2d(np.asarray(probabilities, dtype=np.float64))
+    if len(probabilities) == 1:
+        return probabilities[0]
+    if method == 'mean':
+        return probabilities.mean(axis=0)
+    if method == 'log':
+        log_sum = np.log(np.clip(probabilities, 1e-12, 1.0)).sum(axis=0)
+        fused = np.exp(log_sum - log_sum.max())
+        return fused / fused.sum()
+    raise ValueError(f"Unknown fusion method {method!r}, expected one of {FUSION_METHODS}")
+
+
+class Calibration:
+    def __init__(self, temperature=1.0, thresholds=None, default_threshold=DEFAULT_THRESHOLD):
+        self.temperature = float(temperature)
+        self.thresholds = {int(cls): float(t) for cls, t in (thresholds or {}).items()}
+        self.default_threshold = float(default_threshold)
+
+    @classmethod
+    def fit(cls, probabilities, labels, target_precision=0.9, min_accepted=10):
+        # labels: (N,) class indices or (N, num_classes) one-hot
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        labels = np.asarray(labels)
+        if labels.ndim == 2:
+            labels = labels.argmax(axis=1)
+        temperature = fit_temperature(probabilities, labels)
+        thresholds = fit_thresholds(apply_temperature(probabilities, temperature), labels,
+                                    target_precision, min_accepted)
+        return cls(temperature, thresholds)
+
+    def calibrate(self, probabilities):
+        if self.temperature == 1.0:
+            return np.asarray(probabilities, dtype=np.float64)
+        return apply_temperature(probabilities, self.temperature)
+
+    def threshold(self, cls):
+        return self.thresholds.get(int(cls), self.default_threshold)
+
+    def decide(self, probabilities, near_tie_margin=None, fusion='mean'):
+        # ('identified' | 'near_tie' | 'low_confidence', [(class, calibrated
+        # confidence)] best first) for one image, or for (N, num_classes)
+        # scores of several photos fused into one. A near tie is when the top
+        # two classes are within near_tie_margin of each other and together
+        # clear the top class's cutoff, so one of the two is very likely right
+        scores = fuse(self.calibrate(probabilities), fusion)
+        first, second = np.argsort(scores)[::-1][:2]
+        ranked = [(int(first), float(scores[first])), (int(second), float(scores[second]))]
+
+        if scores[first] >= self.threshold(first):
+            return 'identified', ranked
+        if (near_tie_margin is not None and scores[first] - scores[second] <= near_tie_margin
+                and scores[first] + scores[second] >= self.threshold(first)):
+            return 'near_tie', ranked
+        return 'low_confidence', ranked
+
+    def to_dict(self):
+        return {
+            'temperature': self.temperature,
+            'default_threshold': self.default_threshold,
+            'thresholds': {str(cls): t for cls, t in sorted(self.thresholds.items())},
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        # The identity calibration (0.7 for every class) when no file was saved
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data.get('temperature', 1.0), data.get('thresholds'),
+                   data.get('default_threshold', DEFAULT_THRESHOLD))
@@ -0,0 +1,304 @@
+# Training input pipelines. make_dataset builds a tf.data pipeline that decodes
+# images in parallel and prefetches batches, make_packed_dataset reads the shards
+# written by pack_dataset.py, which are decoded once with the webhook's own
+# preprocessing; CustomDataGenerator is the original Keras Sequence, kept for
+# comparison
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.utils import Sequence
+
+from dataset import list_directories
+from preprocessing import load_batch, load_pixels
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+def decode_image(path, target_size):
+    # Read and decode a PNG/JPEG to a uint8 (height, width, 3) tensor with
+    # native tf.io ops, which run in parallel without the GIL and keep the
+    # pipeline serialisable. Not the served pixels: it applies no EXIF
+    # orientation or reduced-size JPEG decoding, and its antialiased bicubic
+    # differs from Pillow's (by 1 on average on the sample data). Only for
+    # experiments where input speed matters more than train/serve parity
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, target_size, method='bicubic', antialias=True)
+    return tf.cast(tf.clip_by_value(tf.round(image), 0.0, 255.0), tf.uint8)
+
+
+def decode_image_pil(path, target_size):
+    # Decode with preprocessing.load_pixels, the webhook's own code, so
+    # training sees the pixels the served model is given. Pillow releases the
+    # GIL while decoding, but the Python around it does not, so this is slower
+    # than decode_image (see benchmarks/bench_input_pipeline.py); cache the
+    # dataset, or train from pack_dataset.py shards, to pay for it once
+    size = (target_size[1], target_size[0])
+    image = tf.numpy_function(lambda p: load_pixels(p.decode('utf-8'), size), [path], tf.uint8, stateful=False)
+    image.set_shape((target_size[0], target_size[1], 3))
+    return image
+
+
+DECODERS = {'native': decode_image, 'pil': decode_image_pil}
+
+
+def make_dataset(directories, batch_size, target_size, class_mode='categorical', shuffle=True,
+                 cache=None, shuffle_buffer=None, seed=None, augment=False, decoder='pil'):
+    # Drop-in replacement for CustomDataGenerator: yields (images, labels)
+    # batches, with images as float32 in [0, 1]. Labels are worked out once here
+    # from the directory index rather than re-parsed from paths every batch.
+    #
+    # cache='memory' keeps decoded images in RAM after the first epoch, any other
+    # string is used as an on-disk cache file prefix. augment=True applies
+    # augment_batch to every batch, after the cache, so each epoch is different.
+    # shuffle_buffer only applies to cached datasets and defaults to the whole
+    # dataset; a smaller one saves memory with an on-disk cache. decoder is
+    # 'pil' (the webhook's decoding, bit for bit) or 'native' (tf.io, faster
+    # but not the served pixels)
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder {decoder!r}, expected one of {sorted(DECODERS)}")
+    decode = DECODERS[decoder]
+    filenames, labels, classes = list_directories(directories)
+    num_classes = len(classes)
+
+    if cache is not None and shuffle:
+        # list_directories returns the files class by class, and the cache
+        # keeps the order it is filled in. Permute the list once up front so
+        # the cached copy is mixed and a buffer shuffle of it is close to IID
+        order = np.random.default_rng(seed).permutation(len(filenames))
+        filenames = [filenames[i] for i in order]
+        labels = labels[order]
+
+    dataset = tf.data.Dataset.from_tensor_slices((filenames, labels))
+
+    if cache is None:
+        # Shuffling the file list is free, do it before decoding
+        if shuffle:
+            dataset = dataset.shuffle(len(filenames), seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.map(lambda path, label: (decode(path, target_size), label),
+                              num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    else:
+        # Decode once into the cache (as uint8, a quarter of the float32 size)
+        # and shuffle the cached images every epoch
+        dataset = dataset.map(lambda path, label: (decode(path, target_size), label),
+                              num_parallel_calls=AUTOTUNE)
+        dataset = dataset.cache('' if cache == 'memory' else cache)
+        if shuffle:
+            dataset = dataset.shuffle(shuffle_buffer or len(filenames), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(lambda images, batch_labels: to_model_inputs(images, batch_labels, class_mode, num_classes),
+                          num_parallel_calls=AUTOTUNE)
+    if augment:
+        dataset = dataset.map(lambda images, batch_labels: (augment_batch(images), batch_labels),
+                              num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def to_model_inputs(images, labels, class_mode, num_classes):
+    # Scale a uint8 batch to float32 in [0, 1] and one-hot the labels if needed
+    images = tf.cast(images, tf.float32) / 255.0
+    if class_mode == 'categorical':
+        return images, tf.one_hot(labels, num_classes)
+    return images, labels
+
+
+def read_manifest(pack_dir):
+    with open(os.path.join(pack_dir, 'manifest.json'), 'r') as f:
+        return json.load(f)
+
+
+def make_packed_dataset(pack_dir, split, batch_size, class_mode='categorical', shuffle=True,
+                        shuffle_buffer=4096, seed=None, augment=False):
+    # Same batches as make_dataset, read from a directory written by
+    # pack_dataset.py. Class indices follow manifest['classes']
+    manifest = read_manifest(pack_dir)
+    num_classes = len(manifest['classes'])
+    height, width = manifest['image_size']
+    split_dir = os.path.join(pack_dir, split)
+    shards = manifest['splits'][split]['shards']
+
+    if manifest['format'] == 'npy':
+        # Memory-map every shard and shuffle over global indices, so the whole
+        # split is shuffled without loading it into memory
+        images = [np.load(os.path.join(split_dir, shard['images']), mmap_mode='r') for shard in shards]
+        labels = np.concatenate([np.load(os.path.join(split_dir, shard['labels'])) for shard in shards])
+        offsets = np.cumsum([0] + [len(shard_images) for shard_images in images])
+
+        def gather(indices):
+            # Sorting keeps the reads within each shard in file order
+            indices = np.sort(indices)
+            shard_ids = np.searchsorted(offsets, indices, side='right') - 1
+            batch = np.empty((len(indices), height, width, 3), dtype=np.uint8)
+            for shard_id in np.unique(shard_ids):
+                mask = shard_ids == shard_id
+                batch[mask] = images[shard_id][indices[mask] - offsets[shard_id]]
+            return batch, labels[indices]
+
+        def load_batch(indices):
+            batch, batch_labels = tf.numpy_function(gather, [indices], (tf.uint8, tf.int64))
+            batch.set_shape((None, height, width, 3))
+            batch_labels.set_shape((None,))
+            return batch, batch_labels
+
+        dataset = tf.data.Dataset.range(len(labels))
+        if shuffle:
+            dataset = dataset.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size).map(load_batch, num_parallel_calls=AUTOTUNE)
+    else:
+        # Stream the TFRecord shards
+        features = {
+            'image': tf.io.FixedLenFeature([], tf.string),
+            'label': tf.io.FixedLenFeature([], tf.int64),
+        }
+
+        def parse(record):
+            example = tf.io.parse_single_example(record, features)
+            image = tf.reshape(tf.io.decode_raw(example['image'], tf.uint8), (height, width, 3))
+            return image, example['label']
+
+        files = [os.path.join(split_dir, shard['file']) for shard in shards]
+        if shuffle:
+            # pack_dataset writes the images in random order, so each shard is
+            # already mixed. Read the shards in a new order every epoch,
+            # interleaving their records, and shuffle through the buffer on top
+            dataset = tf.data.Dataset.from_tensor_slices(files)
+            dataset = dataset.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+            dataset = dataset.interleave(tf.data.TFRecordDataset, num_parallel_calls=AUTOTUNE, deterministic=False)
+            dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        else:
+            dataset = tf.data.TFRecordDataset(files, num_parallel_reads=AUTOTUNE)
+        dataset = dataset.map(parse, num_parallel_calls=AUTOTUNE).batch(batch_size)
+
+    dataset = dataset.map(lambda batch, batch_labels: to_model_inputs(batch, batch_labels, class_mode, num_classes),
+                          num_parallel_calls=AUTOTUNE)
+    if augment:
+        dataset = dataset.map(lambda batch, batch_labels: (augment_batch(batch), batch_labels),
+                              num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+# RGB <-> YIQ. Hue is a rotation and saturation a scaling of the I/Q plane, so
+# both become one 3x3 colour matrix per image
+RGB_TO_YIQ = np.array([[0.299, 0.587, 0.114],
+                       [0.596, -0.274, -0.322],
+                       [0.211, -0.523, 0.312]], dtype=np.float32)
+YIQ_TO_RGB = np.linalg.inv(RGB_TO_YIQ).astype(np.float32)
+
+
+def _per_image_uniform(low, high, batch_size, probability=1.0, identity=0.0):
+    # (batch, 1, 1, 1) random values, or identity for the images the transform
+    # is not applied to
+    values = tf.random.uniform((batch_size, 1, 1, 1), low, high)
+    applied = tf.random.uniform((batch_size, 1, 1, 1)) < probability
+    return tf.where(applied, values, identity)
+
+
+def _apply_to_some(images, probability, fn):
+    # Run fn only on a random subset of the batch and put the results back, so
+    # a transform applied with p=0.2 costs a fifth of the whole batch
+    selected = tf.where(tf.random.uniform((tf.shape(images)[0],)) < probability)
+    return tf.tensor_scatter_nd_update(images, selected, fn(tf.gather_nd(images, selected)))
+
+
+def _colour_matrices(batch_size, probability):
+    # Per-image hue rotation and saturation scaling as (batch, 3, 3) matrices,
+    # new_rgb = matrix @ rgb
+    applied = tf.random.uniform((batch_size,)) < probability
+    angle = tf.where(applied, tf.random.uniform((batch_size,), -np.pi * 2 / 9, np.pi * 2 / 9), 0.0)
+    scale = tf.where(applied, tf.random.uniform((batch_size,), 0.8, 1.2), 1.0)
+    cos, sin = tf.cos(angle) * scale, tf.sin(angle) * scale
+    ones, zeros = tf.ones_like(angle), tf.zeros_like(angle)
+    yiq = tf.stack([tf.stack([ones, zeros, zeros], axis=-1),
+                    tf.stack([zeros, cos, -sin], axis=-1),
+                    tf.stack([zeros, sin, cos], axis=-1)], axis=-2)
+    return tf.einsum('ij,bjk,kl->bil', YIQ_TO_RGB, yiq, RGB_TO_YIQ)
+
+
+def augment_batch(images):
+    # Random augmentation of a float32 (batch, height, width, 3) batch in [0, 1],
+    # covering the transforms of augment_images.py's albumentations pipeline
+    # that map onto batched tensor ops. Images must be square (224x224).
+    # ShiftScaleRotate, the distortions and CLAHE/Sharpen/Emboss are left out
+    batch_size = tf.shape(images)[0]
+
+    # RandomRotate90, Flip and Transpose together give a random one of the
+    # 8 rotations/reflections of the square
+    images = _apply_to_some(images, 0.5, lambda x: tf.transpose(x, (0, 2, 1, 3)))
+    images = _apply_to_some(images, 0.5, lambda x: tf.reverse(x, axis=[2]))
+    images = _apply_to_some(images, 0.5, lambda x: tf.reverse(x, axis=[1]))
+
+    # Gaussian noise, std sqrt(10-50) on the 0-255 scale as in GaussNoise(var_limit=(10, 50))
+    def add_noise(x):
+        std = tf.sqrt(tf.random.uniform((tf.shape(x)[0], 1, 1, 1), 10.0, 50.0)) / 255.0
+        return x + tf.random.normal(tf.shape(x)) * std
+    images = _apply_to_some(images, 0.2, add_noise)
+
+    # 3x3 box blur
+    images = _apply_to_some(images, 0.2, lambda x: tf.nn.avg_pool2d(x, 3, 1, 'SAME'))
+
+    # Hue and saturation (HueSaturationValue, with the hue shift done in YIQ
+    # rather than HSV), then brightness/value and contrast, +-20% like
+    # RandomBrightnessContrast. Unselected images get the identity, so the
+    # whole batch goes through one fused pass
+    images = tf.einsum('bhwc,bdc->bhwd', images, _colour_matrices(batch_size, 0.3))
+    mean = tf.reduce_mean(images, axis=(1, 2, 3), keepdims=True)
+    contrast = _per_image_uniform(0.8, 1.2, batch_size, probability=0.3, identity=1.0)
+    brightness = _per_image_uniform(-0.2, 0.2, batch_size, probability=0.3)
+    images = (images - mean) * contrast + mean + brightness
+
+    return tf.clip_by_value(images, 0.0, 1.0)
+
+
+def class_indices(directories):
+    # {class name: index} in the same order make_dataset labels them
+    return {cls: idx for idx, cls in enumerate(list_directories(directories)[2])}
+
+
+class CustomDataGenerator(Sequence):
+    def __init__(self, directories, batch_size, target_size, class_mode='categorical', shuffle=True):
+        self.directories = directories
+        self.batch_size = batch_size
+        self.target_size = target_size
+        self.class_mode = class_mode
+        self.shuffle = shuffle
+
+        self.classes = [os.path.basename(os.path.dirname(d)) for d in directories]
+        self.class_indices = {cls: idx for idx, cls in enumerate(self.classes)}
+
+        self.filenames = []
+        for d in directories:
+            self.filenames.extend([os.path.join(d, f) for f in os.listdir(d) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
+
+        self.num_classes = len(self.classes)
+        self.indices = np.arange(len(self.filenames))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.filenames) / float(self.batch_size)))
+
+    def __getitem__(self, idx):
+        batch_indices = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
+        batch_filenames = [self.filenames[i] for i in batch_indices]
+
+        X = load_batch(batch_filenames, size=(self.target_size[1], self.target_size[0]))
+
+        if self.class_mode == 'categorical':
+            y = np.array([
+                self.class_indices[os.path.basename(os.path.dirname(os.path.dirname(f)))]
+                for f in batch_filenames
+            ])
+            y = np.eye(self.num_classes)[y]
+        elif self.class_mode == 'binary':
+            y = np.array([
+                self.class_indices[os.path.basename(os.path.dirname(os.path.dirname(f)))]
+                for f in batch_filenames
+            ])
+        else:
+            y = None
+
+        return X, y
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
@@ -0,0 +1,76 @@
+# Helpers for the training data layout: <base_dir>/<plant>/{Train,Validation,Test}/<image>
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def load_class_names(path='class_mapping.json'):
+    # Class names ordered by the model's output index
+    with open(path, 'r') as f:
+        class_mapping = json.load(f)
+    return [class_mapping[str(i)] for i in range(len(class_mapping))]
+
+
+def list_plant_folders(base_dir):
+    # Plant folders, excluding '.ipynb_checkpoints'
+    return sorted(f for f in os.listdir(base_dir)
+                  if os.path.isdir(os.path.join(base_dir, f)) and f != '.ipynb_checkpoints')
+
+
+def list_split(base_dir, split, classes=None):
+    # Return (filenames, labels, classes) for one split. Pass classes (e.g. from
+    # load_class_names) to label images with the served model's class indices.
+    # Every class must have a folder for the split, otherwise the splits would
+    # silently cover different plants
+    if classes is None:
+        classes = list_plant_folders(base_dir)
+
+    filenames = []
+    labels = []
+    for label, plant in enumerate(classes):
+        split_dir = os.path.join(base_dir, plant, split)
+        if not os.path.isdir(split_dir):
+            raise FileNotFoundError(f"No {plant}/{split} directory under {base_dir}")
+        for f in sorted(os.listdir(split_dir)):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                filenames.append(os.path.join(split_dir, f))
+                labels.append(label)
+
+    return filenames, np.array(labels, dtype=np.int64), list(classes)
+
+
+def list_directories(directories):
+    # Return (filenames, labels, classes) for split directories laid out as
+    # <plant>/<split>, labelling each plant by its position in directories, the
+    # way CustomDataGenerator does
+    classes = [os.path.basename(os.path.dirname(os.path.normpath(d))) for d in directories]
+
+    filenames = []
+    labels = []
+    for label, d in enumerate(directories):
+        for f in os.listdir(d):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                filenames.append(os.path.join(d, f))
+                labels.append(label)
+
+    return filenames, np.array(labels, dtype=np.int64), classes
+
+
+def output_names(filenames, prefix, extension):
+    # {input filename: prefix + stem + extension} for scripts that write one
+    # file per input image. Only the last extension is dropped, so 'leaf.1.jpg'
+    # and 'leaf.2.jpg' stay apart, and when two inputs differ only by extension
+    # ('leaf.jpg', 'leaf.png') the original extension is kept too
+    stems = {f: os.path.splitext(f)[0] for f in filenames}
+    counts = Counter(stem.lower() for stem in stems.values())
+
+    names = {}
+    for filename, stem in stems.items():
+        if counts[stem.lower()] > 1:
+            stem = f"{stem}_{os.path.splitext(filename)[1][1:]}"
+        names[filename] = f"{prefix}{stem}{extension}"
+    return names
@@ -0,0 +1,162 @@
+# Media downloader for Twilio attachments: pooled keep-alive connections, timeouts,
+# retries with backoff, and a streamed body that is rejected early if it is not an
+# image or grows past the size cap
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Leading bytes of the image formats Pillow can open
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+]
+
+# Enough of the body to recognise every signature above, including WebP
+SNIFF_BYTES = 16
+
+DownloadResult = namedtuple('DownloadResult', ['data', 'content_type', 'image_format', 'ttfb', 'elapsed'])
+
+
+class DownloadError(Exception):
+    pass
+
+
+class HTTPStatusError(DownloadError):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP status code: {status_code}")
+        self.status_code = status_code
+
+
+class NotAnImageError(DownloadError):
+    pass
+
+
+class UnrecognisedImageError(DownloadError):
+    pass
+
+
+class MediaTooLargeError(DownloadError):
+    pass
+
+
+def sniff_image_format(head):
+    # Identify the image format from its magic bytes, or None if unknown
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class MediaDownloader:
+    def __init__(self, auth=None, max_bytes=10 * 1024 * 1024, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff_factor=0.3, pool_maxsize=10, chunk_size=64 * 1024, timing_window=1000):
+        self.max_bytes = int(max_bytes)
+        self.timeout = (connect_timeout, read_timeout)
+        self.chunk_size = int(chunk_size)
+
+        # Retry connection errors and transient server responses with
+        # exponential backoff. The last response is returned rather than raised
+        # so its status code can be reported
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        # One session per process keeps TLS connections to the media CDN alive
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._downloads = 0
+        self._failures = 0
+        self._bytes = 0
+        self._ttfb = deque(maxlen=timing_window)
+        self._elapsed = deque(maxlen=timing_window)
+
+    def download(self, url):
+        # Fetch an image, raising a DownloadError subclass (or a requests
+        # exception) if it cannot be used
+        started = time.perf_counter()
+        try:
+            result = self._download(url, started)
+        except Exception:
+            with self._stats_lock:
+                self._failures += 1
+            raise
+
+        with self._stats_lock:
+            self._downloads += 1
+            self._bytes += len(result.data)
+            self._ttfb.append(result.ttfb)
+            self._elapsed.append(result.elapsed)
+        return result
+
+    def _download(self, url, started):
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            ttfb = time.perf_counter() - started
+
+            if response.status_code != 200:
+                raise HTTPStatusError(response.status_code)
+
+            content_type = response.headers.get('Content-Type', '')
+            if 'image' not in content_type:
+                raise NotAnImageError(f"Unexpected content type: {content_type}")
+
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                raise MediaTooLargeError(f"Image is {content_length} bytes, the limit is {self.max_bytes}")
+
+            chunks = []
+            size = 0
+            image_format = None
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise MediaTooLargeError(f"Image is larger than {self.max_bytes} bytes")
+
+                # Check the magic bytes as soon as we have them, before the rest
+                # of the body is transferred
+                if image_format is None and size >= SNIFF_BYTES:
+                    image_format = sniff_image_format(b''.join(chunks)[:SNIFF_BYTES])
+                    if image_format is None:
+                        raise UnrecognisedImageError("Image format not recognised")
+
+            data = b''.join(chunks)
+            if image_format is None:
+                image_format = sniff_image_format(data)
+                if image_format is None:
+                    raise UnrecognisedImageError("Image format not recognised")
+
+        return DownloadResult(data, content_type, image_format, ttfb, time.perf_counter() - started)
+
+    def stats(self):
+        with self._stats_lock:
+            ttfb = np.array(self._ttfb) * 1000.0
+            elapsed = np.array(self._elapsed) * 1000.0
+            return {
+                'downloads': self._downloads,
+                'failures': self._failures,
+                'bytes': self._bytes,
+                'ttfb_ms_p50': float(np.percentile(ttfb, 50)) if len(ttfb) else 0.0,
+                'elapsed_ms_p50': float(np.percentile(elapsed, 50)) if len(elapsed) else 0.0,
+                'elapsed_ms_p95': float(np.percentile(elapsed, 95)) if len(elapsed) else 0.0,
+            }
@@ -50,76 +50,42 @@ num_classes = len(plant_folders)
 epochs = 10 # reduced from 30
 
 import numpy as np
-from tensorflow.keras.utils import Sequence
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
-
-class CustomDataGenerator(Sequence):
-    def __init__(self, directories, batch_size, target_size, class_mode='categorical', shuffle=True):
-        self.directories = directories
-        self.batch_size = batch_size
-        self.target_size = target_size
-        self.class_mode = class_mode
-        self.shuffle = shuffle
-
-        self.classes = [os.path.basename(os.path.dirname(d)) for d in directories]
-        self.class_indices = {cls: idx for idx, cls in enumerate(self.classes)}
-
-        self.filenames = []
-        for d in directories:
-            self.filenames.extend([os.path.join(d, f) for f in os.listdir(d) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-
-        self.num_classes = len(self.classes)
-        self.indices = np.arange(len(self.filenames))
-        self.on_epoch_end()
-
-    def __len__(self):
-        return int(np.ceil(len(self.filenames) / float(self.batch_size)))
-
-    def __getitem__(self, idx):
-        batch_indices = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
-        batch_filenames = [self.filenames[i] for i in batch_indices]
-
-        X = np.array([
-            img_to_array(load_img(f, target_size=self.target_size)) / 255.0
-            for f in batch_filenames
-        ])
-
-        if self.class_mode == 'categorical':
-            y = np.array([
-                self.class_indices[os.path.basename(os.path.dirname(os.path.dirname(f)))]
-                for f in batch_filenames
-            ])
-            y = np.eye(self.num_classes)[y]
-        elif self.class_mode == 'binary':
-            y = np.array([
-                self.class_indices[os.path.basename(os.path.dirname(os.path.dirname(f)))]
-                for f in batch_filenames
-            ])
-        else:
-            y = None
-
-        return X, y
-
-    def on_epoch_end(self):
-        if self.shuffle:
-            np.random.shuffle(self.indices)
-
-# Create generators
-train_generator = CustomDataGenerator(train_dirs, batch_size, img_size)
-validation_generator = CustomDataGenerator(validation_dirs, batch_size, img_size)
-test_generator = CustomDataGenerator(test_dirs, batch_size, img_size)
+
+# The helper modules (data_pipeline.py, dataset.py, model_export.py) come from
+# the Dr-Roots repository, clone it into the Colab runtime and add it to sys.path
+from data_pipeline import make_dataset, make_packed_dataset, class_indices, read_manifest
+
+# Training batches are augmented on the fly (augment=True, see augment_batch),
+# so augment_images.py copies are no longer needed in the training folders.
+# Set packed_dir to a directory written by pack_dataset.py (copied to the local
+# disk, e.g. /content/packed) to train from a few large shards instead of
+# reading every JPEG from Google Drive. Either way the images are decoded with
+# the webhook's preprocessing, so the model trains on exactly the pixels it is
+# served
+packed_dir = None
+
+if packed_dir:
+    train_generator = make_packed_dataset(packed_dir, 'Train', batch_size, shuffle=True, augment=True)
+    validation_generator = make_packed_dataset(packed_dir, 'Validation', batch_size, shuffle=False)
+    test_generator = make_packed_dataset(packed_dir, 'Test', batch_size, shuffle=False)
+    train_class_indices = {cls: idx for idx, cls in enumerate(read_manifest(packed_dir)['classes'])}
+else:
+    # Create tf.data pipelines: images are decoded in parallel and batches are
+    # prefetched while the model trains. The training and validation images are
+    # cached in memory after the first epoch, so they are only decoded once; use
+    # a file path instead of 'memory' to cache on disk
+    train_generator = make_dataset(train_dirs, batch_size, img_size, shuffle=True, cache='memory', augment=True)
+    validation_generator = make_dataset(validation_dirs, batch_size, img_size, shuffle=False, cache='memory')
+    test_generator = make_dataset(test_dirs, batch_size, img_size, shuffle=False)
+    train_class_indices = class_indices(train_dirs)
 
 # Print class indices
-print("Class indices:", train_generator.class_indices)
+print("Class indices:", train_class_indices)
 
 # Invert the dictionary to map indices to class names
-idx_to_class = {v: k for k, v in train_generator.class_indices.items()}
+idx_to_class = {v: k for k, v in train_class_indices.items()}
 print("Index to class mapping:", idx_to_class)
 
-# Calculate steps per epoch
-steps_per_epoch = len(train_generator)
-validation_steps = len(validation_generator)
-
 """## **Training the model**"""
 
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
@@ -160,25 +126,27 @@ model.compile(optimizer=Adam(learning_rate=0.001),
 # Print model summary
 model.summary()
 
-# Calculate total number of samples
-train_samples = sum([len(os.listdir(d)) for d in train_dirs])
-val_samples = sum([len(os.listdir(d)) for d in validation_dirs])
-
-# Train the model
+# Train the model, one full pass over the training split per epoch
 history = model.fit(
     train_generator,
-    steps_per_epoch=train_samples // batch_size,
     epochs=epochs,
     validation_data=validation_generator,
-    validation_steps=val_samples // batch_size,
     verbose=1
 )
 
 """## **Evaluating the Model**"""
 
-# Evaluate the model
-test_loss, test_accuracy = model.evaluate(test_generator)
+# Evaluate the model in one streaming pass over the test split, in large
+# batches. The loss, accuracy, confusion matrices, per-class precision/recall
+# and calibration below all come from this single pass
+from evaluation import evaluate, format_report, keras_predictor, tflite_predictor
+
+class_names = [idx_to_class[i] for i in range(len(idx_to_class))]
+test_batches = test_generator.unbatch().batch(256)
+test_results = evaluate(keras_predictor(model), test_batches, len(class_names))
+test_loss, test_accuracy = test_results['loss'], test_results['accuracy']
 print(f"Test accuracy: {test_accuracy:.2f}")
+print(format_report(test_results, class_names))
 
 import matplotlib.pyplot as plt
 
@@ -210,31 +178,10 @@ plt.show()
 
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.metrics import confusion_matrix
 import seaborn as sns
 
-# Assuming your custom generator is called 'test_generator'
-
-# Get the true labels
-y_true = []
-y_pred = []
-
-# Iterate through the entire dataset
-for i in range(len(test_generator)):
-    x, y = test_generator[i]
-    batch_pred = model.predict(x)
-    y_true.extend(np.argmax(y, axis=1))
-    y_pred.extend(np.argmax(batch_pred, axis=1))
-
-# Convert to numpy arrays
-y_true = np.array(y_true)
-y_pred = np.array(y_pred)
-
-# Compute confusion matrix
-cm = confusion_matrix(y_true, y_pred)
-
-# Get class names (you might need to provide these manually if not available in the generator)
-class_names = list(range(num_classes))  # Replace with actual class names if available
+# Confusion matrix from the evaluation pass
+cm = test_results['confusion_matrix']
 
 # Plot the confusion matrix
 plt.figure(figsize=(10, 8))
@@ -247,47 +194,16 @@ plt.show()
 
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.metrics import confusion_matrix
 import seaborn as sns
 
-# Assuming your custom generator is called 'test_generator'
-
-# Get the true labels and predictions
-y_true = []
-y_pred = []
-
-# Iterate through the entire dataset
-for i in range(len(test_generator)):
-    x, y = test_generator[i]
-    batch_pred = model.predict(x)
-    y_true.extend(np.argmax(y, axis=1))
-    y_pred.extend(np.argmax(batch_pred, axis=1))
-
-# Convert to numpy arrays
-y_true = np.array(y_true)
-y_pred = np.array(y_pred)
-
-# Get the number of classes
-num_classes = len(np.unique(y_true))
-
-# Create one-vs-all confusion matrices
-one_vs_all_cms = []
-
-for i in range(num_classes):
-    # Create binary classifications
-    y_true_binary = (y_true == i).astype(int)
-    y_pred_binary = (y_pred == i).astype(int)
-
-    # Compute confusion matrix
-    cm = confusion_matrix(y_true_binary, y_pred_binary)
-    one_vs_all_cms.append(cm)
+# One-vs-all confusion matrices ([[TN, FP], [FN, TP]] per class), also from
+# the evaluation pass
+one_vs_all_cms = test_results['one_vs_all']
 
 # Plot the one-vs-all confusion matrices
 fig, axes = plt.subplots(nrows=(num_classes+1)//2, ncols=2, figsize=(15, 5*((num_classes+1)//2)))
 axes = axes.flatten()
 
-class_names = [f'Class {i}' for i in range(num_classes)]  # Replace with actual class names if available
-
 for i, cm in enumerate(one_vs_all_cms):
     sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', ax=axes[i],
                 xticklabels=['Other', class_names[i]],
@@ -331,21 +247,16 @@ print(f"Class mapping saved to {class_mapping_path}")
 """## **Testing Predictions**"""
 
 from google.colab import files
-from PIL import Image
-import io
+from preprocessing import open_image, to_input_array
 
 def predict_uploaded_image(model, class_mapping):
     # Upload an image
     uploaded = files.upload()
 
     for fn in uploaded.keys():
-        # Open the uploaded image
-        image = Image.open(io.BytesIO(uploaded[fn]))
-
-        # Preprocess the image
-        image = image.resize((224, 224))
-        image_array = np.array(image) / 255.0
-        image_array = np.expand_dims(image_array, axis=0)
+        # Open and preprocess the image exactly as the webhook does
+        image = open_image(uploaded[fn])
+        image_array = to_input_array(image)[np.newaxis]
 
         # Make prediction
         prediction = model.predict(image_array)
@@ -372,10 +283,30 @@ import tensorflow as tf
 # Load your model
 model = tf.keras.models.load_model("/content/drive/MyDrive/medicinal_plants/dr_roots_model.h5")
 
-# Convert the model
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
-tflite_model = converter.convert()
-
-# Save the model
-with open('/content/drive/MyDrive/medicinal_plants/dr_roots_model.tflite', 'wb') as f:
-    f.write(tflite_model)
\ No newline at end of file
+# Convert the model to TFLite: the plain float32 model plus dynamic-range, full
+# int8 and float16 variants. The int8 activation ranges are calibrated on
+# images from the validation split
+from model_export import export_variants
+
+tflite_paths = export_variants(model, '/content/drive/MyDrive/medicinal_plants', validation_generator)
+print("Exported TFLite models:", tflite_paths)
+
+# Calibrate each exported model on the validation split: a temperature that
+# makes its confidence match its accuracy, and per-class confidence cutoffs.
+# Saved next to the model as dr_roots_model*.calibration.json, which the webhook
+# loads in place of its fixed 0.7 cutoff, so deploy it with the .tflite file
+from calibration import Calibration, calibration_filename
+from evaluation import collect_predictions
+
+# Then check each model on the test split, the same single pass as above,
+# with calibrated scores
+for variant, path in tflite_paths.items():
+    predict = tflite_predictor(path)
+    validation_labels, validation_probabilities = collect_predictions(predict, validation_generator)
+    calibration = Calibration.fit(validation_probabilities, validation_labels, target_precision=0.9)
+    calibration.save(calibration_filename(path))
+
+    print(f"\n{variant}: temperature {calibration.temperature:.3f}, cutoffs",
+          {class_names[cls]: threshold for cls, threshold in calibration.thresholds.items()})
+    print(format_report(evaluate(lambda images: calibration.calibrate(predict(images)), test_batches,
+                                 len(class_names), thresholds=[0.5, 0.6, 0.7, 0.8, 0.9]), class_names))
@@ -0,0 +1,206 @@
+# Regression test for a deployed .tflite artefact: run the model the way the
+# webhook serves it (InterpreterPool, prepare_image on the raw file bytes,
+# to_input_array straight into the input tensor) over a labelled
+# <plant>/<split> tree, spread across worker processes that each build their
+# own interpreter, and report accuracy, the confusion matrix, per-class
+# metrics, a sweep of confidence cutoffs and images/sec. Scores are calibrated
+# with the model's .calibration.json when there is one, as the webhook does,
+# and 'served' reports how many photos the webhook's cutoffs would answer and
+# how often those answers are right.
+#
+# --json writes the full result for machine use. Pass --baseline with an
+# earlier --json result to gate a model swap: the script exits non-zero when
+# accuracy, accuracy or coverage at the served cutoffs or throughput drop by
+# more than the allowed margins.
+#
+# Usage:
+#     python evaluate_tflite.py /content/drive/MyDrive/medicinal_plants/data --variant int8 --json int8.json
+#     python evaluate_tflite.py data --variant int8 --baseline float32.json --max-accuracy-drop 0.01
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from PIL import Image
+
+from calibration import Calibration, calibration_filename
+from dataset import list_split, load_class_names
+from evaluation import StreamingEvaluator, format_report, to_json
+from interpreter_pool import InterpreterPool
+from model_export import MODEL_VARIANTS, model_filename
+from preprocessing import prepare_image, to_input_array
+
+THRESHOLDS = tuple(round(t, 2) for t in np.arange(0.3, 1.0, 0.05))
+
+# Per worker process
+_pool = None
+_crop = False
+
+
+def init_worker(model_path, num_threads, crop):
+    global _pool, _crop
+    _pool = InterpreterPool(model_path, num_threads=num_threads)
+    _pool.warm()
+    _crop = crop
+
+
+def predict_file(runner, path):
+    with open(path, 'rb') as f:
+        image = prepare_image(Image.open(io.BytesIO(f.read())), crop=_crop)
+    runner.write_input(lambda view: to_input_array(image, out=view[0]))
+    return runner.invoke()[0].copy()
+
+
+def predict_chunk(paths):
+    # (probabilities, per-image seconds) for a chunk of files, one invoke per
+    # image as the webhook does without request batching
+    probabilities = []
+    seconds = []
+    with _pool.acquire() as runner:
+        for path in paths:
+            started = time.perf_counter()
+            probabilities.append(predict_file(runner, path))
+            seconds.append(time.perf_counter() - started)
+    return np.stack(probabilities), np.asarray(seconds)
+
+
+def evaluate_tflite(data_dir, model_path, split='Test', class_mapping='class_mapping.json',
+                    workers=None, num_threads=1, chunksize=16, crop=False, calibration=None):
+    calibration = calibration or Calibration()
+    classes = load_class_names(class_mapping)
+    filenames, labels, _ = list_split(data_dir, split, classes)
+    if not filenames:
+        raise ValueError(f"No {split} images found under {data_dir}")
+
+    evaluator = StreamingEvaluator(len(classes), thresholds=THRESHOLDS)
+    latencies = []
+    accepted = correct = 0
+    workers = workers or cpu_count()
+    chunks = [filenames[i:i + chunksize] for i in range(0, len(filenames), chunksize)]
+
+    with Pool(workers, initializer=init_worker, initargs=(model_path, num_threads, crop)) as pool:
+        # Interpreters are built and warmed in the initialiser, so time from the
+        # first chunk. imap keeps chunk order, so labels line up by offset
+        started = time.perf_counter()
+        offset = 0
+        for probabilities, seconds in pool.imap(predict_chunk, chunks):
+            chunk_labels = labels[offset:offset + len(probabilities)]
+            probabilities = calibration.calibrate(probabilities)
+            evaluator.update(chunk_labels, probabilities)
+
+            # What the webhook would do: name the plant when the calibrated
+            # confidence clears that class's cutoff
+            predictions = probabilities.argmax(axis=1)
+            answered = probabilities.max(axis=1) >= np.array([calibration.threshold(c) for c in predictions])
+            accepted += int(answered.sum())
+            correct += int((answered & (predictions == chunk_labels)).sum())
+            latencies.append(seconds)
+            offset += len(probabilities)
+        elapsed = time.perf_counter() - started
+
+    latencies = np.concatenate(latencies)
+    result = evaluator.result()
+    result.update({
+        'model': os.path.basename(model_path),
+        'model_bytes': os.path.getsize(model_path),
+        'split': split,
+        'classes': classes,
+        'crop_to_leaf': crop,
+        'model_calibration': calibration.to_dict(),
+        'served': {
+            'coverage': accepted / len(filenames),
+            'accuracy': correct / accepted if accepted else 0.0,
+            'accepted': accepted,
+            'correct': correct,
+        },
+        'throughput': {
+            'workers': workers,
+            'num_threads': num_threads,
+            'seconds': elapsed,
+            'images_per_sec': len(filenames) / elapsed,
+            'latency_ms_p50': float(np.percentile(latencies, 50) * 1000),
+            'latency_ms_p95': float(np.percentile(latencies, 95) * 1000),
+        },
+    })
+    return result
+
+
+def compare(result, baseline, max_accuracy_drop=0.0, max_throughput_drop=0.1):
+    # Reasons result regresses on baseline, empty when the swap is safe.
+    # Throughput is only comparable when both runs used the same machine and workers
+    failures = []
+    checks = [
+        ('accuracy', result['accuracy'], baseline['accuracy']),
+        ('accuracy of served answers', result['served']['accuracy'], baseline['served']['accuracy']),
+        ('coverage of served answers', result['served']['coverage'], baseline['served']['coverage']),
+    ]
+    for name, value, reference in checks:
+        if value < reference - max_accuracy_drop:
+            failures.append(f"{name} {value:.4f} < baseline {reference:.4f} - {max_accuracy_drop}")
+
+    value = result['throughput']['images_per_sec']
+    reference = baseline['throughput']['images_per_sec']
+    if value < reference * (1.0 - max_throughput_drop):
+        failures.append(f"throughput {value:.1f} images/sec < baseline {reference:.1f} - {max_throughput_drop:.0%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the served TFLite model on a labelled image tree')
+    parser.add_argument('data_dir', help='Directory containing <plant>/<split> folders')
+    parser.add_argument('--split', default='Test')
+    parser.add_argument('--model', help='Path to a .tflite file (default: the file for --variant)')
+    parser.add_argument('--variant', default=os.getenv('MODEL_VARIANT', 'float32'), choices=MODEL_VARIANTS,
+                        help='Model variant, as MODEL_VARIANT selects it for the app')
+    parser.add_argument('--class-mapping', default='class_mapping.json')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--num-threads', type=int, default=int(os.getenv('INTERPRETER_NUM_THREADS', 1)),
+                        help='Interpreter threads per worker, as INTERPRETER_NUM_THREADS')
+    parser.add_argument('--crop-to-leaf', action='store_true',
+                        default=os.getenv('CROP_TO_LEAF', 'false').lower() in ('1', 'true', 'yes'))
+    parser.add_argument('--no-calibration', action='store_true',
+                        help="Ignore the model's .calibration.json and use raw scores with the 0.7 cutoff")
+    parser.add_argument('--json', help='Write the full result to this file')
+    parser.add_argument('--baseline', help='Earlier --json result to compare against')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.0,
+                        help='Allowed absolute drop in accuracy and coverage (default 0)')
+    parser.add_argument('--max-throughput-drop', type=float, default=0.1,
+                        help='Allowed fractional drop in images/sec (default 0.1)')
+    args = parser.parse_args()
+
+    model_path = args.model or model_filename(args.variant)
+    calibration = Calibration() if args.no_calibration else Calibration.load(calibration_filename(model_path))
+    result = evaluate_tflite(args.data_dir, model_path, args.split, args.class_mapping,
+                             args.workers, args.num_threads, crop=args.crop_to_leaf, calibration=calibration)
+
+    throughput = result['throughput']
+    print(f"{result['model']} on {result['split']}: {throughput['images_per_sec']:.1f} images/sec with "
+          f"{throughput['workers']} workers, p50 {throughput['latency_ms_p50']:.1f} ms, "
+          f"p95 {throughput['latency_ms_p95']:.1f} ms")
+    print(format_report(result, result['classes']))
+    served = result['served']
+    print(f"\nserved cutoffs (temperature {calibration.temperature:.3f}): answers {served['coverage']:.1%} "
+          f"of photos, {served['accuracy']:.1%} of them correctly")
+    print(f"\nconfusion matrix (rows: true class, columns: predicted)\n{result['confusion_matrix']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(to_json(result), f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(result, baseline, args.max_accuracy_drop, args.max_throughput_drop)
+        for failure in failures:
+            print(f"REGRESSION: {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"No regression against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# Offline evaluation of the plant classifier in a single streaming pass over a
+# labelled split. Each batch of predictions is folded into running totals, from
+# which accuracy, loss, top-k accuracy, the confusion matrix, per-class
+# precision/recall, one-vs-all matrices and calibration are all derived, so
+# every test image is decoded and run through the model exactly once.
+#
+# Works with the Keras model during training and with an exported .tflite file
+# (see keras_predictor and tflite_predictor)
+import numpy as np
+
+
+class StreamingEvaluator:
+    def __init__(self, num_classes, top_k=(1, 3), calibration_bins=10, thresholds=None):
+        self.num_classes = num_classes
+        self.top_k = tuple(k for k in top_k if k <= num_classes)
+        self.calibration_bins = calibration_bins
+        # Confidence cutoffs to sweep, like the webhook's 'confidence >= 0.7'
+        self.thresholds = np.asarray(thresholds if thresholds is not None else [], dtype=np.float64)
+        self.threshold_accepted = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.threshold_correct = np.zeros(len(self.thresholds), dtype=np.int64)
+
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.top_k_correct = {k: 0 for k in self.top_k}
+        self.loss_sum = 0.0
+        self.count = 0
+
+        # Per confidence bin: images, summed confidence, correct predictions
+        self.bin_counts = np.zeros(calibration_bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(calibration_bins, dtype=np.float64)
+        self.bin_correct = np.zeros(calibration_bins, dtype=np.int64)
+
+    def update(self, labels, probabilities):
+        # labels: (N,) class indices or (N, num_classes) one-hot
+        # probabilities: (N, num_classes) model output
+        labels = np.asarray(labels)
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if labels.ndim == 2:
+            labels = labels.argmax(axis=1)
+        labels = labels.astype(np.int64)
+        rows = np.arange(len(labels))
+
+        predictions = probabilities.argmax(axis=1)
+        self.confusion += np.bincount(labels * self.num_classes + predictions,
+                                      minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+
+        # A label is in the top k when fewer than k classes score higher
+        label_scores = probabilities[rows, labels]
+        higher = (probabilities > label_scores[:, None]).sum(axis=1)
+        for k in self.top_k:
+            self.top_k_correct[k] += int((higher < k).sum())
+
+        # Categorical cross-entropy, as model.evaluate reports it
+        self.loss_sum += float(-np.log(np.clip(label_scores, 1e-7, 1.0)).sum())
+        self.count += len(labels)
+
+        confidence = probabilities[rows, predictions]
+        bins = np.minimum((confidence * self.calibration_bins).astype(np.int64), self.calibration_bins - 1)
+        self.bin_counts += np.bincount(bins, minlength=self.calibration_bins)
+        self.bin_confidence += np.bincount(bins, weights=confidence, minlength=self.calibration_bins)
+        self.bin_correct += np.bincount(bins, weights=predictions == labels, minlength=self.calibration_bins).astype(np.int64)
+
+        accepted = confidence[None, :] >= self.thresholds[:, None]
+        self.threshold_accepted += accepted.sum(axis=1)
+        self.threshold_correct += (accepted & (predictions == labels)[None, :]).sum(axis=1)
+
+    def result(self):
+        confusion = self.confusion
+        true_positives = np.diag(confusion)
+        predicted = confusion.sum(axis=0)
+        actual = confusion.sum(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+            recall = np.where(actual > 0, true_positives / actual, 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+        # [[TN, FP], [FN, TP]] per class, the layout sklearn gives for binary labels
+        false_positives = predicted - true_positives
+        false_negatives = actual - true_positives
+        true_negatives = self.count - true_positives - false_positives - false_negatives
+        one_vs_all = np.stack([np.stack([true_negatives, false_positives], axis=1),
+                               np.stack([false_negatives, true_positives], axis=1)], axis=1)
+
+        nonempty = self.bin_counts > 0
+        bin_confidence = np.where(nonempty, self.bin_confidence / np.maximum(self.bin_counts, 1), 0.0)
+        bin_accuracy = np.where(nonempty, self.bin_correct / np.maximum(self.bin_counts, 1), 0.0)
+        # Expected calibration error: confidence/accuracy gap weighted by bin size
+        ece = float((np.abs(bin_confidence - bin_accuracy) * self.bin_counts).sum() / max(self.count, 1))
+
+        return {
+            'count': self.count,
+            'accuracy': float(true_positives.sum() / max(self.count, 1)),
+            'loss': self.loss_sum / max(self.count, 1),
+            'top_k_accuracy': {k: correct / max(self.count, 1) for k, correct in self.top_k_correct.items()},
+            'confusion_matrix': confusion,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'support': actual,
+            'one_vs_all': one_vs_all,
+            'calibration': {
+                'bin_edges': np.linspace(0.0, 1.0, self.calibration_bins + 1),
+                'bin_counts': self.bin_counts.copy(),
+                'bin_confidence': bin_confidence,
+                'bin_accuracy': bin_accuracy,
+                'ece': ece,
+            },
+            # Per cutoff: the share of images answered (coverage) and the
+            # accuracy of those answers; the rest get 'not confident enough'
+            'threshold_sweep': [
+                {
+                    'threshold': float(threshold),
+                    'coverage': int(accepted) / max(self.count, 1),
+                    'accuracy': int(correct) / accepted if accepted else 0.0,
+                    'accepted': int(accepted),
+                    'correct': int(correct),
+                }
+                for threshold, accepted, correct in zip(self.thresholds, self.threshold_accepted, self.threshold_correct)
+            ],
+        }
+
+
+def keras_predictor(model):
+    # predict(images) -> probabilities for a Keras model
+    def predict(images):
+        return np.asarray(model.predict_on_batch(images))
+    return predict
+
+
+def tflite_predictor(model_path, num_threads=None, interpreter_cls=None):
+    # predict(images) -> probabilities for an exported .tflite model, any
+    # variant. The interpreter is resized to each batch, so large batches run
+    # in one invoke
+    from interpreter_pool import load_interpreter_class
+    from inference import ModelRunner
+
+    interpreter_cls = interpreter_cls or load_interpreter_class()
+    interpreter = interpreter_cls(model_path=model_path, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    runner = ModelRunner(interpreter)
+
+    def predict(images):
+        images = np.asarray(images, dtype=np.float32)
+        runner.write_input(lambda view: np.copyto(view, images), batch_size=len(images))
+        return np.array(runner.invoke())
+    return predict
+
+
+def evaluate(predict, batches, num_classes, top_k=(1, 3), calibration_bins=10, thresholds=None):
+    # Run predict over (images, labels) batches once, e.g. a tf.data pipeline
+    # from data_pipeline (which prefetches the next batch meanwhile)
+    evaluator = StreamingEvaluator(num_classes, top_k, calibration_bins, thresholds)
+    for images, labels in batches:
+        evaluator.update(np.asarray(labels), predict(np.asarray(images)))
+    return evaluator.result()
+
+
+def collect_predictions(predict, batches):
+    # (labels, probabilities) for every image in batches, for fitting on, e.g.
+    # calibration.Calibration.fit on the validation split
+    labels, probabilities = [], []
+    for images, batch_labels in batches:
+        batch_labels = np.asarray(batch_labels)
+        labels.append(batch_labels.argmax(axis=1) if batch_labels.ndim == 2 else batch_labels)
+        probabilities.append(predict(np.asarray(images)))
+    return np.concatenate(labels), np.concatenate(probabilities)
+
+
+def format_report(result, class_names=None):
+    # Plain-text summary of an evaluate() result
+    class_names = class_names or [str(i) for i in range(len(result['support']))]
+    width = max(len(name) for name in class_names)
+    lines = [
+        f"{result['count']} images, accuracy {result['accuracy']:.4f}, loss {result['loss']:.4f}, "
+        + ', '.join(f"top-{k} {acc:.4f}" for k, acc in result['top_k_accuracy'].items())
+        + f", ECE {result['calibration']['ece']:.4f}",
+        '',
+        f"{'class':<{width}} {'precision':>9} {'recall':>9} {'f1':>9} {'support':>9}",
+    ]
+    for i, name in enumerate(class_names):
+        lines.append(f"{name:<{width}} {result['precision'][i]:>9.4f} {result['recall'][i]:>9.4f} "
+                     f"{result['f1'][i]:>9.4f} {result['support'][i]:>9d}")
+    if result['threshold_sweep']:
+        lines += ['', f"{'threshold':>9} {'coverage':>9} {'accuracy':>9}"]
+        for row in result['threshold_sweep']:
+            lines.append(f"{row['threshold']:>9.2f} {row['coverage']:>9.4f} {row['accuracy']:>9.4f}")
+    return '\n'.join(lines)
+
+
+def to_json(result):
+    # evaluate() result with the NumPy arrays as plain lists, for json.dump
+    if isinstance(result, dict):
+        return {str(key): to_json(value) for key, value in result.items()}
+    if isinstance(result, (list, tuple)):
+        return [to_json(value) for value in result]
+    if isinstance(result, np.ndarray):
+        return result.tolist()
+    if isinstance(result, np.generic):
+        return result.item()
+    return result
@@ -0,0 +1,36 @@
+# Gunicorn settings, picked up automatically by `gunicorn app:app` (see Procfile).
+# Gunicorn binds to $PORT and reads WEB_CONCURRENCY for the worker count itself
+import os
+
+# Threads per worker. Set INTERPRETER_POOL_SIZE to match (it defaults to this)
+# so every thread can run inference at the same time
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# Import the app once in the master and fork workers from it, so the interpreter
+# runtime is shared copy-on-write between workers. Also set by --preload
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    # Runs in the master before any worker is forked. server.cfg holds the
+    # settings from the command line as well as this file
+    if server.cfg.preload_app:
+        import app
+        app.preload()
+
+
+def on_starting(server):
+    # prometheus_client's multiprocess files must not outlive the workers that
+    # wrote them, start every run with an empty directory
+    multiprocess_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiprocess_dir:
+        os.makedirs(multiprocess_dir, exist_ok=True)
+        for name in os.listdir(multiprocess_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(multiprocess_dir, name))
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
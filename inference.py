@@ -0,0 +1,254 @@
+# Inference helpers for the TFLite plant classifier, including a micro-batching
+# engine that groups concurrent requests into a single interpreter invoke
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class InferenceError(RuntimeError):
+    # The interpreter failed to load, resize or run. Raised in place of the
+    # runtime's own ValueError/RuntimeError so callers can tell a model failure
+    # from a bad input
+    pass
+
+
+class ModelRunner:
+    # Wraps one interpreter with its tensor indices and shapes looked up once at
+    # load time instead of on every request
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        self.input_index = input_details['index']
+        self.output_index = output_details['index']
+        self.input_shape = tuple(input_details['shape'][1:])
+        self.num_classes = int(output_details['shape'][-1])
+        self.batch_size = int(input_details['shape'][0])
+
+        # Full-integer models take and return int8/uint8 tensors, described by
+        # (scale, zero_point) so that real = (quantised - zero_point) * scale
+        self.input_dtype = input_details['dtype']
+        self.output_dtype = output_details['dtype']
+        self.input_quantization = input_details['quantization']
+        self.output_quantization = output_details['quantization']
+        self.quantized_input = self.input_dtype != np.float32
+        self._scratch = None
+
+    def resize(self, batch_size):
+        # Only resize when the batch size changes, allocate_tensors() re-plans
+        # the whole tensor arena and is not free
+        if batch_size != self.batch_size:
+            try:
+                self.interpreter.resize_tensor_input(self.input_index, [batch_size, *self.input_shape])
+                self.interpreter.allocate_tensors()
+            except (ValueError, RuntimeError) as e:
+                raise InferenceError(f"Could not resize the interpreter to batch size {batch_size}: {e}") from e
+            self.batch_size = batch_size
+
+    def write_input(self, fill, batch_size=1):
+        # Call fill(view) with a float32 numpy view of the interpreter's own input
+        # tensor so preprocessing can write into it without an intermediate
+        # array. The view must not outlive fill(), the interpreter refuses to
+        # invoke while references to its buffers are held
+        self.resize(batch_size)
+        if not self.quantized_input:
+            fill(self._input_tensor())
+            return
+
+        # Quantised inputs are filled in float32 first, then quantised in place
+        # into the input tensor
+        if self._scratch is None or len(self._scratch) < batch_size:
+            self._scratch = np.empty((batch_size, *self.input_shape), dtype=np.float32)
+        scratch = self._scratch[:batch_size]
+        fill(scratch)
+        self._quantize_input(scratch)
+
+    def _quantize_input(self, values):
+        scale, zero_point = self.input_quantization
+        info = np.iinfo(self.input_dtype)
+        values /= scale
+        values += zero_point
+        np.rint(values, out=values)
+        np.clip(values, info.min, info.max, out=values)
+        self._input_tensor()[...] = values
+
+    def _input_tensor(self):
+        try:
+            return self.interpreter.tensor(self.input_index)()
+        except (ValueError, RuntimeError) as e:
+            raise InferenceError(f"Could not access the input tensor: {e}") from e
+
+    def invoke(self):
+        # Run the model and return a copy of the (N, num_classes) float output
+        try:
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_index)
+        except (ValueError, RuntimeError) as e:
+            raise InferenceError(f"Inference failed: {e}") from e
+        if self.output_dtype == np.float32:
+            return output
+        scale, zero_point = self.output_quantization
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def run(self, images, batch_size=None):
+        # Copy a sequence of preprocessed images into the input tensor and run
+        # them. With batch_size, the batch is zero-padded up to that size so the
+        # interpreter keeps one shape instead of being resized for every batch,
+        # and only the rows for images are returned
+        batch_size = batch_size or len(images)
+
+        def fill(view):
+            for i, image_array in enumerate(images):
+                view[i] = image_array
+            view[len(images):] = 0
+
+        self.write_input(fill, batch_size=batch_size)
+        return self.invoke()[:len(images)]
+
+
+class BatchingEngine:
+    def __init__(self, pool, max_batch_size=8, max_wait_ms=5.0, num_workers=None, latency_window=1000,
+                 batch_sizes=None):
+        self.pool = pool
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        # Shapes the interpreters are run at. Each batch is padded up to the
+        # smallest of these that fits, so under load the interpreters are not
+        # resized (and their tensors re-allocated) every time the batch size
+        # changes. By default 1 and max_batch_size, so a lone request (the
+        # usual case under light load) runs unpadded and a busy queue still
+        # runs at one fixed shape
+        if batch_sizes is None:
+            batch_sizes = (1,)
+        sizes = {min(max(1, int(size)), self.max_batch_size) for size in batch_sizes}
+        self.batch_sizes = tuple(sorted(sizes | {self.max_batch_size}))
+
+        # One worker per pooled interpreter, so batches can run in parallel
+        self.num_workers = max(1, int(num_workers or pool.size))
+
+        self._queue = queue.Queue()
+        self._workers = []
+        self._start_lock = threading.Lock()
+
+        # Counters, guarded by _stats_lock since predict() callers read them
+        self._stats_lock = threading.Lock()
+        self._started_at = None
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    def _ensure_started(self):
+        # Start the worker threads lazily so the engine can be built before
+        # gunicorn forks its workers (threads do not survive a fork)
+        if self._workers and all(worker.is_alive() for worker in self._workers):
+            return
+        with self._start_lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            if self._started_at is None:
+                self._started_at = time.perf_counter()
+            while len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._run, name=f'batching-engine-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def predict(self, image_array, timeout=None):
+        # Queue a single preprocessed (224, 224, 3) image and block until its
+        # batch has been run, returning that image's row of probabilities
+        self._ensure_started()
+        future = Future()
+        self._queue.put((image_array, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def predict_many(self, image_arrays, timeout=None):
+        # Queue several images together, so they normally share one batch, and
+        # block until all have been run. Returns their rows of probabilities
+        self._ensure_started()
+        futures = []
+        for image_array in image_arrays:
+            future = Future()
+            self._queue.put((image_array, future, time.perf_counter()))
+            futures.append(future)
+        return np.stack([future.result(timeout) for future in futures])
+
+    def close(self):
+        # Each worker consumes one shutdown marker and re-queues it for the next
+        if self._workers:
+            self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+
+    def _collect(self):
+        # Block for the first request, then keep filling the batch until it is
+        # full or max_wait has passed since the first request arrived
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the shutdown marker back so this worker exits after the batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            if requests is None:
+                # Pass the shutdown marker on to the next worker
+                self._queue.put(None)
+                return
+
+            try:
+                batch_size = next(size for size in self.batch_sizes if size >= len(requests))
+                with self.pool.acquire() as runner:
+                    outputs = runner.run([r[0] for r in requests], batch_size=batch_size)
+            except Exception as e:
+                with self._stats_lock:
+                    self._errors += len(requests)
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, enqueued), output in zip(requests, outputs):
+                future.set_result(output)
+
+            with self._stats_lock:
+                self._requests += len(requests)
+                self._batches += 1
+                self._latencies.extend(finished - enqueued for _, _, enqueued in requests)
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = np.array(self._latencies) * 1000.0
+            elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+            return {
+                'requests': self._requests,
+                'batches': self._batches,
+                'errors': self._errors,
+                'queue_depth': self._queue.qsize(),
+                'mean_batch_size': self._requests / self._batches if self._batches else 0.0,
+                'throughput_per_sec': self._requests / elapsed if elapsed else 0.0,
+                'latency_ms_p50': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                'latency_ms_p99': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'batch_sizes': list(self.batch_sizes),
+                'max_wait_ms': self.max_wait * 1000.0,
+            }
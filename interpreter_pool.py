@@ -0,0 +1,149 @@
+# A pool of TFLite interpreters that share one memory-mapped copy of the model, so
+# threaded gunicorn workers can run inference in parallel. Nothing is loaded until
+# first use, so importing the app stays cheap
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from inference import InferenceError, ModelRunner
+
+
+def load_interpreter_class():
+    # Prefer the standalone runtimes, which import in a fraction of the time and
+    # memory of full TensorFlow, and fall back to tf.lite
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class InterpreterPool:
+    def __init__(self, model_path, interpreter_cls=None, size=1, num_threads=1, batch_size=1):
+        self.model_path = model_path
+        self.size = max(1, int(size))
+        self.num_threads = max(1, int(num_threads))
+        # Input batch size every interpreter is built at. Callers run whole
+        # batches of this size (zero-padded if need be), so the interpreters
+        # are never resized once built
+        self.batch_size = max(1, int(batch_size))
+        self._interpreter_cls = interpreter_cls
+
+        # LIFO so a lightly loaded worker keeps reusing the same warm interpreter
+        self._available = queue.LifoQueue()
+        self._built = 0
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+        # Serialises warm() calls, separately from _lock so checkouts carry on
+        # while interpreters are being built
+        self._warm_lock = threading.Lock()
+
+    def load(self):
+        # Import the interpreter runtime and check the model is there. With
+        # gunicorn --preload this runs in the master, so forked workers share
+        # the runtime copy-on-write. Interpreters themselves are only built in
+        # the workers
+        with self._lock:
+            if self._interpreter_cls is None:
+                self._interpreter_cls = load_interpreter_class()
+            os.stat(self.model_path)
+
+    def _build(self):
+        # Called with a slot already reserved in _built
+        try:
+            self.load()
+            # Built from the path, the runtime mmaps the flatbuffer read-only
+            # instead of copying it onto the heap, so every interpreter in every
+            # worker reads the weights from the same page cache pages
+            interpreter = self._interpreter_cls(model_path=self.model_path, num_threads=self.num_threads)
+            interpreter.allocate_tensors()
+        except (OSError, ValueError, RuntimeError) as e:
+            raise InferenceError(f"Could not load {self.model_path}: {e}") from e
+        runner = ModelRunner(interpreter)
+        runner.resize(self.batch_size)
+        with self._lock:
+            self._loaded += 1
+        return runner
+
+    def _checkout(self, timeout):
+        try:
+            return self._available.get_nowait()
+        except queue.Empty:
+            pass
+
+        # Build another interpreter if the pool is not full yet, otherwise wait
+        # for one to be returned
+        with self._lock:
+            build = self._built < self.size
+            if build:
+                self._built += 1
+        if not build:
+            return self._available.get(timeout=timeout)
+
+        try:
+            return self._build()
+        except Exception:
+            with self._lock:
+                self._built -= 1
+            raise
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        # Check a ModelRunner out for the duration of the block. A TFLite
+        # interpreter must never be used by two threads at once
+        runner = self._checkout(timeout)
+        try:
+            yield runner
+        finally:
+            self._available.put(runner)
+
+    def warm(self, timeout=None):
+        # Build the interpreters that do not exist yet and run one inference on
+        # each, so the first real request does not pay for allocation and
+        # kernel setup. Interpreters that are already built are never checked
+        # out, so this does not wait for requests in flight or hold up new
+        # ones. A concurrent warm() is waited for up to timeout seconds.
+        # Returns whether every interpreter is loaded
+        if not self._warm_lock.acquire(timeout=-1 if timeout is None else timeout):
+            return self.is_warm()
+        built = missing = 0
+        try:
+            with self._lock:
+                missing = self.size - self._built
+                self._built += missing
+
+            # Built outside _lock, which load() takes, and handed straight to
+            # the pool
+            for _ in range(missing):
+                runner = self._build()
+                built += 1
+                try:
+                    runner.write_input(lambda view: view.fill(0), batch_size=self.batch_size)
+                    runner.invoke()
+                finally:
+                    self._available.put(runner)
+        finally:
+            # Give back the slots of interpreters that failed to build
+            if built < missing:
+                with self._lock:
+                    self._built -= missing - built
+            self._warm_lock.release()
+        return self.is_warm()
+
+    def available(self):
+        # Interpreters that could be checked out without waiting
+        return self._available.qsize() + self.size - self._built
+
+    def is_warm(self):
+        # Every interpreter built, not just reserved by a checkout or warm()
+        # that is still building it
+        return self._loaded == self.size
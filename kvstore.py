@@ -0,0 +1,241 @@
+# Small key-value stores with TTL expiry, used for caches and shared state. The
+# in-memory store is per process; the SQLite and Redis stores are shared by every
+# gunicorn worker on the dyno (or, for Redis, across dynos). Values must be JSON
+# serialisable
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+class MemoryStore:
+    def __init__(self, max_entries=10000, ttl=None):
+        # max_entries bounds memory, least recently used entries go first
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def update(self, key, fn, ttl=None):
+        # Atomically replace the value with fn(current), where fn returns
+        # (new_value, result). A new_value of None deletes the key. Returns result
+        with self._lock:
+            entry = self._entries.get(key)
+            current = None
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                current = entry[0]
+
+            new_value, result = fn(current)
+
+            if new_value is None:
+                self._entries.pop(key, None)
+            else:
+                ttl = ttl if ttl is not None else self.ttl
+                self._entries[key] = (new_value, time.time() + ttl if ttl else None)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return result
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    def __init__(self, path, max_entries=10000, ttl=None, table='kv'):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.table = table
+        self._local = threading.local()
+
+        # Eviction scans the table, so it only runs every evict_interval writes.
+        # The count is shared by the threads of a worker, so it has its own lock
+        self.evict_interval = 64
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        with self._connection() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, accessed REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)")
+
+    def _connection(self):
+        # One connection per thread and per process, since connections must not
+        # be shared across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            return None
+        conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+        conn = self._connection()
+        conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value), now + ttl if ttl else None, now))
+        if self._count_write():
+            self._evict(conn, now)
+
+    def delete(self, key):
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def update(self, key, fn, ttl=None):
+        # Same contract as MemoryStore.update. BEGIN IMMEDIATE takes the write
+        # lock before reading, so concurrent workers serialise on the row
+        ttl = ttl if ttl is not None else self.ttl
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            current = None
+            if row is not None and (row[1] is None or row[1] > now):
+                current = json.loads(row[0])
+
+            new_value, result = fn(current)
+
+            if new_value is None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            else:
+                conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(new_value), now + ttl if ttl else None, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if new_value is not None and self._count_write():
+            self._evict(conn, now)
+        return result
+
+    def _count_write(self):
+        # Whether this write is due to run an eviction
+        with self._writes_lock:
+            self._writes += 1
+            return self._writes % self.evict_interval == 0
+
+    def _evict(self, conn, now):
+        # Drop expired rows, then the least recently used beyond max_entries
+        conn.execute(f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        conn.execute(f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+                     "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def __len__(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class RedisStore:
+    def __init__(self, url, ttl=None, prefix=''):
+        # redis is an optional dependency, only needed for this backend
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RedisStore needs the redis package, install it with 'pip install redis'")
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def update(self, key, fn, ttl=None):
+        # Same contract as MemoryStore.update, using WATCH/MULTI optimistic
+        # locking and retrying if another worker changed the key meanwhile
+        import redis
+
+        ttl = ttl if ttl is not None else self.ttl
+        key = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    new_value, result = fn(json.loads(value) if value is not None else None)
+
+                    pipe.multi()
+                    if new_value is None:
+                        pipe.delete(key)
+                    else:
+                        pipe.set(key, json.dumps(new_value), ex=int(ttl) if ttl else None)
+                    pipe.execute()
+                    return result
+                except redis.WatchError:
+                    continue
+
+    def __len__(self):
+        # Keys under this store's prefix. SCAN walks the keyspace in steps
+        # without blocking the server, unlike KEYS, but it is still a full walk,
+        # so this is for stats and tests rather than the request path
+        if not self.prefix:
+            return self.client.dbsize()
+        pattern = ''.join('\\' + c if c in '*?[]\\' else c for c in self.prefix) + '*'
+        return sum(1 for _ in self.client.scan_iter(match=pattern, count=1000))
+
+
+def open_store(url, max_entries=10000, ttl=None, name='kv'):
+    # Build a store from a URL: memory://, sqlite:///file.db or redis://host:port/db.
+    # name keeps different users of one backend apart. Redis evicts by its own maxmemory policy, so max_entries does not apply
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryStore(max_entries=max_entries, ttl=ttl)
+    if parsed.scheme == 'sqlite':
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteStore(url[len('sqlite:///'):], max_entries=max_entries, ttl=ttl, table=name)
+    if parsed.scheme in ('redis', 'rediss', 'unix'):
+        return RedisStore(url, ttl=ttl, prefix=f"{name}:")
+    raise ValueError(f"Unsupported store URL {url!r}, use memory://, sqlite:///path or redis://host")
@@ -0,0 +1,87 @@
+# Prometheus metrics for the webhook: stage and request latency histograms, a
+# counter per image outcome, a histogram of prediction confidence and a counter
+# of retries, photos sent again soon after a reply that did not name the plant.
+#
+# Gunicorn workers are separate processes, so a scrape of /metrics would only
+# see whichever worker answered. Set PROMETHEUS_MULTIPROC_DIR to an empty
+# directory and prometheus_client keeps every worker's samples in files there,
+# which /metrics then aggregates (gunicorn.conf.py clears it on startup)
+import os
+
+# Seconds, from a cached prediction to a slow download of a large photo
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0)
+
+# What happened to an image message, one counter label each
+OUTCOMES = (
+    'identified',
+    'low_confidence',
+    'near_tie',
+    'download_failed',
+    'not_an_image',
+    'unrecognised_format',
+    'decode_failed',
+    'too_large',
+    'model_error',
+    'error',
+)
+
+
+class Metrics:
+    def __init__(self, namespace='drroots'):
+        # prometheus_client is an optional dependency, only needed with metrics on
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImportError("Metrics need the prometheus_client package, install it with 'pip install prometheus-client'")
+
+        self._prometheus = prometheus_client
+        self.multiprocess_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+        self.stage_seconds = prometheus_client.Histogram(
+            'stage_seconds', 'Time spent in each stage of a request', ['stage'],
+            namespace=namespace, buckets=LATENCY_BUCKETS)
+        self.request_seconds = prometheus_client.Histogram(
+            'request_seconds', 'Time to handle a request', ['endpoint'],
+            namespace=namespace, buckets=LATENCY_BUCKETS)
+        self.outcomes = prometheus_client.Counter(
+            'image_outcomes', 'Image messages by outcome', ['outcome'], namespace=namespace)
+        self.confidence = prometheus_client.Histogram(
+            'prediction_confidence', 'Confidence of the top prediction', namespace=namespace,
+            buckets=CONFIDENCE_BUCKETS)
+        self.retries = prometheus_client.Counter(
+            'image_retries', 'Image messages sent soon after an earlier image was not identified',
+            ['after'], namespace=namespace)
+
+        # Export every outcome from the start, so rates work before the first error
+        for outcome in OUTCOMES:
+            self.outcomes.labels(outcome)
+            if outcome != 'identified':
+                self.retries.labels(outcome)
+
+    def observe_trace(self, trace):
+        for stage, seconds in trace.items():
+            self.stage_seconds.labels(stage).observe(seconds)
+
+    def observe_request(self, endpoint, seconds):
+        self.request_seconds.labels(endpoint or 'unknown').observe(seconds)
+
+    def count_outcome(self, outcome):
+        self.outcomes.labels(outcome).inc()
+
+    def count_retry(self, after):
+        # after is the outcome of the user's previous image
+        self.retries.labels(after).inc()
+
+    def observe_confidence(self, confidence):
+        self.confidence.observe(float(confidence))
+
+    def render(self):
+        # (body, content type) for a scrape, merged across workers in multiprocess mode
+        if self.multiprocess_dir:
+            registry = self._prometheus.CollectorRegistry()
+            from prometheus_client import multiprocess
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = self._prometheus.REGISTRY
+        return self._prometheus.generate_latest(registry), self._prometheus.CONTENT_TYPE_LATEST
@@ -0,0 +1,81 @@
+# TFLite export of the trained Keras model, in float32 and quantised variants
+import os
+
+import numpy as np
+
+# float32 is the plain conversion the bot has always shipped. dynamic quantises
+# weights to int8, int8 quantises weights and activations (including the model's
+# input and output), float16 halves the weights
+MODEL_VARIANTS = ('float32', 'dynamic', 'int8', 'float16')
+
+
+def model_filename(variant='float32', basename='dr_roots_model'):
+    # float32 keeps the original filename so existing deployments are unaffected
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant {variant!r}, expected one of {MODEL_VARIANTS}")
+    if variant == 'float32':
+        return f"{basename}.tflite"
+    return f"{basename}_{variant}.tflite"
+
+
+def representative_dataset(batches, num_samples=200):
+    # Yield single images from (images, labels) batches (e.g. the validation
+    # tf.data pipeline) for calibrating the int8 activation ranges
+    def samples():
+        count = 0
+        for x, _ in batches:
+            for image in np.asarray(x):
+                yield [image[np.newaxis].astype(np.float32)]
+                count += 1
+                if count >= num_samples:
+                    return
+    return samples
+
+
+def convert_model(model, variant='float32', representative_data=None):
+    # Imported here so the webhook can use model_filename() without TensorFlow
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if variant == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == 'int8':
+        if representative_data is None:
+            raise ValueError("Full integer quantisation needs a representative dataset")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_data
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif variant == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant != 'float32':
+        raise ValueError(f"Unknown model variant {variant!r}, expected one of {MODEL_VARIANTS}")
+
+    return converter.convert()
+
+
+def export_variants(model, output_dir, representative_batches=None, variants=MODEL_VARIANTS, num_samples=200):
+    # Convert and save each variant, returning {variant: path}
+    os.makedirs(output_dir, exist_ok=True)
+
+    representative_data = None
+    if representative_batches is not None:
+        representative_data = representative_dataset(representative_batches, num_samples)
+
+    paths = {}
+    for variant in variants:
+        if variant == 'int8' and representative_data is None:
+            print("Skipping int8 export, no representative dataset given")
+            continue
+
+        tflite_model = convert_model(model, variant, representative_data)
+        path = os.path.join(output_dir, model_filename(variant))
+        with open(path, 'wb') as f:
+            f.write(tflite_model)
+
+        paths[variant] = path
+        print(f"Saved {variant} model to {path} ({len(tflite_model) / 1024 / 1024:.2f} MB)")
+    return paths
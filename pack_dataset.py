@@ -0,0 +1,117 @@
+# Pack the <plant>/{Train,Validation,Test} image tree into a few large shards of
+# pre-resized 224x224 uint8 images, so training reads big sequential files instead
+# of thousands of small JPEGs from Google Drive.
+#
+# npy format: <split>/images-00000.npy (N, 224, 224, 3) uint8 arrays that are
+# memory-mapped for random access, plus matching labels-00000.npy int64 arrays.
+# tfrecord format: <split>/shard-00000.tfrecord files of raw image bytes and labels.
+# Both write a manifest.json describing classes, splits and shards.
+#
+# Images are written in a seeded random order rather than class by class, so
+# every shard holds a mix of all the plants and a streaming shuffle buffer over
+# a few shards still gives mixed batches. The seed is kept in the manifest, and
+# packed_order() recovers which file ended up where.
+#
+# Usage:
+#     python pack_dataset.py /content/drive/MyDrive/medicinal_plants/data /content/packed --format npy
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from dataset import list_plant_folders, list_split, load_class_names
+from preprocessing import INPUT_SIZE, load_pixels
+
+SPLITS = ('Train', 'Validation', 'Test')
+
+
+def write_npy_shard(split_dir, shard, pixels, labels):
+    images_name = f"images-{shard:05d}.npy"
+    labels_name = f"labels-{shard:05d}.npy"
+    images = np.lib.format.open_memmap(os.path.join(split_dir, images_name), mode='w+',
+                                       dtype=np.uint8, shape=(len(pixels), *INPUT_SIZE, 3))
+    for i, image in enumerate(pixels):
+        images[i] = image
+    images.flush()
+    del images
+    np.save(os.path.join(split_dir, labels_name), np.asarray(labels, dtype=np.int64))
+    return {'images': images_name, 'labels': labels_name, 'count': len(pixels)}
+
+
+def write_tfrecord_shard(split_dir, shard, pixels, labels):
+    import tensorflow as tf
+
+    name = f"shard-{shard:05d}.tfrecord"
+    with tf.io.TFRecordWriter(os.path.join(split_dir, name)) as writer:
+        for image, label in zip(pixels, labels):
+            example = tf.train.Example(features=tf.train.Features(feature={
+                'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+            }))
+            writer.write(example.SerializeToString())
+    return {'file': name, 'count': len(pixels)}
+
+
+def packed_order(count, seed):
+    # Position in list_split's order of each packed image
+    return np.random.default_rng(seed).permutation(count)
+
+
+def pack_split(pool, base_dir, output_dir, split, classes, output_format, shard_size, seed):
+    filenames, labels, _ = list_split(base_dir, split, classes)
+    order = packed_order(len(filenames), seed)
+    filenames = [filenames[i] for i in order]
+    labels = labels[order]
+    split_dir = os.path.join(output_dir, split)
+    os.makedirs(split_dir, exist_ok=True)
+    write_shard = write_npy_shard if output_format == 'npy' else write_tfrecord_shard
+
+    shards = []
+    for shard, start in enumerate(range(0, len(filenames), shard_size)):
+        chunk = filenames[start:start + shard_size]
+        # Decode in parallel; imap keeps the images in file order
+        pixels = list(pool.imap(load_pixels, chunk, chunksize=16))
+        shards.append(write_shard(split_dir, shard, pixels, labels[start:start + shard_size]))
+        print(f"{split}: packed {start + len(chunk)}/{len(filenames)} images")
+
+    return {'count': len(filenames), 'shards': shards}
+
+
+def pack_dataset(base_dir, output_dir, output_format='npy', shard_size=2048, classes=None, workers=None, seed=0):
+    if classes is None:
+        classes = list_plant_folders(base_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {'format': output_format, 'image_size': list(INPUT_SIZE), 'classes': list(classes), 'seed': seed,
+                'splits': {}}
+    with Pool(workers) as pool:
+        for split in SPLITS:
+            manifest['splits'][split] = pack_split(pool, base_dir, output_dir, split, classes, output_format,
+                                                   shard_size, seed)
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack the plant image tree into sharded training files')
+    parser.add_argument('input_dir', help='Directory containing <plant>/{Train,Validation,Test} folders')
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', choices=['npy', 'tfrecord'], default='npy')
+    parser.add_argument('--shard-size', type=int, default=2048, help='Images per shard')
+    parser.add_argument('--class-mapping', help='Use the class order from this class_mapping.json')
+    parser.add_argument('--workers', type=int, default=None, help='Decode processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the order images are packed in')
+    args = parser.parse_args()
+
+    classes = load_class_names(args.class_mapping) if args.class_mapping else None
+    manifest = pack_dataset(args.input_dir, args.output_dir, args.format, args.shard_size, classes, args.workers,
+                            args.seed)
+    print(f"Packed {sum(s['count'] for s in manifest['splits'].values())} images into {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Plant profiles loaded once at startup, indexed by model class and by name, with
+# the WhatsApp message for each plant rendered up front
+import json
+import re
+from collections import namedtuple
+
+Profile = namedtuple('Profile', ['scientific_name', 'common_name', 'data', 'message'])
+
+# Spellings used by class_mapping.json (and likely by users) that do not match
+# plant_data.json, mapped to the normalised binomial they refer to
+ALIASES = {
+    'zingiber officianale': 'zingiber officinale',
+}
+
+
+def normalise_name(name):
+    # Casefold and collapse punctuation and whitespace, so "Citrus Limon" and
+    # "citrus  limon." compare equal
+    return ' '.join(re.sub(r'[^\w\s]', ' ', name).casefold().split())
+
+
+def binomial(name):
+    # Genus and species only, dropping authorities like "Roscoe" or "Lour"
+    return ' '.join(normalise_name(name).split()[:2])
+
+
+def render_message(plant):
+    # Format citations on a new line each
+    citations = "\n".join(plant['Citations'])
+
+    return (
+        f"🌿 *Plant Profile: {plant['Common Name']}* 🌿\n"
+        f"- Scientific Name: {plant['Scientific Name']}\n"
+        f"- Shona Name: {plant['Shona Name']}\n"
+        f"\n🍃 What it looks like: \n{plant['Physical Description']}\n"
+        f"\n💊 Reported Medicinal Uses: \n{plant['Reported Medicinal Uses']}\n"
+        f"\n🧪 How it's prepared & used: \n{plant['Preparation Methods & Parts Used']}\n"
+        f"\n🌱 Conservation Status (on the IUCN Red List): {plant['IUCN Red List of Threatened Species']}\n"
+        f"\n📚 Want to learn more? Check out these papers: \n{citations}"
+    )
+
+
+class PlantProfileStore:
+    def __init__(self, plants, class_mapping, aliases=ALIASES):
+        self._by_name = {}
+        for plant in plants:
+            profile = Profile(plant['Scientific Name'], plant['Common Name'], plant, render_message(plant))
+
+            # Full name, binomial, common and Shona names all resolve to the plant
+            for name in (plant['Scientific Name'], binomial(plant['Scientific Name']),
+                         plant['Common Name'], plant['Shona Name']):
+                self._by_name.setdefault(normalise_name(name), profile)
+
+        for alias, target in aliases.items():
+            if target in self._by_name:
+                self._by_name.setdefault(normalise_name(alias), self._by_name[target])
+
+        # Model class index -> profile, None when a class name does not resolve
+        self.class_names = {int(index): name for index, name in class_mapping.items()}
+        self._by_class = {index: self.by_name(name) for index, name in self.class_names.items()}
+
+    @classmethod
+    def from_files(cls, plant_data_path='plant_data.json', class_mapping_path='class_mapping.json'):
+        with open(plant_data_path, 'r', encoding='utf-8') as f:
+            plants = json.load(f)
+        with open(class_mapping_path, 'r') as f:
+            class_mapping = json.load(f)
+        return cls(plants, class_mapping)
+
+    def by_name(self, name):
+        key = normalise_name(name)
+        profile = self._by_name.get(key)
+        if profile is None:
+            profile = self._by_name.get(binomial(name))
+        return profile
+
+    def by_class(self, index):
+        return self._by_class.get(int(index))
+
+    def validate(self):
+        # Fail at startup rather than answering "Plant not found" for a class
+        # the model can predict
+        missing = [f"{index}: {self.class_names[index]}" for index, profile in self._by_class.items() if profile is None]
+        if missing:
+            raise ValueError(f"No plant profile for model classes: {', '.join(missing)}")
@@ -0,0 +1,80 @@
+# Cache of the model's class probabilities for images the bot has already
+# seen, keyed by a hash of the image bytes and optionally by a perceptual hash so
+# recompressed forwards of the same photo also hit
+import hashlib
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+def content_key(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def perceptual_key(image, hash_size=8):
+    # Difference hash: compare neighbouring pixels of a tiny grayscale thumbnail.
+    # It survives recompression and resizing, unlike a hash of the raw bytes
+    thumbnail = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return 'dhash:' + np.packbits(bits).tobytes().hex()
+
+
+class PredictionCache:
+    def __init__(self, store, namespace='', ttl=None, perceptual=False):
+        # store is any kvstore backend; namespace should identify the model so a
+        # model swap does not serve stale predictions
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+        self.perceptual = perceptual
+
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._perceptual_hits = 0
+        self._misses = 0
+
+    def _get(self, key):
+        # Entries written before whole probability vectors were cached are
+        # [class, confidence] lists, treated as misses
+        value = self.store.get(f"{self.namespace}:{key}")
+        if not isinstance(value, dict):
+            return None
+        return np.asarray(value['probabilities'], dtype=np.float32)
+
+    def get(self, data):
+        # Exact lookup on the downloaded bytes, before anything is decoded
+        prediction = self._get(content_key(data))
+        if prediction is not None:
+            with self._stats_lock:
+                self._hits += 1
+        return prediction
+
+    def get_similar(self, image):
+        # Perceptual lookup on the decoded image, counts the miss if neither
+        # lookup found anything
+        prediction = self._get(perceptual_key(image)) if self.perceptual else None
+        with self._stats_lock:
+            if prediction is not None:
+                self._perceptual_hits += 1
+            else:
+                self._misses += 1
+        return prediction
+
+    def put(self, data, image, probabilities):
+        # Uncalibrated scores, so a new calibration file applies to cached images too
+        value = {'probabilities': [float(p) for p in probabilities]}
+        self.store.set(f"{self.namespace}:{content_key(data)}", value, ttl=self.ttl)
+        if self.perceptual:
+            self.store.set(f"{self.namespace}:{perceptual_key(image)}", value, ttl=self.ttl)
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self._hits + self._perceptual_hits + self._misses
+            return {
+                'hits': self._hits,
+                'perceptual_hits': self._perceptual_hits,
+                'misses': self._misses,
+                'hit_rate': (self._hits + self._perceptual_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,167 @@
+# Image preprocessing for the plant classifier: fast decode, orientation and colour
+# normalisation, resize and scaling into the model's float32 input layout.
+#
+# This is the one implementation used by the webhook, the training pipelines
+# (data_pipeline.py, pack_dataset.py), resize_images.py and the notebook, so the
+# model is trained on exactly the pixels it is served.
+# benchmarks/check_preprocessing_parity.py checks the paths agree bit for bit
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# MobileNet input size used by the model
+INPUT_SIZE = (224, 224)
+
+# Pillow's default resize filter, which the webhook has always used
+RESAMPLE = Image.BICUBIC
+
+
+class ImageDecodeError(ValueError):
+    # An image in a format Pillow recognises that still cannot be decoded:
+    # truncated, corrupt or with too many pixels
+    pass
+
+
+def open_image(source, size=INPUT_SIZE, crop=False, fit='stretch'):
+    # Decode raw bytes, a path or a file object into an RGB image of the given size
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return prepare_image(Image.open(source), size, crop, fit)
+
+
+def prepare_image(image, size=INPUT_SIZE, crop=False, fit='stretch'):
+    # For JPEGs, ask the decoder to scale down by 1/2, 1/4 or 1/8 in the DCT
+    # domain while staying at least as large as the target. A 12MP photo is then
+    # decoded at roughly 500px instead of full resolution. This only has an
+    # effect before the image data has been loaded. When cropping, keep twice
+    # the target so the crop still has enough pixels
+    if image.format == 'JPEG':
+        image.draft('RGB', (size[0] * 2, size[1] * 2) if crop else size)
+
+    # Apply the EXIF orientation so portrait phone photos are upright
+    image = ImageOps.exif_transpose(image)
+
+    # RGBA, palette and grayscale images all need three channels
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # An image already at the target size is taken as prepared and not cropped
+    # again. fit='crop' keeps the aspect ratio and takes the centre instead of
+    # squashing the whole photo (only resize_images.py offers this, the model is
+    # trained and served on squashed photos)
+    if image.size != size:
+        if crop:
+            image = crop_to_leaf(image)
+        if fit == 'crop':
+            image = ImageOps.fit(image, size, RESAMPLE)
+        else:
+            image = image.resize(size, RESAMPLE)
+    return image
+
+
+def load_pixels(source, size=INPUT_SIZE, crop=False):
+    # Decode and prepare one image as a uint8 (height, width, 3) array
+    return np.asarray(open_image(source, size, crop), dtype=np.uint8)
+
+
+def load_batch(sources, size=INPUT_SIZE, out=None, workers=None, crop=False):
+    # Decode many images into one float32 (N, height, width, 3) batch. Pillow
+    # releases the GIL while decoding and resizing, so threads decode in
+    # parallel; scaling is then a single divide over the whole batch
+    pixels = np.empty((len(sources), size[1], size[0], 3), dtype=np.uint8)
+
+    def load(i):
+        pixels[i] = load_pixels(sources[i], size, crop)
+
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(load, range(len(sources))))
+    return to_input_array(pixels, out)
+
+
+def crop_to_leaf(image, margin=0.1, mask_size=256, min_area=0.05):
+    # Crop an RGB image to the leaf's bounding box (see remove_background.py)
+    # plus a margin. The mask is computed on a copy at most mask_size pixels
+    # across, so the cost barely depends on the photo size. The image is
+    # returned unchanged when no leaf is found or the box is implausibly small
+    try:
+        from remove_background import leaf_bbox
+    except ImportError:
+        raise ImportError("Cropping to the leaf needs OpenCV, install it with 'pip install opencv-python-headless'")
+
+    small = image.copy()
+    small.thumbnail((mask_size, mask_size))
+    bbox = leaf_bbox(np.asarray(small))
+    if bbox is None:
+        return image
+
+    left, top, right, bottom = bbox
+    if (right - left) * (bottom - top) < min_area * small.width * small.height:
+        return image
+
+    # Pad the box and scale it back to the full image
+    pad_x, pad_y = (right - left) * margin, (bottom - top) * margin
+    scale_x, scale_y = image.width / small.width, image.height / small.height
+    return image.crop((
+        max(0, int((left - pad_x) * scale_x)),
+        max(0, int((top - pad_y) * scale_y)),
+        min(image.width, int(round((right + pad_x) * scale_x))),
+        min(image.height, int(round((bottom + pad_y) * scale_y))),
+    ))
+
+
+# Deterministic test-time augmentation views: the photo, its mirror image, and
+# a centre crop and four corner crops
+TTA_VIEWS = ('identity', 'flip', 'center', 'top_left', 'top_right', 'bottom_left', 'bottom_right')
+
+
+def tta_views(image, views=TTA_VIEWS, crop_fraction=0.875, out=None):
+    # (len(views), H, W, 3) float32 model inputs for one prepared image. Each
+    # view is described by the source row and column of every output pixel
+    # (crops are scaled back up by nearest-neighbour sampling), so all views are
+    # built with a single gather instead of a PIL resize per crop
+    pixels = np.ascontiguousarray(np.asarray(image, dtype=np.uint8))
+    height, width = pixels.shape[:2]
+    crop_height = int(round(height * crop_fraction))
+    crop_width = int(round(width * crop_fraction))
+    crop_rows = ((np.arange(height) + 0.5) * crop_height / height).astype(np.intp)
+    crop_cols = ((np.arange(width) + 0.5) * crop_width / width).astype(np.intp)
+
+    top, left = (height - crop_height) // 2, (width - crop_width) // 2
+    bottom, right = height - crop_height, width - crop_width
+    offsets = {
+        'center': (top, left),
+        'top_left': (0, 0),
+        'top_right': (0, right),
+        'bottom_left': (bottom, 0),
+        'bottom_right': (bottom, right),
+    }
+
+    rows = np.empty((len(views), height), dtype=np.intp)
+    cols = np.empty((len(views), width), dtype=np.intp)
+    for i, view in enumerate(views):
+        if view == 'identity':
+            rows[i], cols[i] = np.arange(height), np.arange(width)
+        elif view == 'flip':
+            rows[i], cols[i] = np.arange(height), np.arange(width)[::-1]
+        elif view in offsets:
+            rows[i], cols[i] = crop_rows + offsets[view][0], crop_cols + offsets[view][1]
+        else:
+            raise ValueError(f"Unknown view {view!r}, expected one of {TTA_VIEWS}")
+
+    # Gather whole pixels, viewed as 3-byte items, by flat index. About twice
+    # as fast as indexing the (H, W, 3) array with a row and a column array
+    rgb = pixels.view(np.dtype((np.void, 3))).reshape(height, width)
+    gathered = np.take(rgb, rows[:, :, None] * width + cols[:, None, :])
+    return to_input_array(gathered.view(np.uint8).reshape(len(views), height, width, 3), out=out)
+
+
+def to_input_array(image, out=None):
+    # Scale 8-bit pixels (an image, or a uint8 array such as a whole batch) to
+    # [0, 1] float32, written in place into out if given
+    pixels = np.asarray(image, dtype=np.uint8)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    np.divide(pixels, np.float32(255.0), out=out)
+    return out
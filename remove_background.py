@@ -1,68 +1,149 @@
+# Leaf segmentation: Otsu threshold a blurred grayscale image, clean the mask up
+# with morphology and keep the largest contour, assumed to be the leaf.
+#
+# leaf_mask / leaf_bbox work on in-memory RGB arrays (preprocessing uses them to
+# crop webhook photos to the leaf). Run as a script to write background-removed
+# RGBA PNGs for a whole directory in parallel; files already written are skipped.
+#
+# Usage:
+#     python remove_background.py input_dir output_dir --workers 4
+import argparse
+import os
+from multiprocessing import Pool
+
 import cv2
 import numpy as np
-from skimage import filters
-import os
 from PIL import Image
 
-def remove_background(image_path, output_path):
-    # Read the image
-    img = cv2.imread(image_path)
-    
-    # Convert to RGB (OpenCV uses BGR by default)
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
+from dataset import output_names
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+KERNEL = np.ones((5, 5), np.uint8)
+
+
+def leaf_mask(rgb):
+    # uint8 mask (255 on the leaf, 0 elsewhere) for an RGB uint8 array, or None
+    # if no contour is found
     # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
     # Apply Gaussian blur
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    
+
     # Use Otsu's method for thresholding
     _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    
+
     # Apply morphological operations to clean up the mask
-    kernel = np.ones((5,5), np.uint8)
-    cleaned = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-    cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel)
-    
+    cleaned = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, KERNEL)
+    cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, KERNEL)
+
     # Find the largest contour (assuming it's the leaf)
     contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if contours:
-        largest_contour = max(contours, key=cv2.contourArea)
-        
-        # Create a mask from the largest contour
-        mask = np.zeros(cleaned.shape, np.uint8)
-        cv2.drawContours(mask, [largest_contour], 0, (255), -1)
-        
-        # Apply the mask to the original image
-        result = cv2.bitwise_and(img_rgb, img_rgb, mask=mask)
-        
-        # Convert black background to transparent
-        rgba = cv2.cvtColor(result, cv2.COLOR_RGB2RGBA)
-        rgba[:, :, 3] = mask
-        
-        # Save the result
-        Image.fromarray(rgba).save(output_path)
-    else:
+    if not contours:
+        return None
+    largest_contour = max(contours, key=cv2.contourArea)
+
+    # Create a mask from the largest contour
+    mask = np.zeros(cleaned.shape, np.uint8)
+    cv2.drawContours(mask, [largest_contour], 0, 255, -1)
+    return mask
+
+
+def leaf_bbox(rgb):
+    # (left, top, right, bottom) of the leaf in an RGB uint8 array, or None
+    mask = leaf_mask(rgb)
+    if mask is None:
+        return None
+    x, y, w, h = cv2.boundingRect(mask)
+    return x, y, x + w, y + h
+
+
+def remove_background_array(rgb):
+    # RGBA array with the background made transparent, or None
+    mask = leaf_mask(rgb)
+    if mask is None:
+        return None
+
+    # Apply the mask to the original image and use it as the alpha channel
+    rgba = cv2.cvtColor(cv2.bitwise_and(rgb, rgb, mask=mask), cv2.COLOR_RGB2RGBA)
+    rgba[:, :, 3] = mask
+    return rgba
+
+
+def remove_background(image_path, output_path):
+    # Read the image (OpenCV uses BGR by default)
+    img = cv2.imread(image_path)
+    if img is None:
+        print(f"Could not read {image_path}")
+        return False
+
+    rgba = remove_background_array(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    if rgba is None:
         print(f"No contours found in {image_path}")
+        return False
+
+    # Save the result
+    Image.fromarray(rgba).save(output_path)
+    return True
+
+
+def output_filenames(filenames):
+    # {input filename: output filename}, every output a PNG
+    return output_names(filenames, 'processed_', '.png')
+
+
+def init_worker():
+    # One process per core already, keep OpenCV from starting its own threads
+    cv2.setNumThreads(1)
+
+
+def process_file(task):
+    input_path, output_path = task
+    return remove_background(input_path, output_path)
+
+
+def process_directory(input_dir, output_dir, workers=None, chunksize=16, overwrite=False):
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    skipped = 0
+    filenames = [f for f in sorted(os.listdir(input_dir)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    for filename, output_name in output_filenames(filenames).items():
+        output_path = os.path.join(output_dir, output_name)
+        if not overwrite and os.path.exists(output_path):
+            skipped += 1
+            continue
+        tasks.append((os.path.join(input_dir, filename), output_path))
+
+    print(f"{len(tasks)} images to process, {skipped} already done")
+    processed = 0
+    with Pool(workers, initializer=init_worker) as pool:
+        # Chunks amortise the inter-process overhead over several small images
+        for i, ok in enumerate(pool.imap_unordered(process_file, tasks, chunksize=chunksize), 1):
+            processed += int(ok)
+            if i % 100 == 0 or i == len(tasks):
+                print(f"Processed {i}/{len(tasks)}")
+
+    return {'processed': processed, 'skipped': skipped, 'failed': len(tasks) - processed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove the background from every image in a directory')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--chunksize', type=int, default=16, help='Images handed to a worker at a time')
+    parser.add_argument('--overwrite', action='store_true', help='Redo images whose output already exists')
+    args = parser.parse_args()
+
+    print(f"Processing images from: {args.input_dir}")
+    print(f"Saving processed images to: {args.output_dir}")
+
+    summary = process_directory(args.input_dir, args.output_dir, args.workers, args.chunksize, args.overwrite)
+    print(f"Processing complete! {summary['processed']} processed, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed")
+
 
-def process_directory(input_dir, output_dir):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, f"processed_{filename.split('.')[0]}.png")
-            remove_background(input_path, output_path)
-            print(f"Processed {filename}")
-
-# Usage 
-base_input_dir = r"DIRECTORY TO TAKE IMAGES FROM"
-base_output_dir = r"DIRECTORY TO SEND IMAGES TO"
-
-print(f"Processing images from: {base_input_dir}")
-print(f"Saving processed images to: {base_output_dir}")
-
-process_directory(base_input_dir, base_output_dir)
-print("Processing complete!")
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,113 @@
+# Resize a folder of photos to the model's 224x224 input, spread over all CPU
+# cores. JPEGs are decoded at reduced size in draft mode, the output can be
+# JPEG, WebP, PNG or raw .npy arrays, and the run ends with a throughput and
+# size summary.
+#
+# Resizing uses preprocessing.prepare_image, the same filter and colour handling
+# as training and the webhook. --fit stretch squashes the whole photo to
+# 224x224 as they do; --fit crop keeps the aspect ratio and crops the centre.
+#
+# Usage:
+#     python resize_images.py input_folder output_folder --format jpeg --quality 90
+import argparse
 import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
 from PIL import Image
 
-def resize_images(input_folder, output_folder, size=(224, 224)):
+from dataset import output_names
+from preprocessing import prepare_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+# Output format -> (file extension, PIL format)
+OUTPUT_FORMATS = {
+    'jpeg': ('.jpg', 'JPEG'),
+    'webp': ('.webp', 'WEBP'),
+    'png': ('.png', 'PNG'),
+    'npy': ('.npy', None),
+}
+
+
+def output_filenames(filenames, output_format):
+    # {input filename: output filename}, see dataset.output_names
+    return output_names(filenames, 'resized_', OUTPUT_FORMATS[output_format][0])
+
+
+def resize_file(task):
+    input_path, output_path, size, fit, output_format, quality = task
+
+    # Open and resize the image
+    with Image.open(input_path) as img:
+        img_resized = prepare_image(img, size, fit=fit)
+
+        # Save the resized image
+        if output_format == 'npy':
+            np.save(output_path, np.asarray(img_resized, dtype=np.uint8))
+        elif output_format == 'png':
+            img_resized.save(output_path, 'PNG')
+        else:
+            img_resized.save(output_path, OUTPUT_FORMATS[output_format][1], quality=quality)
+
+    return os.path.getsize(input_path), os.path.getsize(output_path)
+
+
+def resize_images(input_folder, output_folder, size=(224, 224), fit='stretch', output_format='jpeg', quality=90,
+                  workers=None, chunksize=16):
     # Create the output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Loop through all files in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            # Open the image
-            with Image.open(os.path.join(input_folder, filename)) as img:
-                # Resize the image
-                img_resized = img.resize(size, Image.LANCZOS)
-                
-                # Prepare the output filename
-                output_filename = f"resized_{filename.split('.')[0]}.png"
-                output_path = os.path.join(output_folder, output_filename)
-                
-                # Save the resized image
-                img_resized.save(output_path)
-                print(f"Resized {filename} to 224x224")
-
-# Usage
-input_folder = r"FILEPATH"
-output_folder = r"FILEPATH"
-
-print(f"Resizing images from: {input_folder}")
-print(f"Saving resized images to: {output_folder}")
-
-resize_images(input_folder, output_folder)
-
-print("Resizing complete!")
+    os.makedirs(output_folder, exist_ok=True)
+
+    filenames = sorted(f for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    names = output_filenames(filenames, output_format)
+    tasks = [(os.path.join(input_folder, f), os.path.join(output_folder, names[f]), size, fit, output_format, quality)
+             for f in filenames]
+
+    started = time.perf_counter()
+    input_bytes = output_bytes = 0
+    with Pool(workers) as pool:
+        for i, (in_size, out_size) in enumerate(pool.imap_unordered(resize_file, tasks, chunksize=chunksize), 1):
+            input_bytes += in_size
+            output_bytes += out_size
+            if i % 100 == 0 or i == len(tasks):
+                print(f"Resized {i}/{len(tasks)}")
+    elapsed = time.perf_counter() - started
+
+    return {
+        'images': len(tasks),
+        'seconds': elapsed,
+        'images_per_sec': len(tasks) / elapsed if elapsed else 0.0,
+        'input_bytes': input_bytes,
+        'output_bytes': output_bytes,
+        'bytes_saved': input_bytes - output_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resize every image in a folder for training')
+    parser.add_argument('input_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--size', type=int, nargs=2, default=(224, 224), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--fit', choices=['stretch', 'crop'], default='stretch',
+                        help='Squash to size, or keep the aspect ratio and centre-crop')
+    parser.add_argument('--format', choices=list(OUTPUT_FORMATS), default='jpeg')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG/WebP quality')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    print(f"Resizing images from: {args.input_folder}")
+    print(f"Saving resized images to: {args.output_folder}")
+
+    summary = resize_images(args.input_folder, args.output_folder, tuple(args.size), args.fit, args.format,
+                            args.quality, args.workers)
+
+    saved = summary['bytes_saved'] / summary['input_bytes'] * 100 if summary['input_bytes'] else 0.0
+    print(f"Resizing complete! {summary['images']} images in {summary['seconds']:.1f}s "
+          f"({summary['images_per_sec']:.1f} images/sec), "
+          f"{summary['input_bytes'] / 1024 / 1024:.1f} MB -> {summary['output_bytes'] / 1024 / 1024:.1f} MB "
+          f"({summary['bytes_saved'] / 1024 / 1024:.1f} MB, {saved:.0f}% saved)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# Conversation state per WhatsApp number. Each record is just the state name,
+# kept in a bounded kvstore backend with a TTL so idle users expire. Use a SQLite
+# or Redis backend to share state between gunicorn workers
+class SessionStore:
+    def __init__(self, store, ttl=24 * 3600):
+        self.store = store
+        self.ttl = ttl
+
+    def get(self, user):
+        return self.store.get(user)
+
+    def transition(self, user, fn):
+        # Atomically move the user to a new state. fn(state) gets the current
+        # state (None for a new or expired user) and returns (new_state, result);
+        # a new_state of None ends the session. Returns result
+        return self.store.update(user, fn, ttl=self.ttl)
+
+    def clear(self, user):
+        self.store.delete(user)
+
+    def __len__(self):
+        return len(self.store)
@@ -0,0 +1,138 @@
+# Shared fixtures. The app loads plant_data.json and class_mapping.json
+# relative to the working directory, so tests run from the repository root
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# app reads its settings when imported, so these have to be in place first
+os.environ.update({
+    'TWILIO_ACCOUNT_SID': 'ACtest',
+    'TWILIO_AUTH_TOKEN': 'test-token',
+    'TWILIO_PHONE_NUMBER': 'whatsapp:+15550000000',
+    'ASYNC_REPLIES': 'false',
+    'INFERENCE_BATCHING': 'false',
+    'METRICS': 'false',
+    'TTA': 'false',
+})
+
+from calibration import Calibration  # noqa: E402
+from interpreter_pool import InterpreterPool  # noqa: E402
+from kvstore import open_store  # noqa: E402
+from prediction_cache import PredictionCache  # noqa: E402
+from preprocessing import INPUT_SIZE  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+from tests.twilio_stub import FakeTwilio  # noqa: E402
+
+NUM_CLASSES = 7
+
+
+class FakeInterpreter:
+    # Stands in for a TFLite interpreter with the same tensor API. The scores
+    # are a softmax over the mean of each of NUM_CLASSES slices of the input,
+    # so they depend on the pixels without needing a model file. Every
+    # allocate_tensors() and invoke() is counted
+    instances = []
+
+    def __init__(self, model_path=None, num_threads=1):
+        self.input_shape = [1, *INPUT_SIZE, 3]
+        self.input = None
+        self.output = None
+        self.allocations = 0
+        self.invocations = 0
+        self.batch_sizes = []
+        FakeInterpreter.instances.append(self)
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': np.array(self.input_shape), 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'shape': np.array([self.input_shape[0], NUM_CLASSES]), 'dtype': np.float32,
+                 'quantization': (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.input_shape = list(shape)
+
+    def allocate_tensors(self):
+        self.allocations += 1
+        self.input = np.zeros(self.input_shape, dtype=np.float32)
+
+    def tensor(self, index):
+        return lambda: self.input
+
+    def invoke(self):
+        self.invocations += 1
+        self.batch_sizes.append(len(self.input))
+        slices = np.array_split(self.input.reshape(len(self.input), -1), NUM_CLASSES, axis=1)
+        logits = np.stack([s.mean(axis=1) for s in slices], axis=1) * 20.0
+        scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+        self.output = scores / scores.sum(axis=1, keepdims=True)
+
+    def get_tensor(self, index):
+        return self.output.copy()
+
+
+@pytest.fixture
+def fake_interpreter():
+    FakeInterpreter.instances.clear()
+    return FakeInterpreter
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    # FakeInterpreter ignores the model, the pool only needs the file to exist
+    path = tmp_path / 'model.tflite'
+    path.write_bytes(b'fake model')
+    return str(path)
+
+
+@pytest.fixture
+def twilio():
+    stub = FakeTwilio()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def webhook_app(monkeypatch, fake_interpreter, model_path, twilio):
+    # The app module with the model swapped for FakeInterpreter, fresh sessions
+    # and cache, and the Twilio REST client pointed at the stub
+    import app
+
+    monkeypatch.setenv('TWILIO_API_BASE_URL', twilio.url)
+    monkeypatch.setattr(app, 'twilio_client', None)
+    monkeypatch.setattr(app, 'interpreter_pool', InterpreterPool(model_path, interpreter_cls=fake_interpreter))
+    monkeypatch.setattr(app, 'batch_pool', InterpreterPool(model_path, interpreter_cls=fake_interpreter,
+                                                           batch_size=app.batch_pool.batch_size))
+    monkeypatch.setattr(app, 'batching_engine', None)
+    monkeypatch.setattr(app, 'calibration', Calibration())
+    monkeypatch.setattr(app, 'reply_dispatcher', None)
+    monkeypatch.setattr(app, 'user_sessions', SessionStore(open_store('memory://', name='sessions')))
+    monkeypatch.setattr(app, 'prediction_cache', PredictionCache(open_store('memory://', name='predictions'),
+                                                                 namespace=app.prediction_cache.namespace))
+    return app
+
+
+def make_leaf_jpeg(predicted_class, size=(320, 320)):
+    # A JPEG that FakeInterpreter scores as predicted_class with high
+    # confidence: bright in that class's band of rows, dark elsewhere
+    from io import BytesIO
+
+    from PIL import Image
+
+    pixels = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    rows = np.array_split(np.arange(size[1]), NUM_CLASSES)[predicted_class]
+    pixels[rows] = 255
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def leaf_jpeg():
+    return make_leaf_jpeg
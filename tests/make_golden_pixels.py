@@ -0,0 +1,80 @@
+# Writes the fixtures for tests/test_preprocessing.py: a few source photos and
+# the pixels preprocessing.load_pixels turns them into. The sources are only
+# generated once and committed, since re-encoding them with a different
+# libjpeg would change them; regenerate the golden PNGs after deliberately
+# changing preprocessing, and review the diff:
+#     python -m tests.make_golden_pixels            # golden PNGs only
+#     python -m tests.make_golden_pixels --sources  # sources as well
+import argparse
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from preprocessing import load_pixels
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# Source file -> golden file
+FIXTURES = {
+    'photo.jpg': 'photo.golden.png',
+    'rotated.jpg': 'rotated.golden.png',
+    'leaf.png': 'leaf.golden.png',
+}
+
+# EXIF tag for orientation; 6 means the camera was turned 90 degrees clockwise
+ORIENTATION = 0x0112
+
+
+def leaf_photo(width, height, seed):
+    # Smooth colour fields with a leaf-shaped ellipse and veins, so resampling
+    # is exercised on both gradients and sharp edges
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (height // 40 + 2, width // 40 + 2, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BILINEAR)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width * 0.2, height * 0.25, width * 0.8, height * 0.75), fill=(40, 140, 50))
+    for i in range(5):
+        x = width * (0.3 + 0.1 * i)
+        draw.line((width * 0.5, height * 0.5, x, height * 0.3), fill=(200, 220, 120), width=3)
+    return image
+
+
+def write_sources():
+    leaf_photo(640, 480, 0).save(os.path.join(GOLDEN_DIR, 'photo.jpg'), 'JPEG', quality=90)
+
+    exif = Image.Exif()
+    exif[ORIENTATION] = 6
+    leaf_photo(480, 360, 1).save(os.path.join(GOLDEN_DIR, 'rotated.jpg'), 'JPEG', quality=90, exif=exif)
+
+    leaf = leaf_photo(300, 260, 2).convert('RGBA')
+    alpha = Image.new('L', leaf.size, 0)
+    ImageDraw.Draw(alpha).ellipse((30, 30, 270, 230), fill=255)
+    leaf.putalpha(alpha)
+    buffer = io.BytesIO()
+    leaf.save(buffer, 'PNG')
+    with open(os.path.join(GOLDEN_DIR, 'leaf.png'), 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def write_golden():
+    for source, golden in FIXTURES.items():
+        pixels = load_pixels(os.path.join(GOLDEN_DIR, source))
+        Image.fromarray(pixels).save(os.path.join(GOLDEN_DIR, golden), 'PNG', optimize=True)
+        print(f"{source} -> {golden}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the golden pixel fixtures for the preprocessing tests')
+    parser.add_argument('--sources', action='store_true', help='Also regenerate the source images')
+    args = parser.parse_args()
+
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    if args.sources:
+        write_sources()
+    write_golden()
+
+
+if __name__ == '__main__':
+    main()
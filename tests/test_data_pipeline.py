@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+tf = pytest.importorskip('tensorflow')
+
+from data_pipeline import make_dataset  # noqa: E402
+
+NUM_CLASSES = 7
+PER_CLASS = 40
+
+
+@pytest.fixture
+def class_directories(tmp_path):
+    # <plant>/Train folders of small solid-colour PNGs, one colour per class
+    directories = []
+    for label in range(NUM_CLASSES):
+        directory = tmp_path / f'plant{label}' / 'Train'
+        directory.mkdir(parents=True)
+        for i in range(PER_CLASS):
+            Image.new('RGB', (8, 8), (label * 30, i, 0)).save(directory / f'{i:03d}.png')
+        directories.append(str(directory) + os.sep)
+    return directories
+
+
+# A buffer much smaller than the dataset stands in for a large training set
+@pytest.mark.parametrize('cache, shuffle_buffer', [(None, None), ('memory', None), ('memory', 32)])
+def test_batches_mix_classes(class_directories, cache, shuffle_buffer):
+    dataset = make_dataset(class_directories, 16, (8, 8), class_mode='sparse', cache=cache,
+                           shuffle_buffer=shuffle_buffer, seed=0)
+
+    for epoch in range(2):
+        for batch, (_, labels) in zip(range(3), dataset):
+            # A batch of 16 drawn from 7 evenly sized classes, not two or three
+            # neighbouring classes as a class-ordered cache produces
+            assert len(np.unique(labels.numpy())) >= 4, (epoch, batch, labels.numpy())
+
+
+def test_cached_epochs_cover_every_image_once(class_directories):
+    dataset = make_dataset(class_directories, 16, (8, 8), class_mode='sparse', cache='memory', seed=0)
+
+    epochs = []
+    for _ in range(2):
+        labels = np.concatenate([labels.numpy() for _, labels in dataset])
+        assert np.bincount(labels).tolist() == [PER_CLASS] * NUM_CLASSES
+        epochs.append(labels)
+    # Reshuffled every epoch
+    assert not np.array_equal(epochs[0], epochs[1])
@@ -0,0 +1,29 @@
+import pytest
+
+from dataset import list_split, output_names
+
+
+def test_output_names_keep_dotted_and_same_stem_files_apart():
+    names = output_names(['leaf.v1.jpg', 'leaf.v2.jpg', 'a.jpg', 'a.PNG', 'b.jpeg'], 'processed_', '.png')
+
+    assert names == {
+        'leaf.v1.jpg': 'processed_leaf.v1.png',
+        'leaf.v2.jpg': 'processed_leaf.v2.png',
+        'a.jpg': 'processed_a_jpg.png',
+        'a.PNG': 'processed_a_PNG.png',
+        'b.jpeg': 'processed_b.png',
+    }
+    assert len(set(names.values())) == len(names)
+
+
+def test_list_split_refuses_a_class_without_the_split(tmp_path):
+    for plant in ('aloe', 'guava'):
+        (tmp_path / plant / 'Train').mkdir(parents=True)
+        (tmp_path / plant / 'Train' / 'leaf.jpg').write_bytes(b'')
+    (tmp_path / 'aloe' / 'Test').mkdir()
+
+    filenames, labels, classes = list_split(str(tmp_path), 'Train')
+    assert classes == ['aloe', 'guava'] and labels.tolist() == [0, 1]
+
+    with pytest.raises(FileNotFoundError, match='guava/Test'):
+        list_split(str(tmp_path), 'Test')
@@ -0,0 +1,24 @@
+import importlib.util
+import sys
+import types
+
+import pytest
+
+
+def load_config():
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', 'gunicorn.conf.py')
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    return config
+
+
+@pytest.mark.parametrize('preload', [True, False])
+def test_when_ready_preloads_when_gunicorn_does(preload, monkeypatch):
+    # --preload on the command line only shows up in server.cfg
+    calls = []
+    monkeypatch.setitem(sys.modules, 'app', types.SimpleNamespace(preload=lambda: calls.append(True)))
+    server = types.SimpleNamespace(cfg=types.SimpleNamespace(preload_app=preload))
+
+    load_config().when_ready(server)
+
+    assert calls == ([True] if preload else [])
@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+
+from inference import BatchingEngine
+from interpreter_pool import InterpreterPool
+from preprocessing import INPUT_SIZE
+
+
+def random_inputs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.random((*INPUT_SIZE, 3), dtype=np.float32) for _ in range(count)]
+
+
+def test_batches_are_padded_to_a_fixed_size(fake_interpreter, model_path):
+    pool = InterpreterPool(model_path, interpreter_cls=fake_interpreter)
+    engine = BatchingEngine(pool, max_batch_size=4, max_wait_ms=0, batch_sizes=(4,))
+    images = random_inputs(7)
+
+    # Batches of whatever size the queue happens to hold
+    for count in (1, 3, 2, 4, 1):
+        results = engine.predict_many(images[:count])
+        assert len(results) == count
+
+    interpreter, = fake_interpreter.instances
+    assert set(interpreter.batch_sizes) == {4}
+    # Built at batch 1, resized to 4 once and never again
+    assert interpreter.allocations == 2
+
+
+def test_lone_requests_are_not_padded_by_default(fake_interpreter, model_path):
+    pool = InterpreterPool(model_path, interpreter_cls=fake_interpreter)
+    engine = BatchingEngine(pool, max_batch_size=8, max_wait_ms=0)
+    images = random_inputs(3, seed=3)
+
+    for image in images:
+        assert engine.predict(image).shape == (7,)
+
+    interpreter, = fake_interpreter.instances
+    assert engine.batch_sizes == (1, 8)
+    assert set(interpreter.batch_sizes) == {1}
+    assert interpreter.allocations == 1
+
+
+def test_padded_rows_do_not_change_results(fake_interpreter, model_path):
+    pool = InterpreterPool(model_path, interpreter_cls=fake_interpreter)
+    engine = BatchingEngine(pool, max_batch_size=8, max_wait_ms=0, batch_sizes=(1, 8))
+    images = random_inputs(3, seed=1)
+
+    with pool.acquire() as runner:
+        expected = [runner.run([image])[0] for image in images]
+    results = engine.predict_many(images)
+
+    np.testing.assert_allclose(np.stack(results), np.stack(expected), rtol=1e-6)
+    assert engine.batch_sizes == (1, 8)
+
+
+def test_concurrent_requests_share_padded_batches(fake_interpreter, model_path):
+    pool = InterpreterPool(model_path, interpreter_cls=fake_interpreter)
+    engine = BatchingEngine(pool, max_batch_size=8, max_wait_ms=20)
+    images = random_inputs(6, seed=2)
+    results = [None] * len(images)
+
+    def predict(i):
+        results[i] = engine.predict(images[i], timeout=10)
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(result is not None and result.shape == (7,) for result in results)
+    assert all(size in (1, 8) for interpreter in fake_interpreter.instances for size in interpreter.batch_sizes)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from interpreter_pool import InterpreterPool
+
+
+def test_warm_builds_every_interpreter(fake_interpreter, model_path):
+    pool = InterpreterPool(model_path, interpreter_cls=fake_interpreter, size=3)
+
+    assert not pool.is_warm()
+    assert pool.warm()
+    assert pool.available() == 3
+    assert all(interpreter.invocations == 1 for interpreter in fake_interpreter.instances)
+
+    # Nothing left to build the second time
+    assert pool.warm()
+    assert len(fake_interpreter.instances) == 3
+
+
+def test_warm_does_not_wait_for_interpreters_in_use(fake_interpreter, model_path):
+    pool = InterpreterPool(model_path, interpreter_cls=fake_interpreter, size=2)
+    results = []
+
+    with pool.acquire():
+        # Concurrent readiness probes while a request holds an interpreter
+        threads = [threading.Thread(target=lambda: results.append(pool.warm())) for _ in range(2)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        assert not any(thread.is_alive() for thread in threads)
+        assert time.perf_counter() - started < 1
+
+        assert results == [True, True]
+        assert pool.available() == 1
+        assert len(fake_interpreter.instances) == 2
+
+
+def test_warm_does_not_wait_for_another_warm(fake_interpreter, model_path):
+    building = threading.Event()
+    release = threading.Event()
+
+    class SlowInterpreter(fake_interpreter):
+        def allocate_tensors(self):
+            building.set()
+            release.wait(5)
+            super().allocate_tensors()
+
+    pool = InterpreterPool(model_path, interpreter_cls=SlowInterpreter)
+    first = threading.Thread(target=pool.warm)
+    first.start()
+    building.wait(5)
+
+    # Still loading: reported at once instead of waiting for the first probe
+    assert pool.warm(timeout=0) is False
+    release.set()
+    first.join(5)
+    assert pool.warm(timeout=0) is True
+
+
+def test_failed_build_gives_its_slot_back(fake_interpreter, model_path):
+    failures = [RuntimeError('no memory')]
+
+    class FlakyInterpreter(fake_interpreter):
+        def allocate_tensors(self):
+            if failures:
+                raise failures.pop()
+            super().allocate_tensors()
+
+    pool = InterpreterPool(model_path, interpreter_cls=FlakyInterpreter, size=2)
+    try:
+        pool.warm()
+    except RuntimeError:
+        pass
+    assert not pool.is_warm()
+    assert pool.warm()
+    assert pool.available() == 2
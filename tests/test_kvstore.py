@@ -0,0 +1,64 @@
+import fnmatch
+import threading
+import time
+
+import pytest
+
+from kvstore import RedisStore, SQLiteStore
+from session_store import SessionStore
+
+
+def test_sqlite_store_evicts_to_max_entries_under_concurrent_writes(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'kv.db'), max_entries=10)
+    threads_count, writes = 8, 64
+
+    def write(thread):
+        for i in range(writes):
+            if i % 2:
+                store.set(f'{thread}-{i}', i)
+            else:
+                store.update(f'{thread}-{i}', lambda current: (i, None))
+
+    threads = [threading.Thread(target=write, args=(t,)) for t in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The total is a multiple of the eviction interval, so the last write
+    # evicts down to max_entries, unless concurrent writes went uncounted
+    assert (threads_count * writes) % store.evict_interval == 0
+    assert len(store) == store.max_entries
+
+
+def test_sqlite_store_expires_entries(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'kv.db'), ttl=60)
+    store.set('short', 1, ttl=0.05)
+    store.set('long', 2)
+    time.sleep(0.1)
+
+    assert store.get('short') is None
+    assert store.get('long') == 2
+    assert store.update('short', lambda current: (None, current)) is None
+
+
+class FakeRedis:
+    # The few client calls RedisStore.__len__ makes, over a dict
+    def __init__(self, keys):
+        self.keys = keys
+
+    def dbsize(self):
+        return len(self.keys)
+
+    def scan_iter(self, match=None, count=None):
+        return (key for key in self.keys if match is None or fnmatch.fnmatchcase(key, match.replace('\\', '')))
+
+
+@pytest.mark.parametrize('prefix, expected', [('sessions:', 2), ('', 3)])
+def test_redis_store_len_counts_its_own_keys(prefix, expected):
+    store = RedisStore.__new__(RedisStore)
+    store.prefix, store.ttl = prefix, None
+    store.client = FakeRedis(['sessions:a', 'sessions:b', 'predictions:c'])
+
+    assert len(store) == expected
+    assert len(SessionStore(store)) == expected
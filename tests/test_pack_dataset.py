@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from dataset import list_split
+from pack_dataset import pack_dataset, packed_order
+
+NUM_CLASSES = 7
+PER_CLASS = 12
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    # <plant>/{Train,Validation,Test} folders of solid-colour PNGs
+    for label in range(NUM_CLASSES):
+        for split in ('Train', 'Validation', 'Test'):
+            directory = tmp_path / 'data' / f'plant{label}' / split
+            directory.mkdir(parents=True)
+            for i in range(PER_CLASS if split == 'Train' else 1):
+                Image.new('RGB', (32, 32), (label * 30, i * 10, 0)).save(directory / f'{i:03d}.png')
+    return str(tmp_path / 'data')
+
+
+def test_npy_shards_are_mixed_and_in_the_recorded_order(data_dir, tmp_path):
+    pack_dir = tmp_path / 'packed'
+    manifest = pack_dataset(data_dir, str(pack_dir), 'npy', shard_size=16, workers=1, seed=3)
+    assert manifest['seed'] == 3
+
+    shards = manifest['splits']['Train']['shards']
+    labels = [np.load(pack_dir / 'Train' / shard['labels']) for shard in shards]
+    # Class by class, a 16-image shard would hold two or three plants
+    assert all(len(np.unique(shard_labels)) >= 5 for shard_labels in labels[:-1])
+
+    # packed_order maps the shards back onto list_split's order
+    _, expected, _ = list_split(data_dir, 'Train')
+    order = packed_order(len(expected), manifest['seed'])
+    np.testing.assert_array_equal(np.concatenate(labels), expected[order])
+
+    images = np.concatenate([np.load(pack_dir / 'Train' / shard['images']) for shard in shards])
+    np.testing.assert_array_equal(images[:, 0, 0, 0], expected[order] * 30)
+
+
+def test_tfrecord_batches_are_mixed(data_dir, tmp_path):
+    pytest.importorskip('tensorflow')
+    from data_pipeline import make_packed_dataset
+
+    pack_dir = str(tmp_path / 'packed')
+    pack_dataset(data_dir, pack_dir, 'tfrecord', shard_size=16, workers=1)
+    # A buffer smaller than a shard, as the default 4096 is against 2048-image shards
+    dataset = make_packed_dataset(pack_dir, 'Train', 16, class_mode='sparse', shuffle_buffer=8, seed=0)
+
+    epochs = []
+    for _ in range(2):
+        batches = [labels.numpy() for _, labels in dataset]
+        assert all(len(np.unique(labels)) >= 4 for labels in batches[:-1])
+        epochs.append(np.concatenate(batches))
+        assert np.bincount(epochs[-1]).tolist() == [PER_CLASS] * NUM_CLASSES
+    assert not np.array_equal(epochs[0], epochs[1])
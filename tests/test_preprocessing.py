@@ -0,0 +1,76 @@
+# Pins preprocessing to fixed golden pixels (tests/golden, written by
+# tests/make_golden_pixels.py), so a change in how photos are decoded, rotated
+# or resized - a Pillow upgrade, a different filter, a new decoder - shows up
+# here instead of as a silent train/serve skew
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from preprocessing import INPUT_SIZE, load_batch, load_pixels, open_image, prepare_image, to_input_array
+from tests.make_golden_pixels import FIXTURES, GOLDEN_DIR
+
+
+def golden(source):
+    return np.asarray(Image.open(os.path.join(GOLDEN_DIR, FIXTURES[source])), dtype=np.uint8)
+
+
+def source_bytes(source):
+    with open(os.path.join(GOLDEN_DIR, source), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('source', sorted(FIXTURES))
+def test_load_pixels_matches_golden(source):
+    pixels = load_pixels(os.path.join(GOLDEN_DIR, source))
+
+    assert pixels.shape == (INPUT_SIZE[1], INPUT_SIZE[0], 3)
+    np.testing.assert_array_equal(pixels, golden(source))
+
+
+@pytest.mark.parametrize('source', sorted(FIXTURES))
+def test_webhook_path_matches_golden(source):
+    # What app.load_media and predict_image do with downloaded bytes
+    image = prepare_image(Image.open(io.BytesIO(source_bytes(source))))
+    expected = golden(source).astype(np.float32) / 255.0
+
+    np.testing.assert_array_equal(to_input_array(image), expected)
+    np.testing.assert_array_equal(to_input_array(open_image(source_bytes(source))), expected)
+
+
+def test_batch_path_matches_golden():
+    sources = sorted(FIXTURES)
+    batch = load_batch([os.path.join(GOLDEN_DIR, source) for source in sources])
+
+    np.testing.assert_array_equal(batch, np.stack([golden(s) for s in sources]).astype(np.float32) / 255.0)
+
+
+def test_exif_orientation_is_applied():
+    # rotated.jpg is stored landscape with orientation 6, so upright it is
+    # portrait: its golden pixels are the stored image turned 90 degrees
+    # clockwise, not the stored image squashed
+    stored = np.asarray(Image.open(os.path.join(GOLDEN_DIR, 'rotated.jpg')).transpose(Image.Transpose.ROTATE_270)
+                        .resize(INPUT_SIZE, Image.BICUBIC), dtype=np.float32)
+    squashed = np.asarray(Image.open(os.path.join(GOLDEN_DIR, 'rotated.jpg')).resize(INPUT_SIZE, Image.BICUBIC),
+                          dtype=np.float32)
+    pixels = golden('rotated.jpg').astype(np.float32)
+
+    assert np.abs(pixels - stored).mean() < np.abs(pixels - squashed).mean() / 4
+
+
+@pytest.mark.parametrize('source', sorted(FIXTURES))
+def test_training_pipeline_matches_golden(source, tmp_path):
+    # make_dataset as dr_roots.py trains with it, uncached and cached
+    pytest.importorskip('tensorflow')
+    from data_pipeline import make_dataset
+
+    directory = tmp_path / 'plant' / 'Train'
+    directory.mkdir(parents=True)
+    (directory / source).write_bytes(source_bytes(source))
+    expected = golden(source).astype(np.float32) / 255.0
+
+    for cache in (None, 'memory'):
+        (batch, _), = make_dataset([str(directory) + os.sep], 1, INPUT_SIZE, shuffle=False, cache=cache)
+        np.testing.assert_array_equal(batch.numpy()[0], expected)
@@ -0,0 +1,171 @@
+# Drives /webhook end to end against the local Twilio stub: media is downloaded
+# from it and asynchronous replies are sent to its Messages API
+import io
+
+import numpy as np
+from PIL import Image
+
+from async_replies import ReplyDispatcher
+
+USER = 'whatsapp:+15550001111'
+
+
+def post(client, **form):
+    response = client.post('/webhook', data={'From': USER, **form})
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def start_conversation(client):
+    # The first message of a session always gets the main menu
+    assert 'Welcome to Doctor Roots' in post(client, Body='hi')
+
+
+def test_image_is_answered_in_the_webhook_response(webhook_app, twilio, leaf_jpeg):
+    client = webhook_app.app.test_client()
+    start_conversation(client)
+
+    body = post(client, NumMedia='1', MediaUrl0=twilio.add_media('aloe.jpg', leaf_jpeg(0)))
+
+    assert 'confident this is Aloe barbadensis' in body
+    assert twilio.messages == []
+
+
+def test_async_reply_is_sent_through_the_messages_api(webhook_app, twilio, leaf_jpeg, monkeypatch):
+    dispatcher = ReplyDispatcher(webhook_app.process_media, webhook_app.send_message, max_workers=1)
+    monkeypatch.setattr(webhook_app, 'reply_dispatcher', dispatcher)
+    client = webhook_app.app.test_client()
+    start_conversation(client)
+
+    # The webhook only acknowledges, the answer arrives out of band
+    body = post(client, NumMedia='2', MediaUrl0=twilio.add_media('guava-1.jpg', leaf_jpeg(5)),
+                MediaUrl1=twilio.add_media('guava-2.jpg', leaf_jpeg(5)))
+    assert '<Message>' not in body
+
+    message, = twilio.wait_for_messages(1)
+    assert message['To'] == USER
+    assert message['From'] == webhook_app.TWILIO_PHONE_NUMBER
+    assert 'Going by your 2 photos' in message['Body']
+    assert 'Psidium guajava' in message['Body']
+    dispatcher.shutdown()
+    assert dispatcher.stats()['sent'] == 1
+
+
+def test_async_reply_reports_a_failed_download(webhook_app, twilio, monkeypatch):
+    dispatcher = ReplyDispatcher(webhook_app.process_media, webhook_app.send_message, max_workers=1)
+    monkeypatch.setattr(webhook_app, 'reply_dispatcher', dispatcher)
+    client = webhook_app.app.test_client()
+    start_conversation(client)
+
+    post(client, NumMedia='1', MediaUrl0=twilio.media_url('missing.jpg'))
+
+    message, = twilio.wait_for_messages(1)
+    assert 'Failed to download image. HTTP status code: 404' in message['Body']
+    dispatcher.shutdown()
+
+
+def test_ready_does_not_wait_for_busy_interpreters(webhook_app):
+    client = webhook_app.app.test_client()
+
+    with webhook_app.interpreter_pool.acquire():
+        response = client.get('/ready')
+
+    assert response.status_code == 200
+    assert response.get_json()['ready'] is True
+    assert response.get_json()['pool_available'] == 0
+
+
+def test_outcomes_tell_decode_failures_from_model_errors(webhook_app, twilio, leaf_jpeg, fake_interpreter,
+                                                         monkeypatch):
+    # A JPEG cut off half way is recognised as an image but cannot be decoded
+    data = leaf_jpeg(0)
+    outcome, reply = webhook_app.reply_to_media([twilio.add_media('truncated.jpg', data[:len(data) // 2])])
+    assert outcome == 'decode_failed'
+    assert "couldn't read that image" in reply
+
+    def fail(self):
+        raise RuntimeError('tensor arena exhausted')
+
+    monkeypatch.setattr(fake_interpreter, 'invoke', fail)
+    outcome, reply = webhook_app.reply_to_media([twilio.add_media('aloe.jpg', data)])
+    assert outcome == 'model_error'
+    assert 'tensor arena exhausted' in reply
+
+    # An input the model never saw is neither
+    outcome, _ = webhook_app.reply_to_media([twilio.add_media('notes.txt', b'plain text', 'text/plain')])
+    assert outcome == 'not_an_image'
+
+
+def test_tta_applies_to_every_photo_the_cache_sees(webhook_app, twilio, leaf_jpeg, fake_interpreter, monkeypatch):
+    # A band wide enough that every photo gets a second look
+    monkeypatch.setattr(webhook_app, 'TTA_ENABLED', True)
+    monkeypatch.setattr(webhook_app, 'TTA_MIN_CONFIDENCE', 0.0)
+    monkeypatch.setattr(webhook_app, 'TTA_MAX_CONFIDENCE', 1.01)
+    first, second = leaf_jpeg(3), leaf_jpeg(4)
+
+    # Predicted together as one multi-photo message, then cached
+    webhook_app.reply_to_media([twilio.add_media('mango-1.jpg', first), twilio.add_media('moringa.jpg', second)])
+    cached = webhook_app.prediction_cache.get(first)
+
+    # What a single-photo message would have computed for the same image
+    image = webhook_app.prepare_image(Image.open(io.BytesIO(first)))
+    monkeypatch.setattr(webhook_app, 'TTA_ENABLED', False)
+    plain = webhook_app.predict_image(image)
+    monkeypatch.setattr(webhook_app, 'TTA_ENABLED', True)
+    expected = webhook_app.predict_image(image)
+
+    assert not np.allclose(plain, expected)
+    np.testing.assert_allclose(cached, expected, rtol=1e-5)
+
+    # A later single-photo message is served that from the cache
+    invocations = sum(interpreter.invocations for interpreter in fake_interpreter.instances)
+    outcome, _ = webhook_app.reply_to_media([twilio.add_media('mango-2.jpg', first)])
+    assert outcome == 'identified'
+    assert sum(interpreter.invocations for interpreter in fake_interpreter.instances) == invocations
+
+
+def test_tta_views_run_as_one_batch_without_resizing(webhook_app, leaf_jpeg, fake_interpreter, monkeypatch):
+    monkeypatch.setattr(webhook_app, 'TTA_ENABLED', True)
+    monkeypatch.setattr(webhook_app, 'TTA_MIN_CONFIDENCE', 0.0)
+    monkeypatch.setattr(webhook_app, 'TTA_MAX_CONFIDENCE', 1.01)
+    image = webhook_app.prepare_image(Image.open(io.BytesIO(leaf_jpeg(2))))
+
+    for _ in range(3):
+        webhook_app.predict_image(image)
+
+    # One batch-1 invoke and one invoke for the other views per photo, each on
+    # an interpreter that keeps the size it was built at
+    single, views = fake_interpreter.instances
+    assert single.invocations == views.invocations == 3
+    assert set(single.batch_sizes) == {1}
+    assert set(views.batch_sizes) == {len(webhook_app.TTA_VIEWS) - 1}
+    assert single.allocations == 1
+    # Built at batch 1 and resized once, when it was built
+    assert views.allocations == 2
+
+
+def test_multi_photo_batches_leave_the_pool_at_batch_one(webhook_app, leaf_jpeg, fake_interpreter):
+    images = [webhook_app.prepare_image(Image.open(io.BytesIO(leaf_jpeg(k % 7)))) for k in range(8)]
+    expected = np.stack([webhook_app.predict_image(image) for image in images])
+
+    for count in (2, 8, 3):
+        np.testing.assert_allclose(webhook_app.predict_images(images[:count]), expected[:count], rtol=1e-5)
+    webhook_app.predict_image(images[0])
+
+    single, batched = fake_interpreter.instances
+    assert set(single.batch_sizes) == {1}
+    assert single.allocations == 1
+    # Chunks of the batch pool's size, the last one padded
+    assert batched.invocations == 1 + 2 + 1
+    assert set(batched.batch_sizes) == {webhook_app.batch_pool.batch_size}
+
+
+def test_reply_counts_photos_that_could_not_be_read(webhook_app, twilio, leaf_jpeg, caplog):
+    media_urls = [twilio.add_media('guava-1.jpg', leaf_jpeg(5)), twilio.media_url('missing.jpg'),
+                  twilio.add_media('guava-2.jpg', leaf_jpeg(5))]
+
+    outcome, reply = webhook_app.reply_to_media(media_urls)
+
+    assert outcome == 'identified'
+    assert "Going by 2 of your 3 photos (1 couldn't be read)" in reply
+    assert 'Skipped an attachment' in caplog.text
@@ -0,0 +1,121 @@
+# Local stand-in for the two Twilio endpoints the webhook talks to: the media
+# CDN that attachments are downloaded from, and the REST API's Messages
+# resource that asynchronous replies are sent through. Point the app at it with
+# TWILIO_API_BASE_URL=<stub.url> and MediaUrl0=<stub.media_url(name)>.
+#
+# It can also be run on its own to try the whole Twilio path offline, printing
+# every message the app sends:
+#     python -m tests.twilio_stub --port 8010 --image leaf.jpg
+#     TWILIO_API_BASE_URL=http://127.0.0.1:8010 ASYNC_REPLIES=true python app.py
+#     curl -d From=whatsapp:+15550001 -d NumMedia=1 \
+#          -d MediaUrl0=http://127.0.0.1:8010/media/leaf.jpg http://127.0.0.1:5000/webhook
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTwilio:
+    def __init__(self, port=0, verbose=False):
+        # name -> (content type, body) served under /media/<name>
+        self.media = {}
+        # Form fields of every message created through the REST API
+        self.messages = []
+        self._messages_changed = threading.Condition()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                if verbose:
+                    super().log_message(*args)
+
+            def do_GET(self):
+                name = self.path[len('/media/'):] if self.path.startswith('/media/') else None
+                if name not in server.media:
+                    self.send_error(404)
+                    return
+                content_type, data = server.media[name]
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                # /2010-04-01/Accounts/<sid>/Messages.json
+                parts = self.path.split('/')
+                if len(parts) != 5 or parts[2] != 'Accounts' or parts[4] != 'Messages.json':
+                    self.send_error(404)
+                    return
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                fields = {key: values[0] for key, values in parse_qs(body).items()}
+                if verbose:
+                    print(f"message to {fields.get('To')}:\n{fields.get('Body')}\n")
+
+                with server._messages_changed:
+                    server.messages.append(fields)
+                    sid = f"SM{len(server.messages):032d}"
+                    server._messages_changed.notify_all()
+
+                payload = json.dumps({'sid': sid, 'account_sid': parts[3], 'status': 'queued',
+                                      'to': fields.get('To'), 'from': fields.get('From'), 'body': fields.get('Body')})
+                self.send_response(201)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload.encode())
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def add_media(self, name, data, content_type='image/jpeg'):
+        self.media[name] = (content_type, data)
+        return self.media_url(name)
+
+    def media_url(self, name):
+        return f"{self.url}/media/{name}"
+
+    def wait_for_messages(self, count, timeout=10.0):
+        # The first count messages, waiting for background replies to arrive
+        deadline = time.monotonic() + timeout
+        with self._messages_changed:
+            while len(self.messages) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Only {len(self.messages)} of {count} messages arrived within {timeout}s")
+                self._messages_changed.wait(remaining)
+            return list(self.messages[:count])
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Twilio media host and Messages API')
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--image', action='append', default=[], help='Serve this file at /media/<basename>')
+    args = parser.parse_args()
+
+    stub = FakeTwilio(args.port, verbose=True)
+    for path in args.image:
+        with open(path, 'rb') as f:
+            print(f"serving {stub.add_media(os.path.basename(path), f.read())}")
+    print(f"Twilio stub on {stub.url}, set TWILIO_API_BASE_URL={stub.url}")
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.close()
+
+
+if __name__ == '__main__':
+    main()
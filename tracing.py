@@ -0,0 +1,66 @@
+# Per-request stage timings. A request starts a trace, the code it runs wraps
+# its stages (download, decode, inference, ...) in stage(), and the finished
+# trace is reported as a Server-Timing response header.
+#
+# When no trace has been started on the current thread, stage() only does one
+# thread-local lookup, so instrumented code costs next to nothing with tracing off
+import threading
+import time
+from contextlib import nullcontext
+
+_local = threading.local()
+
+
+def start_trace():
+    _local.trace = {}
+
+
+def end_trace():
+    # Return {stage: seconds} for the current thread's trace and stop tracing
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+class _StageTimer:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.trace[self.name] = self.trace.get(self.name, 0.0) + time.perf_counter() - self.started
+
+
+# Shared do-nothing context for untraced threads
+_NOT_TRACED = nullcontext()
+
+
+def stage(name):
+    # Time the enclosed block as one stage of the current trace. A stage entered
+    # more than once in a request accumulates
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NOT_TRACED
+    return _StageTimer(trace, name)
+
+
+def server_timing(trace):
+    # Format a trace as a Server-Timing header value, durations in milliseconds
+    return ', '.join(f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in trace.items())
+
+
+def parse_server_timing(header):
+    # {stage: milliseconds} from a Server-Timing header
+    timings = {}
+    for entry in header.split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                timings[name] = float(value)
+    return timings